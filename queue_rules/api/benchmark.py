@@ -0,0 +1,193 @@
+from time import perf_counter
+from typing import Iterable, List, NamedTuple
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from social_django.models import UserSocialAuth
+
+from data.models import Rule, SongSequenceMember, update_cached_song_sequences
+from worker.metrics import summarize
+
+
+API_BENCHMARK_USERNAME = "api-benchmark"
+
+# Every rule in the synthetic datasets, and every rule created or updated by the
+# benchmark, has this many songs in its sequence.
+SEQUENCE_LENGTH = 3
+
+DEFAULT_SIZES = (1, 10, 100, 1000)
+
+
+class Budget(NamedTuple):
+    queries: int
+    latency_ms: float
+
+
+# Query counts must not grow with the number of rules a user has. Create and update
+# scale with SEQUENCE_LENGTH instead, as every song gets its name looked up, and leave
+# room for one extra transaction statement depending on whether they run inside an
+# outer transaction (as in tests) or not.
+ENDPOINT_BUDGETS = {
+    "rule-list": Budget(queries=1, latency_ms=500),
+    "rule-detail": Budget(queries=1, latency_ms=50),
+    "rule-create": Budget(queries=6 + 3 * SEQUENCE_LENGTH, latency_ms=250),
+    "rule-update": Budget(queries=9 + 3 * SEQUENCE_LENGTH, latency_ms=250),
+    "service-status": Budget(queries=3, latency_ms=50),
+}
+
+
+def create_benchmark_user() -> User:
+    user = User.objects.create(username=API_BENCHMARK_USERNAME)
+    UserSocialAuth.objects.create(
+        user=user,
+        provider="spotify",
+        uid=API_BENCHMARK_USERNAME,
+        extra_data={"access_token": "access", "refresh_token": "refresh"},
+    )
+    return user
+
+
+def clear_benchmark_user() -> None:
+    User.objects.filter(username=API_BENCHMARK_USERNAME).delete()
+
+
+def seed_rules(user: User, num_rules: int) -> None:
+    """
+    Top the user up to num_rules rules, each with a SEQUENCE_LENGTH song sequence.
+    """
+    existing = user.rules.count()
+    Rule.objects.bulk_create(
+        [
+            Rule(owner=user, trigger_song_spotify_id=f"seeded{n}")
+            for n in range(existing, num_rules)
+        ]
+    )
+
+    new_rules = list(user.rules.filter(song_sequence=None))
+    SongSequenceMember.objects.bulk_create(
+        [
+            SongSequenceMember(
+                rule=rule,
+                song_spotify_id=f"{rule.trigger_song_spotify_id}-{n}",
+                sequence_number=n,
+            )
+            for rule in new_rules
+            for n in range(SEQUENCE_LENGTH)
+        ]
+    )
+    update_cached_song_sequences(
+        Rule.objects.filter(id__in=[rule.id for rule in new_rules])
+    )
+
+
+def _rule_payload(trigger_song_spotify_id: str) -> dict:
+    return {
+        "trigger_song_spotify_id": trigger_song_spotify_id,
+        "is_active": True,
+        "song_sequence": [
+            {"song_spotify_id": f"{trigger_song_spotify_id}-{n}", "sequence_number": n}
+            for n in range(SEQUENCE_LENGTH)
+        ],
+    }
+
+
+def _request(client: APIClient, endpoint: str, rule: Rule, key: str):
+    if endpoint == "rule-list":
+        return client.get(reverse("rule-list"))
+    elif endpoint == "rule-detail":
+        return client.get(reverse("rule-detail", kwargs={"pk": rule.id}))
+    elif endpoint == "rule-create":
+        return client.post(
+            reverse("rule-create"), _rule_payload(f"created{key}"), format="json"
+        )
+    elif endpoint == "rule-update":
+        return client.put(
+            reverse("rule-detail", kwargs={"pk": rule.id}),
+            _rule_payload(rule.trigger_song_spotify_id),
+            format="json",
+        )
+    elif endpoint == "service-status":
+        return client.get(reverse("service-status"))
+
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+def measure_endpoint(user: User, endpoint: str, size: int, repeat: int) -> dict:
+    """
+    Hit the endpoint repeat times as the user and return the worst query count seen
+    along with a summary of the latencies, checked against the endpoint's budget.
+    """
+    client = APIClient()
+    client.force_authenticate(user)
+    budget = ENDPOINT_BUDGETS[endpoint]
+    rule = user.rules.earliest("created")
+
+    queries = 0
+    latencies = []
+    for iteration in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            started = perf_counter()
+            response = _request(client, endpoint, rule, f"{size}-{iteration}")
+            latencies.append((perf_counter() - started) * 1000)
+
+        # The service status is critical whenever queuerd isn't running, which is a
+        # perfectly good response to benchmark.
+        if response.status_code >= 400 and endpoint != "service-status":
+            raise RuntimeError(
+                f"{endpoint} returned {response.status_code}: {response.content}"
+            )
+
+        queries = max(queries, len(context))
+
+    latency = summarize(latencies)
+    return {
+        "endpoint": endpoint,
+        "size": size,
+        "queries": queries,
+        "latency_ms": latency,
+        "budget": budget._asdict(),
+        "within_budget": (
+            queries <= budget.queries and latency["p50"] <= budget.latency_ms
+        ),
+    }
+
+
+def run_benchmarks(
+    user: User,
+    sizes: Iterable[int] = DEFAULT_SIZES,
+    endpoints: Iterable[str] = tuple(ENDPOINT_BUDGETS),
+    repeat: int = 5,
+) -> List[dict]:
+    results = []
+    for size in sorted(sizes):
+        seed_rules(user, size)
+        for endpoint in endpoints:
+            results.append(measure_endpoint(user, endpoint, size, repeat))
+
+    return results
+
+
+def format_results(results: List[dict]) -> str:
+    lines = [
+        "{:<16}{:>8}{:>10}{:>10}{:>10}{:>10}{:>12}  {}".format(
+            "Endpoint", "rules", "queries", "p50 ms", "p95 ms", "max ms", "budget", ""
+        )
+    ]
+    for result in results:
+        lines.append(
+            "{:<16}{:>8}{:>10}{:>10.1f}{:>10.1f}{:>10.1f}{:>12}  {}".format(
+                result["endpoint"],
+                result["size"],
+                result["queries"],
+                result["latency_ms"]["p50"],
+                result["latency_ms"]["p95"],
+                result["latency_ms"]["max"],
+                "{queries}q/{latency_ms:g}ms".format(**result["budget"]),
+                "ok" if result["within_budget"] else "OVER BUDGET",
+            )
+        )
+
+    return "\n".join(lines)
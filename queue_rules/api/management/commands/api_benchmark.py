@@ -0,0 +1,92 @@
+import json
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from api.benchmark import (
+    clear_benchmark_user,
+    create_benchmark_user,
+    DEFAULT_SIZES,
+    ENDPOINT_BUDGETS,
+    format_results,
+    run_benchmarks,
+)
+from worker.benchmark import FakeSpotifyServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Exercises the API endpoints against synthetic datasets of increasing size, "
+        "reporting query counts and latencies and failing if any endpoint goes over "
+        "its budget. Writes to the configured database, so point it at a disposable "
+        "one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-s",
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=list(DEFAULT_SIZES),
+            help="Numbers of rules the benchmark user has for each round.",
+        )
+        parser.add_argument(
+            "-e",
+            "--endpoints",
+            nargs="+",
+            choices=list(ENDPOINT_BUDGETS),
+            default=list(ENDPOINT_BUDGETS),
+        )
+        parser.add_argument(
+            "-r",
+            "--repeat",
+            type=int,
+            default=5,
+            help="Requests made to each endpoint for each dataset size.",
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            default=False,
+            help="Print the report as JSON for comparing across commits.",
+        )
+
+    def handle(self, *args, **options):
+        # Don't log every critical service status response.
+        logging.getLogger("django.request").setLevel(logging.CRITICAL)
+
+        clear_benchmark_user()
+        user = create_benchmark_user()
+
+        # Creating and updating rules looks up track names on Spotify.
+        server = FakeSpotifyServer([])
+
+        try:
+            with server, override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+                SPOTIFY_API_PREFIX=f"{server.url}/v1/",
+                SPOTIFY_TOKEN_URL=f"{server.url}/api/token",
+            ):
+                results = run_benchmarks(
+                    user,
+                    sizes=options["sizes"],
+                    endpoints=options["endpoints"],
+                    repeat=options["repeat"],
+                )
+        finally:
+            clear_benchmark_user()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.stdout.write(format_results(results))
+
+        over_budget = [r for r in results if not r["within_budget"]]
+        if over_budget:
+            raise CommandError(
+                "Over budget: "
+                + ", ".join(f"{r['endpoint']} ({r['size']} rules)" for r in over_budget)
+            )
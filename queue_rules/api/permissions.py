@@ -3,4 +3,5 @@ from rest_framework import permissions
 
 class IsOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.owner == request.user
+        # Compare IDs so checking ownership doesn't cost a query for the owner.
+        return obj.owner_id == request.user.id
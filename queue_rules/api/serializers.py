@@ -1,13 +1,35 @@
 from django.db.transaction import atomic
 from rest_framework import serializers
 
-from data.models import Rule, SongSequenceMember
+from data.models import (
+    Rule,
+    RuleHourlyActivity,
+    SongSequenceMember,
+    UserHourlyActivity,
+)
+
+
+ACTIVITY_FIELDS = [
+    "hour",
+    "applied",
+    "skipped_not_playing",
+    "skipped_too_early",
+    "skipped_applied_recently",
+    "errors",
+]
+
+
+class SongSequenceSerializer(serializers.ListSerializer):
+    def get_attribute(self, instance):
+        # Rules carry a copy of their sequence, so there's usually no need to query it.
+        return instance.get_song_sequence()
 
 
 class SongSequenceMemberSerializer(serializers.ModelSerializer):
     class Meta:
         model = SongSequenceMember
         fields = ["id", "name", "song_spotify_id", "sequence_number"]
+        list_serializer_class = SongSequenceSerializer
 
 
 class RuleSerializer(serializers.ModelSerializer):
@@ -31,11 +53,15 @@ class RuleSerializer(serializers.ModelSerializer):
             rule = Rule.objects.create(**validated_data)
             rule.set_name()
 
+            members = []
             for sequence_member_data in sequence_data:
                 member = SongSequenceMember.objects.create(
                     rule=rule, **sequence_member_data
                 )
                 member.set_name()
+                members.append(member)
+
+            rule.update_cached_song_sequence(members)
 
         return rule
 
@@ -53,10 +79,26 @@ class RuleSerializer(serializers.ModelSerializer):
 
             SongSequenceMember.objects.filter(rule=instance).delete()
 
+            members = []
             for sequence_member_data in sequence_data:
                 member = SongSequenceMember.objects.create(
                     rule=instance, **sequence_member_data
                 )
                 member.set_name()
+                members.append(member)
+
+            instance.update_cached_song_sequence(members)
 
         return instance
+
+
+class RuleActivitySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RuleHourlyActivity
+        fields = ACTIVITY_FIELDS
+
+
+class UserActivitySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserHourlyActivity
+        fields = ACTIVITY_FIELDS
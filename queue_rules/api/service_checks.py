@@ -4,7 +4,9 @@ from typing import Tuple
 
 from django.conf import settings
 
-from data.models import LastCheckLog, UserLock
+from data.circuit_breaker import CLOSED
+from data.models import CircuitBreakerState, LastCheckLog, UserLock
+from data.user_utils import spotify_breaker
 
 
 # For each of these checks, return a tuple of whether the check passed and a dict with
@@ -36,6 +38,26 @@ def stale_locks() -> Tuple[bool, dict]:
     return result, {"num_stale_locks": num_stale_locks}
 
 
+def spotify_circuit_breaker() -> Tuple[bool, dict]:
+    breaker = CircuitBreakerState.objects.filter(name=spotify_breaker.name).first()
+    if breaker is None:  # It's never changed state.
+        return True, {"circuit_breaker_state": CLOSED, "circuit_breaker_changed": None}
+
+    # Each change is saved by the queuerd process whose breaker it was, and an open
+    # breaker probes at least every max open time, saving the outcome. If nothing's
+    # been saved for longer, that process has gone and its state went with it.
+    now = datetime.now(timezone.utc)
+    stale_after = timedelta(
+        seconds=settings.SPOTIFY_BREAKER_MAX_OPEN_TIME + settings.QUEUERD_CHECK_INTERVAL
+    )
+
+    result = breaker.state == CLOSED or now - breaker.changed > stale_after
+    return result, {
+        "circuit_breaker_state": breaker.state,
+        "circuit_breaker_changed": breaker.changed,
+    }
+
+
 class ServiceStatus(Enum):
     CRITICAL = 0
     WARNING = 1
@@ -45,7 +67,7 @@ class ServiceStatus(Enum):
 # For each of the above checks, register them as critical checks (indicators that the
 # service is down) or warning checks (indicators that the service has degraded).
 CRITICAL_CHECKS = (most_recent_check,)
-WARNING_CHECKS = (stale_locks,)
+WARNING_CHECKS = (stale_locks, spotify_circuit_breaker)
 
 
 def run_checks() -> Tuple[ServiceStatus, dict]:
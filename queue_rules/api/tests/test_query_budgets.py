@@ -0,0 +1,163 @@
+import json
+import logging
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import override_settings, TestCase
+
+from api import benchmark
+from worker.benchmark import FakeSpotifyServer
+
+
+class TestQueryBudgets(TestCase):
+    """
+    Query counts for each endpoint must stay within budget, and mustn't grow with the
+    number of rules the user has.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeSpotifyServer([]).start()
+        cls.settings_override = override_settings(
+            SPOTIFY_API_PREFIX=f"{cls.server.url}/v1/",
+            SPOTIFY_TOKEN_URL=f"{cls.server.url}/api/token",
+        )
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        # Squelch logging for these tests.
+        logging.disable(logging.CRITICAL)
+
+        self.test_user = benchmark.create_benchmark_user()
+
+    def tearDown(self):
+        # Reenable logging when tests finish.
+        logging.disable(logging.NOTSET)
+
+    def assertWithinQueryBudget(self, endpoint):
+        for size in (1, 25):
+            benchmark.seed_rules(self.test_user, size)
+            result = benchmark.measure_endpoint(self.test_user, endpoint, size, 2)
+
+            self.assertLessEqual(
+                result["queries"],
+                benchmark.ENDPOINT_BUDGETS[endpoint].queries,
+                f"{endpoint} with {size} rules",
+            )
+
+    def test_rule_list(self):
+        self.assertWithinQueryBudget("rule-list")
+
+    def test_rule_detail(self):
+        self.assertWithinQueryBudget("rule-detail")
+
+    def test_rule_create(self):
+        self.assertWithinQueryBudget("rule-create")
+
+    def test_rule_update(self):
+        self.assertWithinQueryBudget("rule-update")
+
+    def test_service_status(self):
+        self.assertWithinQueryBudget("service-status")
+
+
+class TestSeedRules(TestCase):
+    def test_top_up(self):
+        test_user = benchmark.create_benchmark_user()
+
+        benchmark.seed_rules(test_user, 2)
+        benchmark.seed_rules(test_user, 5)
+
+        self.assertEqual(test_user.rules.count(), 5)
+        for rule in test_user.rules.all():
+            self.assertEqual(rule.song_sequence.count(), benchmark.SEQUENCE_LENGTH)
+
+
+class TestMeasureEndpoint(TestCase):
+    def setUp(self):
+        self.test_user = benchmark.create_benchmark_user()
+        benchmark.seed_rules(self.test_user, 1)
+
+    def test_over_budget(self):
+        with mock.patch.dict(
+            benchmark.ENDPOINT_BUDGETS,
+            {"rule-list": benchmark.Budget(queries=0, latency_ms=1000)},
+        ):
+            result = benchmark.measure_endpoint(self.test_user, "rule-list", 1, 1)
+
+        self.assertEqual(result["queries"], 1)
+        self.assertFalse(result["within_budget"])
+
+    @mock.patch("api.benchmark._request")
+    def test_error_response(self, mock_request):
+        mock_request.return_value.status_code = 500
+
+        with self.assertRaises(RuntimeError):
+            benchmark.measure_endpoint(self.test_user, "rule-list", 1, 1)
+
+    def test_unknown_endpoint(self):
+        with self.assertRaises(ValueError):
+            benchmark._request(None, "foo", None, "")
+
+
+class TestCommand(TestCase):
+    def setUp(self):
+        # Squelch logging for these tests.
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        # Reenable logging when tests finish.
+        logging.disable(logging.NOTSET)
+
+    def test_report(self):
+        out = StringIO()
+
+        call_command("api_benchmark", sizes=[1, 5], repeat=1, stdout=out)
+
+        self.assertIn("rule-list", out.getvalue())
+        self.assertNotIn("OVER BUDGET", out.getvalue())
+        self.assertFalse(
+            benchmark.User.objects.filter(
+                username=benchmark.API_BENCHMARK_USERNAME
+            ).exists()
+        )
+
+    def test_json_report(self):
+        out = StringIO()
+
+        call_command(
+            "api_benchmark",
+            sizes=[1],
+            endpoints=["rule-list", "service-status"],
+            repeat=1,
+            json=True,
+            stdout=out,
+        )
+
+        results = json.loads(out.getvalue())
+        self.assertEqual(
+            [result["endpoint"] for result in results], ["rule-list", "service-status"]
+        )
+
+    def test_over_budget(self):
+        with mock.patch.dict(
+            benchmark.ENDPOINT_BUDGETS,
+            {"rule-list": benchmark.Budget(queries=0, latency_ms=1000)},
+        ):
+            with self.assertRaises(CommandError):
+                call_command(
+                    "api_benchmark",
+                    sizes=[1],
+                    endpoints=["rule-list"],
+                    repeat=1,
+                    stdout=StringIO(),
+                )
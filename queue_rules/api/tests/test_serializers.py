@@ -166,6 +166,19 @@ class TestRuleSerializer(TestCase):
         self.assertEqual(sequence[1].song_spotify_id, "baz")
         self.assertEqual(sequence[1].sequence_number, 2)
 
+        # The rule's copy of its sequence matches the members.
+        self.assertEqual(
+            [
+                (member.id, member.song_spotify_id, member.sequence_number)
+                for member in rule.get_song_sequence()
+            ],
+            list(
+                rule.song_sequence.order_by("sequence_number").values_list(
+                    "id", "song_spotify_id", "sequence_number"
+                )
+            ),
+        )
+
     @mock.patch("api.serializers.SongSequenceMember.set_name")
     @mock.patch("api.serializers.Rule.set_name")
     @freeze_time("2020-08-15")
@@ -245,6 +258,19 @@ class TestRuleSerializer(TestCase):
         self.assertEqual(sequence[0].sequence_number, 100)
         mock_ssm_set_name.assert_called_once()
 
+        # The rule's copy of its sequence matches the members.
+        self.assertEqual(
+            [
+                (member.id, member.song_spotify_id, member.sequence_number)
+                for member in rule.get_song_sequence()
+            ],
+            list(
+                rule.song_sequence.order_by("sequence_number").values_list(
+                    "id", "song_spotify_id", "sequence_number"
+                )
+            ),
+        )
+
     @mock.patch("api.serializers.SongSequenceMember.set_name")
     @mock.patch("api.serializers.Rule.set_name")
     @freeze_time("2020-08-15")
@@ -2,11 +2,11 @@ from datetime import datetime, timedelta, timezone
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import SimpleTestCase, TestCase
+from django.test import override_settings, SimpleTestCase, TestCase
 from freezegun import freeze_time
 
 from api import service_checks
-from data.models import LastCheckLog, UserLock
+from data.models import CircuitBreakerState, LastCheckLog, UserLock
 
 
 class TestMostRecentCheck(TestCase):
@@ -150,6 +150,67 @@ class TestStaleLocks(TestCase):
         )
 
 
+class TestSpotifyCircuitBreaker(TestCase):
+    def test_never_changed(self):
+        check_pass, check_info = service_checks.spotify_circuit_breaker()
+
+        self.assertTrue(check_pass)
+        self.assertEqual(
+            {
+                "circuit_breaker_state": "closed",
+                "circuit_breaker_changed": None,
+            },
+            check_info,
+        )
+
+    @freeze_time("2020-11-01")
+    def test_closed(self):
+        CircuitBreakerState.objects.create(name="spotify", state="closed")
+
+        check_pass, check_info = service_checks.spotify_circuit_breaker()
+
+        self.assertTrue(check_pass)
+        self.assertEqual(
+            {
+                "circuit_breaker_state": "closed",
+                "circuit_breaker_changed": datetime(2020, 11, 1, tzinfo=timezone.utc),
+            },
+            check_info,
+        )
+
+    def test_open(self):
+        CircuitBreakerState.objects.create(name="spotify", state="open")
+
+        check_pass, check_info = service_checks.spotify_circuit_breaker()
+
+        self.assertFalse(check_pass)
+        self.assertEqual(check_info["circuit_breaker_state"], "open")
+
+    def test_half_open(self):
+        CircuitBreakerState.objects.create(name="spotify", state="half_open")
+
+        check_pass, check_info = service_checks.spotify_circuit_breaker()
+
+        self.assertFalse(check_pass)
+        self.assertEqual(check_info["circuit_breaker_state"], "half_open")
+
+    @override_settings(SPOTIFY_BREAKER_MAX_OPEN_TIME=300, QUEUERD_CHECK_INTERVAL=5)
+    def test_stale(self):
+        with freeze_time("2020-11-01 00:00:00"):
+            CircuitBreakerState.objects.create(name="spotify", state="open")
+
+        # Still open as far as anyone knows.
+        with freeze_time("2020-11-01 00:05:05"):
+            check_pass, _ = service_checks.spotify_circuit_breaker()
+        self.assertFalse(check_pass)
+
+        # Whichever queuerd opened it has gone without saying otherwise.
+        with freeze_time("2020-11-01 00:05:06"):
+            check_pass, check_info = service_checks.spotify_circuit_breaker()
+        self.assertTrue(check_pass)
+        self.assertEqual(check_info["circuit_breaker_state"], "open")
+
+
 class TestRunChecks(SimpleTestCase):
     def test_no_checks(self):
         service_checks.CRITICAL_CHECKS = ()
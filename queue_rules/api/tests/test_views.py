@@ -1,15 +1,28 @@
+import asyncio
+import json
 import logging
+import time
 from unittest import mock
 
+from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import SimpleTestCase, TestCase
+from django.test import Client, SimpleTestCase, TestCase
 from django.urls import reverse
 from freezegun import freeze_time
 from rest_framework.test import APIClient
 
 from api.service_checks import ServiceStatus
+from data.accounts import delete_account
 from data.exceptions import BadSpotifyTrackID
-from data.models import Rule, SongSequenceMember
+from data.models import (
+    AccountDeletion,
+    Rule,
+    RuleHourlyActivity,
+    SongSequenceMember,
+    UserHourlyActivity,
+)
+from queue_rules.asgi import application
 
 
 class TestRuleList(TestCase):
@@ -464,7 +477,9 @@ class TestDeleteAccount(TestCase):
         # Reenable logging when tests finish.
         logging.disable(logging.NOTSET)
 
-    def test_delete(self):
+    @mock.patch("data.accounts.delete_account_in_background")
+    @mock.patch("data.accounts.transaction.on_commit", side_effect=lambda func: func())
+    def test_delete(self, mock_on_commit, mock_delete_account_in_background):
         client = APIClient()
         client.force_login(self.test_user)
 
@@ -475,10 +490,16 @@ class TestDeleteAccount(TestCase):
         response = client.get(reverse("rule-list"))
         self.assertEqual(response.status_code, 403)
 
-        # Make sure that the user was deleted.
-        self.assertEqual(User.objects.count(), 0)
+        # Make sure that the user was deactivated straight away, and the rest left
+        # to the background.
+        self.test_user.refresh_from_db()
+        self.assertFalse(self.test_user.is_active)
+        self.assertTrue(AccountDeletion.objects.filter(user=self.test_user).exists())
+        mock_delete_account_in_background.assert_called_once_with(self.test_user.id)
 
-        # Also test that the user's data was deleted.
+        # Which deletes the user's data.
+        delete_account(self.test_user.id)
+        self.assertEqual(User.objects.count(), 0)
         self.assertEqual(Rule.objects.count(), 0)
         self.assertEqual(SongSequenceMember.objects.count(), 0)
 
@@ -487,3 +508,229 @@ class TestDeleteAccount(TestCase):
 
         response = client.post(reverse("delete-account"))
         self.assertEqual(response.status_code, 403)
+
+
+class TestExportRules(TestCase):
+    def setUp(self):
+        # Squelch logging for these tests.
+        logging.disable(logging.CRITICAL)
+
+        self.test_user_1 = User.objects.create(username="test1")
+        self.test_user_2 = User.objects.create(username="test2")
+
+        self.test_rule_1 = Rule.objects.create(
+            owner=self.test_user_1, trigger_song_spotify_id="foo"
+        )
+        self.test_rule_2 = Rule.objects.create(
+            owner=self.test_user_2, trigger_song_spotify_id="bar"
+        )
+        self.test_rule_3 = Rule.objects.create(
+            owner=self.test_user_1, trigger_song_spotify_id="baz"
+        )
+
+    def tearDown(self):
+        # Reenable logging when tests finish.
+        logging.disable(logging.NOTSET)
+
+    def test_ndjson(self):
+        client = APIClient()
+        client.force_authenticate(self.test_user_1)
+
+        response = client.get(reverse("rule-export"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="rules.ndjson"'
+        )
+
+        # Only the user's own rules.
+        content = b"".join(response.streaming_content).decode()
+        self.assertEqual(
+            [json.loads(line)["id"] for line in content.splitlines()],
+            [self.test_rule_1.id, self.test_rule_3.id],
+        )
+
+    def test_csv(self):
+        client = APIClient()
+        client.force_authenticate(self.test_user_2)
+
+        response = client.get(reverse("rule-export"), {"type": "csv"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="rules.csv"'
+        )
+
+        content = b"".join(response.streaming_content).decode()
+        self.assertEqual(len(content.splitlines()), 2)
+        self.assertTrue(content.startswith("rule_id,owner,"))
+
+    def test_unknown_type(self):
+        client = APIClient()
+        client.force_authenticate(self.test_user_1)
+
+        response = client.get(reverse("rule-export"), {"type": "xml"})
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch("api.views.export_rules")
+    def test_asgi(self, mock_export_rules):
+        def slow_lines(rules, export_format):
+            for rule in rules.order_by("id"):
+                time.sleep(0.1)
+                yield f"{rule.id}\n"
+
+        mock_export_rules.side_effect = slow_lines
+        client = Client()
+        client.force_login(self.test_user_1)
+        session_cookie = client.cookies[settings.SESSION_COOKIE_NAME]
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": reverse("rule-export"),
+            "query_string": b"",
+            "headers": [
+                (b"host", b"testserver"),
+                (b"cookie", f"{session_cookie.key}={session_cookie.value}".encode()),
+            ],
+        }
+        messages = []
+        ticks = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        async def get():
+            # Through Django's ASGI handler, like uvicorn, with the event loop
+            # running something else alongside.
+            request = asyncio.ensure_future(application(scope, receive, send))
+            while not request.done():
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+            await request
+
+        async_to_sync(get)()
+
+        self.assertEqual(messages[0]["status"], 200)
+        self.assertIn(
+            (b"Content-Disposition", b'attachment; filename="rules.ndjson"'),
+            messages[0]["headers"],
+        )
+        self.assertEqual(
+            b"".join(message.get("body", b"") for message in messages[1:]).decode(),
+            f"{self.test_rule_1.id}\n{self.test_rule_3.id}\n",
+        )
+        # The event loop was never held up waiting on the export.
+        self.assertLess(max(b - a for a, b in zip(ticks, ticks[1:])), 0.1)
+
+    def test_unauthenticated(self):
+        client = APIClient()
+        response = client.get(reverse("rule-export"))
+        self.assertEqual(response.status_code, 403)
+
+
+@freeze_time("2020-09-01T12:30:00Z")
+class TestActivity(TestCase):
+    def setUp(self):
+        # Squelch logging for these tests.
+        logging.disable(logging.CRITICAL)
+
+        self.test_user_1 = User.objects.create(username="test1")
+        self.test_user_2 = User.objects.create(username="test2")
+        self.test_rule_1 = Rule.objects.create(
+            owner=self.test_user_1, trigger_song_spotify_id="foo"
+        )
+        self.test_rule_2 = Rule.objects.create(
+            owner=self.test_user_2, trigger_song_spotify_id="foo"
+        )
+
+        for hour in ("2020-08-31T12:00:00Z", "2020-09-01T11:00:00Z"):
+            RuleHourlyActivity.objects.create(
+                rule=self.test_rule_1, hour=hour, applied=2, skipped_too_early=5
+            )
+            UserHourlyActivity.objects.create(
+                user=self.test_user_1, hour=hour, applied=3, errors=1
+            )
+        RuleHourlyActivity.objects.create(
+            rule=self.test_rule_2, hour="2020-09-01T12:00:00Z", applied=1
+        )
+
+    def tearDown(self):
+        # Reenable logging when tests finish.
+        logging.disable(logging.NOTSET)
+
+    def test_rule_activity(self):
+        client = APIClient()
+        client.force_authenticate(self.test_user_1)
+
+        # The rule, then its activity.
+        with self.assertNumQueries(2):
+            response = client.get(
+                reverse("rule-activity", kwargs={"pk": self.test_rule_1.id})
+            )
+        self.assertEqual(response.status_code, 200)
+        # Only the last 24 hours by default.
+        self.assertEqual(
+            response.json(),
+            [
+                {
+                    "hour": "2020-09-01T11:00:00Z",
+                    "applied": 2,
+                    "skipped_not_playing": 0,
+                    "skipped_too_early": 5,
+                    "skipped_applied_recently": 0,
+                    "errors": 0,
+                }
+            ],
+        )
+
+        response = client.get(
+            reverse("rule-activity", kwargs={"pk": self.test_rule_1.id}),
+            {"hours": 25},
+        )
+        self.assertEqual(
+            [row["hour"] for row in response.json()],
+            ["2020-08-31T12:00:00Z", "2020-09-01T11:00:00Z"],
+        )
+
+    def test_someone_elses_rule_activity(self):
+        client = APIClient()
+        client.force_authenticate(self.test_user_1)
+
+        response = client.get(
+            reverse("rule-activity", kwargs={"pk": self.test_rule_2.id})
+        )
+        self.assertEqual(response.status_code, 403)
+
+        response = client.get(reverse("rule-activity", kwargs={"pk": 12345}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_user_activity(self):
+        client = APIClient()
+        client.force_authenticate(self.test_user_1)
+
+        response = client.get(reverse("activity"), {"hours": 48})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row["hour"], row["applied"], row["errors"]) for row in response.json()],
+            [("2020-08-31T12:00:00Z", 3, 1), ("2020-09-01T11:00:00Z", 3, 1)],
+        )
+
+        client.force_authenticate(self.test_user_2)
+        response = client.get(reverse("activity"))
+        self.assertEqual(response.json(), [])
+
+    def test_bad_hours(self):
+        client = APIClient()
+        client.force_authenticate(self.test_user_1)
+
+        for hours in ("0", "soon", "100000"):
+            response = client.get(reverse("activity"), {"hours": hours})
+            self.assertEqual(response.status_code, 400)
+
+    def test_unauthenticated(self):
+        client = APIClient()
+        response = client.get(reverse("activity"))
+        self.assertEqual(response.status_code, 403)
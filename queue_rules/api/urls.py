@@ -6,7 +6,12 @@ from . import views
 urlpatterns = [
     path("rules/", views.RuleList.as_view(), name="rule-list"),
     path("rules/create/", views.CreateRule.as_view(), name="rule-create"),
+    path("rules/export/", views.ExportRules.as_view(), name="rule-export"),
     path("rules/<int:pk>/", views.RuleDetail.as_view(), name="rule-detail"),
+    path(
+        "rules/<int:pk>/activity/", views.RuleActivity.as_view(), name="rule-activity"
+    ),
+    path("activity/", views.UserActivity.as_view(), name="activity"),
     path("service_status/", views.ServiceStatus.as_view(), name="service-status"),
     path("logout/", views.Logout.as_view(), name="logout"),
     path("delete_account/", views.DeleteAccount.as_view(), name="delete-account"),
@@ -1,28 +1,85 @@
+from datetime import datetime, timedelta, timezone
+
 from django.db import IntegrityError
 from django.contrib.auth import logout
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, StreamingHttpResponse
 from rest_framework.exceptions import ValidationError
 from rest_framework import generics
 from rest_framework import permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from data.accounts import request_account_deletion
 from data.exceptions import BadSpotifyTrackID
+from data.export import CONTENT_TYPES, export_rules, spool, stream
 from data.models import Rule
 
 from .permissions import IsOwner
-from .serializers import RuleSerializer
+from .serializers import (
+    RuleActivitySerializer,
+    RuleSerializer,
+    UserActivitySerializer,
+)
 from .service_checks import run_checks
 from .service_checks import ServiceStatus as StatusEnum
 
 
+DEFAULT_ACTIVITY_HOURS = 24
+# Rows are kept for QUEUERD_ACTIVITY_RETENTION_DAYS, 90 by default.
+MAX_ACTIVITY_HOURS = 24 * 90
+
+
+def _activity_since(request) -> datetime:
+    # The start of the earliest of the last few hours, counting this one.
+    hours = request.query_params.get("hours", DEFAULT_ACTIVITY_HOURS)
+    try:
+        hours = int(hours)
+    except ValueError:
+        hours = 0
+    if not 1 <= hours <= MAX_ACTIVITY_HOURS:
+        raise ValidationError(
+            f"hours must be a whole number from 1 to {MAX_ACTIVITY_HOURS}."
+        )
+
+    now = datetime.now(timezone.utc)
+    return now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+
+
 class RuleList(generics.ListAPIView):
     serializer_class = RuleSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_queryset(self):
+        # Each rule carries a copy of its song sequence, so this is a single query.
         return Rule.objects.filter(owner=self.request.user).order_by("-created")
 
 
+class ExportRules(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request):
+        # Not "format", which picks how DRF renders its own responses.
+        export_format = request.query_params.get("type", "ndjson")
+        if export_format not in CONTENT_TYPES:
+            raise ValidationError(
+                f"Can't export rules as {export_format}, only as "
+                f"{' or '.join(CONTENT_TYPES)}."
+            )
+
+        rules = Rule.objects.filter(owner=request.user)
+        lines = export_rules(rules, export_format)
+        content_type = CONTENT_TYPES[export_format]
+        if isinstance(request._request, ASGIRequest):
+            # Streaming responses would be generated in the event loop.
+            response = FileResponse(spool(lines), content_type=content_type)
+        else:
+            response = StreamingHttpResponse(stream(lines), content_type=content_type)
+        filename = f"rules.{export_format}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
 class RuleDetail(generics.RetrieveUpdateDestroyAPIView):
     queryset = Rule.objects.all()
     serializer_class = RuleSerializer
@@ -35,6 +92,33 @@ class RuleDetail(generics.RetrieveUpdateDestroyAPIView):
             raise ValidationError(e.message)
 
 
+class RuleActivity(generics.ListAPIView):
+    serializer_class = RuleActivitySerializer
+    permission_classes = (permissions.IsAuthenticated, IsOwner)
+
+    def get_queryset(self):
+        # Only the rule's owner gets to see it, as with RuleDetail.
+        rule = generics.get_object_or_404(
+            Rule.objects.only("id", "owner_id"), pk=self.kwargs["pk"]
+        )
+        self.check_object_permissions(self.request, rule)
+        return rule.hourly_activity.filter(
+            hour__gte=_activity_since(self.request)
+        ).order_by("hour")
+
+
+class UserActivity(generics.ListAPIView):
+    # The same, added up across all of the user's rules, with errors counting all of
+    # the user's failed checks.
+    serializer_class = UserActivitySerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        return self.request.user.hourly_rule_activity.filter(
+            hour__gte=_activity_since(self.request)
+        ).order_by("hour")
+
+
 class CreateRule(generics.CreateAPIView):
     serializer_class = RuleSerializer
     permission_classes = (permissions.IsAuthenticated,)
@@ -78,6 +162,7 @@ class DeleteAccount(APIView):
     def delete(self, request):
         user = request.user
         logout(request)
-        user.delete()
+        # Their data's deleted in the background, as there can be a lot of it.
+        request_account_deletion(user)
 
         return Response()
@@ -0,0 +1,77 @@
+import logging
+from threading import Thread
+
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models import QuerySet
+
+from .models import AccountDeletion, Rule, RuleHourlyActivity, SongSequenceMember
+
+
+logger = logging.getLogger(__name__)
+
+# How many rows are deleted by each DELETE statement.
+DELETE_BATCH_SIZE = 1000
+
+
+def request_account_deletion(user: User) -> None:
+    """
+    Deactivate the user straight away, so they can't log in and queuerd stops checking
+    them, then delete their data on a thread of its own once that's committed. Anyone
+    whose deletion doesn't finish is picked up by the delete_pending_accounts command.
+    """
+    with transaction.atomic():
+        User.objects.filter(id=user.id).update(is_active=False)
+        AccountDeletion.objects.get_or_create(user=user)
+
+    user_id = user.id
+    transaction.on_commit(lambda: delete_account_in_background(user_id))
+
+
+def delete_account_in_background(user_id: int) -> Thread:
+    thread = Thread(
+        target=_delete_account_in_thread,
+        args=(user_id,),
+        name=f"delete-account-{user_id}",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def _delete_account_in_thread(user_id: int) -> None:
+    try:
+        delete_account(user_id)
+    except Exception:
+        # The delete_pending_accounts command will have another go.
+        logger.exception(f"Couldn't delete user {user_id}'s account")
+    finally:
+        # Any connections were this thread's alone.
+        connections.close_all()
+
+
+def _delete_in_batches(queryset: QuerySet, batch_size: int) -> None:
+    while True:
+        ids = list(queryset.order_by("id").values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return
+
+        # A plain DELETE by primary key, each batch in its own short transaction,
+        # rather than having the collector load every row first.
+        queryset.model.objects.filter(id__in=ids)._raw_delete(queryset.db)
+
+
+def delete_account(user_id: int, batch_size: int = DELETE_BATCH_SIZE) -> None:
+    """
+    Delete a user and everything of theirs. The bulk of it, their rules, song
+    sequences and rules' hourly activity, goes in batches, leaving the collector a
+    handful of rows to cascade through when the user itself is deleted.
+    """
+    _delete_in_batches(
+        SongSequenceMember.objects.filter(rule__owner_id=user_id), batch_size
+    )
+    _delete_in_batches(
+        RuleHourlyActivity.objects.filter(rule__owner_id=user_id), batch_size
+    )
+    _delete_in_batches(Rule.objects.filter(owner_id=user_id), batch_size)
+    User.objects.filter(id=user_id).delete()
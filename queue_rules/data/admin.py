@@ -1,25 +1,172 @@
+import json
+
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.db.transaction import atomic
+from django.utils.functional import cached_property
+
+from .models import (
+    AccountDeletion,
+    CircuitBreakerState,
+    LastCheckLog,
+    Rule,
+    RuleHourlyActivity,
+    SongSequenceMember,
+    update_cached_song_sequences,
+    UserHourlyActivity,
+    UserLock,
+)
+
+
+# Past this many rows, the admin shows PostgreSQL's estimate of how many are in an
+# unfiltered table instead of counting them.
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+def _estimate_count(queryset: QuerySet) -> int:
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]["Plan Rows"]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts small tables and filtered results exactly, but trusts the query planner's
+    estimate for big unfiltered ones, rather than counting millions of rows for every
+    page. Estimates for filtered results can be far off, so they're never used.
+    """
+
+    @cached_property
+    def count(self) -> int:
+        queryset = self.object_list
+        if (
+            connections[queryset.db].vendor == "postgresql"
+            and not queryset.query.where
+        ):
+            estimate = _estimate_count(queryset)
+            if estimate > ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+
+        return super().count
+
 
-from .models import LastCheckLog, Rule, SongSequenceMember, UserLock
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Don't count the whole table as well as what's been filtered.
+    show_full_result_count = False
 
 
-class RuleAdmin(admin.ModelAdmin):
+class RuleAdmin(LargeTableAdmin):
     list_display = ("name", "owner", "trigger_song_spotify_id", "is_active")
+    list_select_related = ("owner",)
+    list_filter = ("is_active",)
+    raw_id_fields = ("owner",)
+    # Exact matches, so they can use the username and unique_song_owner indexes.
+    search_fields = ("=owner__username", "=trigger_song_spotify_id")
 
 
-class SongSequenceMemberAdmin(admin.ModelAdmin):
+class SongSequenceMemberAdmin(LargeTableAdmin):
     list_display = ("name", "rule", "sequence_number", "song_spotify_id")
+    list_select_related = ("rule",)
+    raw_id_fields = ("rule",)
+    search_fields = ("=rule__owner__username",)
 
+    # Keep the rules' copies of their sequences up to date.
+    def save_model(self, request, obj, form, change):
+        rule_ids = {obj.rule_id}
+        if change and "rule" in form.changed_data:
+            rule_ids.add(form.initial["rule"])
 
-class LastCheckLogAdmin(admin.ModelAdmin):
+        with atomic():
+            super().save_model(request, obj, form, change)
+            update_cached_song_sequences(Rule.objects.filter(id__in=rule_ids))
+
+    def delete_model(self, request, obj):
+        with atomic():
+            super().delete_model(request, obj)
+            update_cached_song_sequences(Rule.objects.filter(id=obj.rule_id))
+
+    def delete_queryset(self, request, queryset):
+        with atomic():
+            rule_ids = set(queryset.values_list("rule_id", flat=True))
+            super().delete_queryset(request, queryset)
+            update_cached_song_sequences(Rule.objects.filter(id__in=rule_ids))
+
+
+class LastCheckLogAdmin(LargeTableAdmin):
     list_display = ("user", "last_checked")
+    list_select_related = ("user",)
+    list_filter = ("last_checked",)
+    ordering = ("-last_checked",)
+    raw_id_fields = ("user",)
+    search_fields = ("=user__username",)
+
+
+class CircuitBreakerStateAdmin(admin.ModelAdmin):
+    list_display = ("name", "state", "changed")
 
 
-class UserLockAdmin(admin.ModelAdmin):
+class UserLockAdmin(LargeTableAdmin):
     list_display = ("user", "created")
+    list_select_related = ("user",)
+    list_filter = ("created",)
+    ordering = ("created",)
+    raw_id_fields = ("user",)
+    search_fields = ("=user__username",)
+
+
+class AccountDeletionAdmin(admin.ModelAdmin):
+    list_display = ("user", "requested")
+    list_select_related = ("user",)
+    raw_id_fields = ("user",)
+
+
+class RuleHourlyActivityAdmin(LargeTableAdmin):
+    list_display = (
+        "rule",
+        "hour",
+        "applied",
+        "skipped_not_playing",
+        "skipped_too_early",
+        "skipped_applied_recently",
+        "errors",
+    )
+    list_select_related = ("rule",)
+    list_filter = ("hour",)
+    ordering = ("-hour",)
+    raw_id_fields = ("rule",)
+    search_fields = ("=rule__owner__username",)
+
+
+class UserHourlyActivityAdmin(LargeTableAdmin):
+    list_display = (
+        "user",
+        "hour",
+        "applied",
+        "skipped_not_playing",
+        "skipped_too_early",
+        "skipped_applied_recently",
+        "errors",
+    )
+    list_select_related = ("user",)
+    list_filter = ("hour",)
+    ordering = ("-hour",)
+    raw_id_fields = ("user",)
+    search_fields = ("=user__username",)
 
 
 admin.site.register(Rule, RuleAdmin)
 admin.site.register(SongSequenceMember, SongSequenceMemberAdmin)
 admin.site.register(UserLock, UserLockAdmin)
 admin.site.register(LastCheckLog, LastCheckLogAdmin)
+admin.site.register(CircuitBreakerState, CircuitBreakerStateAdmin)
+admin.site.register(AccountDeletion, AccountDeletionAdmin)
+admin.site.register(RuleHourlyActivity, RuleHourlyActivityAdmin)
+admin.site.register(UserHourlyActivity, UserHourlyActivityAdmin)
@@ -0,0 +1,172 @@
+import logging
+import random
+from collections import deque
+from threading import Lock
+from time import monotonic
+from typing import Callable, Optional
+
+from .exceptions import CircuitOpen
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Fails calls to a service fast while it's down or struggling, instead of letting
+    every caller wait on it.
+
+    The breaker opens once at least failure_rate of the last window calls either
+    failed or took longer than slow_call seconds. While it's open, calls are refused
+    until a jittered open_time has passed, then a single probe call is let through.
+    If the probe goes well the breaker closes, and otherwise it opens again for twice
+    as long, up to max_open_time.
+
+    on_change, if given, is called with the breaker's name and new state whenever it
+    changes.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int,
+        failure_rate: float,
+        slow_call: float,
+        open_time: float,
+        max_open_time: float,
+        on_change: Optional[Callable[[str, str], None]] = None,
+    ):
+        self.name = name
+        self.window = window
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.open_time = open_time
+        self.max_open_time = max_open_time
+        self.on_change = on_change
+
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._state = CLOSED
+            self._outcomes = deque(maxlen=self.window)
+            self._delay = self.open_time
+            self._probe_at = 0.0
+
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def seconds_until_probe(self) -> float:
+        """
+        How long until the breaker lets a call through again, which is 0 if it's
+        closed.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return 0.0
+            return max(self._probe_at - monotonic(), 0.0)
+
+    def before_call(self) -> bool:
+        """
+        Call before each call to the service. Raises CircuitOpen if the breaker's
+        refusing calls, and otherwise returns whether this call is the probe.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return False
+
+            now = monotonic()
+            if now < self._probe_at:
+                raise CircuitOpen(self.name)
+
+            # Should the probe go missing, another is let through after the same
+            # delay again.
+            self._probe_at = now + self._jittered(self._delay)
+            changed = self._set_state(HALF_OPEN)
+
+        self._notify(changed)
+        return True
+
+    def after_call(self, probe: bool, seconds: float, failed: bool) -> None:
+        """
+        Call after each call that before_call() let through, with how long it took
+        and whether it failed in a way that counts against the service.
+        """
+        failed = failed or seconds > self.slow_call
+
+        with self._lock:
+            if probe:
+                changed = self._after_probe(failed)
+            elif self._state == CLOSED:
+                changed = self._after_closed_call(failed)
+            else:
+                # Calls that started before the breaker opened don't tell us anything
+                # the probe won't.
+                changed = False
+
+        self._notify(changed)
+
+    def cancel_call(self, probe: bool) -> None:
+        """
+        Call instead of after_call() when a call that was let through never reached
+        the service, so if it was the probe, another can go straight away.
+        """
+        with self._lock:
+            if probe and self._state == HALF_OPEN:
+                self._probe_at = monotonic()
+
+    def _after_closed_call(self, failed: bool) -> bool:
+        self._outcomes.append(failed)
+        if len(self._outcomes) < self.window:
+            return False
+        if sum(self._outcomes) < self.failure_rate * len(self._outcomes):
+            return False
+
+        self._open(self.open_time)
+        return True
+
+    def _after_probe(self, failed: bool) -> bool:
+        if self._state != HALF_OPEN:
+            return False
+
+        if failed:
+            self._open(min(self._delay * 2, self.max_open_time))
+            return True
+
+        self._outcomes.clear()
+        self._delay = self.open_time
+        return self._set_state(CLOSED)
+
+    def _open(self, delay: float) -> None:
+        self._delay = delay
+        self._probe_at = monotonic() + self._jittered(delay)
+        self._set_state(OPEN)
+
+    def _jittered(self, delay: float) -> float:
+        # So several processes with their own breakers don't all probe at once.
+        return delay * random.uniform(0.5, 1.0)
+
+    def _set_state(self, state: str) -> bool:
+        changed = state != self._state
+        self._state = state
+        return changed
+
+    def _notify(self, changed: bool) -> None:
+        if not changed:
+            return
+
+        state = self.state()
+        if state == OPEN:
+            logger.warning(f"The {self.name} circuit breaker opened")
+        else:
+            logger.info(f"The {self.name} circuit breaker is {state}")
+
+        if self.on_change is not None:
+            self.on_change(self.name, state)
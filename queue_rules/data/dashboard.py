@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+
+from .models import UserLock, WorkerRollup
+
+
+ROLLUP_FIELDS = (
+    "checks",
+    "rules_applied",
+    "check_errors",
+    "check_timeouts",
+    "shed_checks",
+    "backlog",
+)
+
+
+def _minute(moment: datetime) -> datetime:
+    return moment.replace(second=0, microsecond=0)
+
+
+def worker_series(now: datetime, minutes: int) -> List[dict]:
+    """
+    queuerd's activity for each of the last few minutes, added up across workers, from
+    a single query over WorkerRollup's recent rows. Minutes without any rollups are
+    zeroes.
+    """
+    start = _minute(now) - timedelta(minutes=minutes - 1)
+    rows = {
+        row["minute"]: row
+        for row in WorkerRollup.objects.filter(minute__gte=start)
+        .values("minute")
+        .annotate(**{field: Sum(field) for field in ROLLUP_FIELDS})
+    }
+
+    series = []
+    for n in range(minutes):
+        minute = start + timedelta(minutes=n)
+        row = rows.get(minute, dict.fromkeys(ROLLUP_FIELDS, 0))
+        # The current minute isn't over yet.
+        seconds = min((now - minute).total_seconds(), 60) or 1
+        failures = row["check_errors"] + row["check_timeouts"]
+        attempts = row["checks"] + failures
+
+        series.append(
+            {
+                "minute": minute,
+                "reported": minute in rows,
+                "checks_per_second": row["checks"] / seconds,
+                "rules_applied": row["rules_applied"],
+                "error_rate": failures / attempts if attempts else 0.0,
+                "shed_checks": row["shed_checks"],
+                "backlog": row["backlog"],
+            }
+        )
+
+    return series
+
+
+def lock_ages(now: datetime) -> List[dict]:
+    """
+    How many users are locked, by how long they've been locked, in one query. Anyone
+    locked for longer than STALE_LOCK_THRESHOLD is probably stuck.
+    """
+    threshold = settings.STALE_LOCK_THRESHOLD
+    stale = timedelta(seconds=threshold)
+    buckets = (
+        (f"Under {threshold}s", now - stale, None),
+        (f"{threshold}s to {threshold * 4}s", now - stale * 4, now - stale),
+        (f"Over {threshold * 4}s", None, now - stale * 4),
+    )
+
+    filters = {}
+    for n, (_, after, before) in enumerate(buckets):
+        q = Q()
+        if after is not None:
+            q &= Q(created__gt=after)
+        if before is not None:
+            q &= Q(created__lte=before)
+        filters[f"bucket{n}"] = Count("id", filter=q)
+
+    counts = UserLock.objects.aggregate(**filters)
+    return [
+        {"age": label, "count": counts[f"bucket{n}"]}
+        for n, (label, _, _) in enumerate(buckets)
+    ]
+
+
+def dashboard(now: Optional[datetime] = None, minutes: int = 60) -> dict:
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    series = worker_series(now, minutes)
+    # Workers may not have written anything yet this minute.
+    latest = next((row for row in reversed(series) if row["reported"]), series[-1])
+    return {
+        "now": now,
+        "series": series,
+        "locks": lock_ages(now),
+        "latest": latest,
+        "peak_checks_per_second": max(row["checks_per_second"] for row in series),
+    }
@@ -1,5 +1,21 @@
+from requests.exceptions import Timeout
+
+
 class BadSpotifyTrackID(Exception):
     def __init__(self, track_id):
         self.track_id = track_id
         self.message = f"Bad Spotify track ID: {track_id}"
         super().__init__(self.message)
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name):
+        self.name = name
+        self.message = f"The {name} circuit breaker is open"
+        super().__init__(self.message)
+
+
+class DeadlineExceeded(Timeout):
+    def __init__(self):
+        self.message = "Ran out of time for calls to Spotify"
+        super().__init__(self.message)
@@ -0,0 +1,151 @@
+import csv
+import json
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+from typing import IO, Iterator, List, Optional
+
+from django.db.models import QuerySet
+
+from .models import Rule
+
+
+# How many rules are read from the database at a time.
+EXPORT_CHUNK_SIZE = 1000
+
+# Lines are sent on in chunks of about this many characters.
+EXPORT_CHUNK_LENGTH = 64 * 1024
+
+# Spooled exports bigger than this many bytes are written to disk instead of memory.
+SPOOL_MAX_SIZE = 1024 * 1024
+
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# One CSV row per song in a rule's sequence, or a row without a song for rules with
+# no sequence.
+CSV_COLUMNS = (
+    "rule_id",
+    "owner",
+    "name",
+    "trigger_song_spotify_id",
+    "is_active",
+    "created",
+    "last_applied",
+    "sequence_number",
+    "song_spotify_id",
+    "song_name",
+)
+
+
+class _Line:
+    # Lets a csv.writer hand back the rows it formats instead of writing them out.
+    def write(self, value: str) -> str:
+        return value
+
+
+def _isoformat(moment: Optional[datetime]) -> Optional[str]:
+    return None if moment is None else moment.isoformat()
+
+
+def _rule_record(rule: Rule) -> dict:
+    return {
+        "id": rule.id,
+        "owner": rule.owner.username,
+        "name": rule.name,
+        "trigger_song_spotify_id": rule.trigger_song_spotify_id,
+        "is_active": rule.is_active,
+        "created": _isoformat(rule.created),
+        "last_applied": _isoformat(rule.last_applied),
+        "song_sequence": [
+            {
+                "name": song.name,
+                "song_spotify_id": song.song_spotify_id,
+                "sequence_number": song.sequence_number,
+            }
+            for song in rule.get_song_sequence()
+        ],
+    }
+
+
+def _csv_rows(record: dict) -> Iterator[list]:
+    rule = [
+        record["id"],
+        record["owner"],
+        record["name"],
+        record["trigger_song_spotify_id"],
+        record["is_active"],
+        record["created"],
+        record["last_applied"],
+    ]
+
+    if not record["song_sequence"]:
+        yield rule + ["", "", ""]
+    for song in record["song_sequence"]:
+        yield rule + [song["sequence_number"], song["song_spotify_id"], song["name"]]
+
+
+def export_rules(rules: QuerySet, export_format: str) -> Iterator[str]:
+    """
+    The rules and their song sequences as NDJSON (one rule per line) or CSV, for
+    writing out as it's generated. Rules are read EXPORT_CHUNK_SIZE at a time, so
+    memory use doesn't grow with how many there are.
+    """
+    if export_format not in CONTENT_TYPES:
+        raise ValueError(f"Unknown export format: {export_format}")
+
+    # Rules come with a copy of their song sequences, so there's nothing to prefetch.
+    rules = (
+        rules.select_related("owner")
+        .order_by("id")
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+    if export_format == "ndjson":
+        for rule in rules:
+            yield json.dumps(_rule_record(rule)) + "\n"
+        return
+
+    writer = csv.writer(_Line())
+    yield writer.writerow(CSV_COLUMNS)
+    for rule in rules:
+        for row in _csv_rows(_rule_record(rule)):
+            yield writer.writerow(row)
+
+
+def _chunked(lines: Iterator[str]) -> Iterator[str]:
+    chunk: List[str] = []
+    length = 0
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= EXPORT_CHUNK_LENGTH:
+            yield "".join(chunk)
+            chunk = []
+            length = 0
+
+    if chunk:
+        yield "".join(chunk)
+
+
+def stream(lines: Iterator[str]) -> Iterator[str]:
+    """
+    Chunks of lines from export_rules(), for a StreamingHttpResponse under WSGI.
+    """
+    return _chunked(lines)
+
+
+def spool(lines: Iterator[str]) -> IO[bytes]:
+    """
+    Lines from export_rules() written out to a temporary file, rewound for a
+    FileResponse. Under ASGI, Django iterates streaming responses in the event loop,
+    where waiting on the database would hold up every other request, so exports are
+    generated on the view's thread instead, and the event loop only has to read back
+    the file. It's kept in memory up to SPOOL_MAX_SIZE bytes.
+    """
+    spooled = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    for chunk in _chunked(lines):
+        spooled.write(chunk.encode())
+    spooled.seek(0)
+    return spooled
@@ -1,10 +1,14 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 from data.models import UserLock
 
 
+# How many locks are deleted by each DELETE statement.
+DEFAULT_BATCH_SIZE = 1000
+
+
 def _parse_datetime(string_dt: str) -> datetime:
     return datetime.strptime(string_dt, "%Y-%m-%dT%H:%M:%S").replace(
         tzinfo=timezone.utc
@@ -12,10 +16,14 @@ def _parse_datetime(string_dt: str) -> datetime:
 
 
 class Command(BaseCommand):
-    help = "Clear existing user locks."
+    help = (
+        "Clear existing user locks. Locks are deleted a batch at a time, each batch "
+        "in its own short statement, so it's safe to run while queuerd is running."
+    )
 
     def add_arguments(self, parser):
-        parser.add_argument(
+        created = parser.add_mutually_exclusive_group()
+        created.add_argument(
             "-c",
             "--created-before",
             action="store",
@@ -26,13 +34,70 @@ class Command(BaseCommand):
                 "the format YYYY-MM-DDTHH:MM:SS (such as 2020-09-04T19:18:09)"
             ),
         )
+        created.add_argument(
+            "-o",
+            "--older-than-seconds",
+            action="store",
+            type=int,
+            default=None,
+            help="Only delete locks created more than this many seconds ago.",
+        )
+        parser.add_argument(
+            "-b",
+            "--batch-size",
+            action="store",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help=f"How many locks to delete at a time (default {DEFAULT_BATCH_SIZE}).",
+        )
+        parser.add_argument(
+            "-n",
+            "--dry-run",
+            action="store_true",
+            default=False,
+            help="Count the locks that would be deleted without deleting them.",
+        )
 
     def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
         locks = UserLock.objects.all()
 
         created_upper_bound = options["created_before"]
+        if options["older_than_seconds"] is not None:
+            created_upper_bound = datetime.now(timezone.utc) - timedelta(
+                seconds=options["older_than_seconds"]
+            )
         if created_upper_bound is not None:
             locks = locks.filter(created__lt=created_upper_bound)
 
-        num_deleted = locks.delete()[0]
+        # Leave locks taken after we started to the workers that took them, or with
+        # queuerd running this might never finish.
+        last_id = locks.order_by("-id").values_list("id", flat=True).first()
+        locks = locks.filter(id__lte=last_id or 0)
+
+        num_locks = locks.count()
+        if options["dry_run"]:
+            self.stdout.write(f"Would delete {num_locks} locks.")
+            return
+
+        num_deleted = 0
+        while True:
+            # Workers delete their own locks as they go, so rather than paging through
+            # the table, keep taking the oldest locks that are still there.
+            lock_ids = list(
+                locks.order_by("id").values_list("id", flat=True)[
+                    : options["batch_size"]
+                ]
+            )
+            if not lock_ids:
+                break
+
+            # A plain DELETE by primary key, without loading the locks first. Locks
+            # have nothing depending on them, so there's nothing to collect.
+            num_deleted += locks.filter(id__in=lock_ids)._raw_delete(locks.db)
+            if num_locks > options["batch_size"]:
+                self.stdout.write(f"Deleted {num_deleted} of {num_locks} locks...")
+
         self.stdout.write(f"Deleted {num_deleted} locks.")
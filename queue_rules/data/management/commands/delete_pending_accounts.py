@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from data.accounts import DELETE_BATCH_SIZE, delete_account
+from data.models import AccountDeletion
+
+
+class Command(BaseCommand):
+    help = (
+        "Finish deleting the accounts of users who've asked for it, in case deleting "
+        "one in the background was interrupted. Safe to run while queuerd is running."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-b",
+            "--batch-size",
+            action="store",
+            type=int,
+            default=DELETE_BATCH_SIZE,
+            help=f"How many rows to delete at a time (default {DELETE_BATCH_SIZE}).",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        user_ids = list(
+            AccountDeletion.objects.order_by("requested").values_list(
+                "user_id", flat=True
+            )
+        )
+        for user_id in user_ids:
+            delete_account(user_id, options["batch_size"])
+            self.stdout.write(f"Deleted user {user_id}'s account.")
+
+        self.stdout.write(f"Deleted {len(user_ids)} accounts.")
@@ -0,0 +1,52 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from data.export import CONTENT_TYPES, export_rules
+from data.models import Rule
+
+
+class Command(BaseCommand):
+    help = (
+        "Export rules and their song sequences as NDJSON or CSV, for backups and "
+        "users' data export requests. Rules are streamed out a chunk at a time, so "
+        "it's fine to export every rule there is."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-u",
+            "--user",
+            action="store",
+            default=None,
+            help="Only export this user's rules, by username.",
+        )
+        parser.add_argument(
+            "-f",
+            "--format",
+            action="store",
+            choices=sorted(CONTENT_TYPES),
+            default="ndjson",
+        )
+        parser.add_argument(
+            "-o",
+            "--output",
+            action="store",
+            default=None,
+            help="File to write the export to, instead of standard output.",
+        )
+
+    def handle(self, *args, **options):
+        rules = Rule.objects.all()
+        if options["user"] is not None:
+            if not User.objects.filter(username=options["user"]).exists():
+                raise CommandError(f"There's no user called {options['user']}.")
+            rules = rules.filter(owner__username=options["user"])
+
+        lines = export_rules(rules, options["format"])
+        if options["output"] is None:
+            for line in lines:
+                self.stdout.write(line, ending="")
+            return
+
+        with open(options["output"], "w", newline="") as f:
+            f.writelines(lines)
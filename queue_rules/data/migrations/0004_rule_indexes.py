@@ -0,0 +1,39 @@
+# Generated by Django 3.1 on 2026-10-19 14:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("data", "0003_circuitbreakerstate"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="rule",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["owner", "trigger_song_spotify_id"],
+                name="rule_active_owner_trigger",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="rule",
+            index=models.Index(fields=["owner", "-created"], name="rule_owner_created"),
+        ),
+        # The owner index goes once the indexes that replace it are in.
+        migrations.AlterField(
+            model_name="rule",
+            name="owner",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="rules",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.1 on 2026-10-19 14:14
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def cache_song_sequences(apps, schema_editor):
+    Rule = apps.get_model("data", "Rule")
+
+    last_id = 0
+    while True:
+        rules = list(
+            Rule.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .prefetch_related("song_sequence")[:BATCH_SIZE]
+        )
+        if not rules:
+            break
+
+        for rule in rules:
+            rule.cached_song_sequence = [
+                {
+                    "id": member.id,
+                    "name": member.name,
+                    "song_spotify_id": member.song_spotify_id,
+                    "sequence_number": member.sequence_number,
+                }
+                for member in sorted(
+                    rule.song_sequence.all(), key=lambda member: member.sequence_number
+                )
+            ]
+
+        Rule.objects.bulk_update(rules, ["cached_song_sequence"])
+        last_id = rules[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0004_rule_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rule",
+            name="cached_song_sequence",
+            field=models.JSONField(default=None, editable=False, null=True),
+        ),
+        migrations.RunPython(cache_song_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-19 14:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0006_accountdeletion"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="userlock",
+            name="created",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.1 on 2026-10-19 14:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0007_userlock_created_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WorkerRollup",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("minute", models.DateTimeField()),
+                ("worker", models.CharField(max_length=128)),
+                ("checks", models.PositiveIntegerField(default=0)),
+                ("rules_applied", models.PositiveIntegerField(default=0)),
+                ("check_errors", models.PositiveIntegerField(default=0)),
+                ("check_timeouts", models.PositiveIntegerField(default=0)),
+                ("shed_checks", models.PositiveIntegerField(default=0)),
+                ("backlog", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="workerrollup",
+            constraint=models.UniqueConstraint(
+                fields=("minute", "worker"), name="unique_rollup_minute_worker"
+            ),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 3.1 on 2026-10-19 16:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("data", "0008_workerrollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserHourlyActivity",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hour", models.DateTimeField(db_index=True)),
+                ("applied", models.PositiveIntegerField(default=0)),
+                ("skipped_not_playing", models.PositiveIntegerField(default=0)),
+                ("skipped_too_early", models.PositiveIntegerField(default=0)),
+                ("skipped_applied_recently", models.PositiveIntegerField(default=0)),
+                ("errors", models.PositiveIntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="hourly_rule_activity",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="RuleHourlyActivity",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hour", models.DateTimeField(db_index=True)),
+                ("applied", models.PositiveIntegerField(default=0)),
+                ("skipped_not_playing", models.PositiveIntegerField(default=0)),
+                ("skipped_too_early", models.PositiveIntegerField(default=0)),
+                ("skipped_applied_recently", models.PositiveIntegerField(default=0)),
+                ("errors", models.PositiveIntegerField(default=0)),
+                (
+                    "rule",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="hourly_activity",
+                        to="data.rule",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="userhourlyactivity",
+            constraint=models.UniqueConstraint(
+                fields=("user", "hour"), name="unique_user_activity_hour"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="rulehourlyactivity",
+            constraint=models.UniqueConstraint(
+                fields=("rule", "hour"), name="unique_rule_activity_hour"
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.1 on 2026-10-19 17:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0009_hourlyactivity"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RuleApplyClaim",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("slot", models.BigIntegerField()),
+                ("expires", models.DateTimeField(db_index=True)),
+                (
+                    "rule",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        db_index=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="data.rule",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="ruleapplyclaim",
+            constraint=models.UniqueConstraint(
+                fields=("rule", "slot"), name="unique_apply_claim_rule_slot"
+            ),
+        ),
+    ]
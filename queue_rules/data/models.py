@@ -1,9 +1,9 @@
 from datetime import datetime, timezone
-from typing import Iterable, Optional
+from typing import Iterable, List, Optional
 
 from django.contrib.auth.models import User
 from django.db import models
-from django.db.models import Max
+from django.db.models import Max, QuerySet
 from spotipy import Spotify
 from spotipy.exceptions import SpotifyException
 
@@ -17,12 +17,19 @@ def _make_track_name(track_info):
 
 
 class Rule(models.Model):
-    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="rules")
+    # Indexed by the indexes in Meta, which all start with it.
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="rules", db_index=False
+    )
     name = models.CharField(max_length=256, default="Unnamed")
     created = models.DateTimeField(auto_now_add=True)
     trigger_song_spotify_id = models.CharField(max_length=64)
     is_active = models.BooleanField(default=True)
     last_applied = models.DateTimeField(null=True, default=None)
+    # A copy of the song sequence, in order, so applying or showing the rule doesn't
+    # need to query it. The sequence's members are still what gets edited, and None
+    # means there's no copy yet.
+    cached_song_sequence = models.JSONField(null=True, default=None, editable=False)
 
     class Meta:
         constraints = [
@@ -30,23 +37,84 @@ class Rule(models.Model):
                 fields=("trigger_song_spotify_id", "owner"), name="unique_song_owner"
             ),
         ]
+        indexes = [
+            # queuerd only ever looks up active rules, by owner and then by trigger.
+            # Backends without partial indexes index every rule instead.
+            models.Index(
+                fields=("owner", "trigger_song_spotify_id"),
+                condition=models.Q(is_active=True),
+                name="rule_active_owner_trigger",
+            ),
+            # The rule list, newest first.
+            models.Index(fields=("owner", "-created"), name="rule_owner_created"),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.trigger_song_spotify_id})"
 
     def get_song_sequence(self) -> Iterable["SongSequenceMember"]:
+        if self.cached_song_sequence is not None:
+            return [
+                SongSequenceMember(rule_id=self.id, **member)
+                for member in self.cached_song_sequence
+            ]
+
+        # A prefetched sequence is already in order, so don't query it again.
+        if "song_sequence" in getattr(self, "_prefetched_objects_cache", {}):
+            return self.song_sequence.all()
+
         return self.song_sequence.order_by("sequence_number")
 
-    def apply(self, client: Optional[Spotify] = None) -> None:
+    def update_cached_song_sequence(
+        self,
+        members: Optional[Iterable["SongSequenceMember"]] = None,
+        save: bool = True,
+    ) -> None:
+        """
+        Copy the song sequence onto the rule. Anything that changes the sequence's
+        members needs to call this in the same transaction. Pass the members if
+        they're already loaded, to save looking them up again.
+        """
+        if members is None:
+            members = self.song_sequence.order_by("sequence_number")
+
+        self.cached_song_sequence = [
+            {
+                "id": member.id,
+                "name": member.name,
+                "song_spotify_id": member.song_spotify_id,
+                "sequence_number": member.sequence_number,
+            }
+            for member in sorted(members, key=lambda member: member.sequence_number)
+        ]
+
+        if save:
+            self.save(update_fields=["cached_song_sequence"])
+
+    def apply(
+        self,
+        client: Optional[Spotify] = None,
+        save: bool = True,
+        queued: Optional[List[str]] = None,
+    ) -> None:
         if client is None:
             client = get_spotify_client(self.owner)
 
+        # Callers can pass queued to find out how much of the sequence made it into
+        # the queue should applying fail partway.
         sequence = self.get_song_sequence()
         for song in sequence:
             client.add_to_queue(song.song_spotify_id)
+            if queued is not None:
+                queued.append(song.song_spotify_id)
 
         self.last_applied = datetime.now(timezone.utc)
-        self.save()
+
+        # Callers batching their writes can save last_applied themselves. Only
+        # last_applied, so the rule isn't put back how it was when it was loaded if
+        # it's been edited since.
+        if save:
+            self.save(update_fields=["last_applied"])
 
     def set_name(self, client: Optional[Spotify] = None) -> None:
         if client is None:
@@ -99,6 +167,18 @@ class SongSequenceMember(models.Model):
         self.save()
 
 
+def update_cached_song_sequences(rules: QuerySet) -> None:
+    """
+    update_cached_song_sequence() for many rules at once, such as after bulk creating
+    their sequences' members.
+    """
+    rules = list(rules.prefetch_related("song_sequence"))
+    for rule in rules:
+        rule.update_cached_song_sequence(rule.song_sequence.all(), save=False)
+
+    Rule.objects.bulk_update(rules, ["cached_song_sequence"], batch_size=1000)
+
+
 class LastCheckLog(models.Model):
     user = models.OneToOneField(
         User, on_delete=models.CASCADE, related_name="last_check_log"
@@ -112,4 +192,115 @@ class LastCheckLog(models.Model):
 
 class UserLock(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="lock")
-    created = models.DateTimeField(auto_now_add=True)
+    # Indexed for finding stale locks.
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class AccountDeletion(models.Model):
+    # A user who's asked for their account to be deleted, and been deactivated until
+    # their data's gone.
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, related_name="account_deletion"
+    )
+    requested = models.DateTimeField(auto_now_add=True)
+
+
+class WorkerRollup(models.Model):
+    # What one queuerd process did in one minute, kept up to date as it goes, so the
+    # dashboard never has to aggregate over the users or their checks.
+    minute = models.DateTimeField()
+    worker = models.CharField(max_length=128)
+    checks = models.PositiveIntegerField(default=0)
+    rules_applied = models.PositiveIntegerField(default=0)
+    check_errors = models.PositiveIntegerField(default=0)
+    check_timeouts = models.PositiveIntegerField(default=0)
+    shed_checks = models.PositiveIntegerField(default=0)
+    # How many of the worker's users were due when it last wrote this minute.
+    backlog = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Also the index the dashboard reads recent minutes through.
+            models.UniqueConstraint(
+                fields=("minute", "worker"), name="unique_rollup_minute_worker"
+            ),
+        ]
+
+
+class RuleApplyClaim(models.Model):
+    # A queuerd worker's claim on applying a rule for one play of its track. Plays are
+    # told apart by which slot of a few seconds they started in, and each claim covers
+    # its slot and the ones either side, so claims on the same play always overlap and
+    # only one of them can be inserted.
+    # No database constraint or cascade, as claims are short-lived and outlive their
+    # rules harmlessly until they expire. Indexed by the unique constraint instead.
+    rule = models.ForeignKey(
+        Rule,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        related_name="+",
+    )
+    slot = models.BigIntegerField()
+    expires = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("rule", "slot"), name="unique_apply_claim_rule_slot"
+            ),
+        ]
+
+
+class HourlyActivity(models.Model):
+    # What queuerd did with rules in one hour. Workers count these up in memory and add
+    # them to the hour's row every so often, rather than writing on every check.
+    hour = models.DateTimeField(db_index=True)
+    applied = models.PositiveIntegerField(default=0)
+    skipped_not_playing = models.PositiveIntegerField(default=0)
+    skipped_too_early = models.PositiveIntegerField(default=0)
+    skipped_applied_recently = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class RuleHourlyActivity(HourlyActivity):
+    # Indexed by the unique constraint instead.
+    rule = models.ForeignKey(
+        Rule, on_delete=models.CASCADE, related_name="hourly_activity", db_index=False
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("rule", "hour"), name="unique_rule_activity_hour"
+            ),
+        ]
+
+
+class UserHourlyActivity(HourlyActivity):
+    # The same, added up across all of a user's rules, except for errors, which count
+    # every check of the user that failed, whether or not a rule was being applied.
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="hourly_rule_activity",
+        db_index=False,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("user", "hour"), name="unique_user_activity_hour"
+            ),
+        ]
+
+
+class CircuitBreakerState(models.Model):
+    # Where each circuit breaker shares its state with the rest of the service. With
+    # several processes, whichever one's breaker changed state last wins.
+    name = models.CharField(max_length=64, unique=True)
+    state = models.CharField(max_length=16)
+    changed = models.DateTimeField(auto_now=True)
@@ -0,0 +1,148 @@
+import logging
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from social_django.models import UserSocialAuth
+
+from data.accounts import (
+    _delete_account_in_thread,
+    delete_account,
+    request_account_deletion,
+)
+from data.models import (
+    AccountDeletion,
+    LastCheckLog,
+    Rule,
+    RuleHourlyActivity,
+    SongSequenceMember,
+    UserHourlyActivity,
+    UserLock,
+)
+
+
+def make_user(username, num_rules=3):
+    user = User.objects.create(username=username)
+    UserSocialAuth.objects.create(user=user, provider="spotify", uid=username)
+    LastCheckLog.objects.create(user=user, last_checked="2020-01-01T00:00:00Z")
+    UserLock.objects.create(user=user)
+    for n in range(num_rules):
+        rule = Rule.objects.create(owner=user, trigger_song_spotify_id=f"song{n}")
+        for m in range(3):
+            SongSequenceMember.objects.create(
+                rule=rule, song_spotify_id=f"song{m}", sequence_number=m
+            )
+    return user
+
+
+class TestRequestAccountDeletion(TestCase):
+    @mock.patch("data.accounts.delete_account_in_background")
+    @mock.patch("data.accounts.transaction.on_commit", side_effect=lambda func: func())
+    def test_request(self, mock_on_commit, mock_delete_account_in_background):
+        user = make_user("test")
+
+        request_account_deletion(user)
+
+        user.refresh_from_db()
+        self.assertFalse(user.is_active)
+        self.assertTrue(AccountDeletion.objects.filter(user=user).exists())
+        # Nothing's deleted until the deactivation's committed.
+        self.assertEqual(Rule.objects.filter(owner=user).count(), 3)
+        mock_delete_account_in_background.assert_called_once_with(user.id)
+
+    @mock.patch("data.accounts.transaction.on_commit")
+    def test_request_twice(self, mock_on_commit):
+        user = make_user("test")
+
+        request_account_deletion(user)
+        request_account_deletion(user)
+
+        self.assertEqual(AccountDeletion.objects.count(), 1)
+
+
+class TestDeleteAccount(TestCase):
+    def test_delete(self):
+        user = make_user("test")
+        AccountDeletion.objects.create(user=user)
+        for rule in user.rules.all():
+            RuleHourlyActivity.objects.create(rule=rule, hour="2020-01-01T00:00:00Z")
+        UserHourlyActivity.objects.create(user=user, hour="2020-01-01T00:00:00Z")
+        other_user = make_user("other")
+
+        delete_account(user.id)
+
+        self.assertFalse(User.objects.filter(id=user.id).exists())
+        # Only the other user's data is left.
+        self.assertEqual(Rule.objects.exclude(owner=other_user).count(), 0)
+        self.assertEqual(
+            SongSequenceMember.objects.exclude(rule__owner=other_user).count(), 0
+        )
+        self.assertEqual(LastCheckLog.objects.exclude(user=other_user).count(), 0)
+        self.assertEqual(UserLock.objects.exclude(user=other_user).count(), 0)
+        self.assertFalse(AccountDeletion.objects.exists())
+        self.assertFalse(RuleHourlyActivity.objects.exists())
+        self.assertFalse(UserHourlyActivity.objects.exists())
+        self.assertEqual(
+            list(UserSocialAuth.objects.values_list("user_id", flat=True)),
+            [other_user.id],
+        )
+
+    def test_batches(self):
+        user = make_user("test", num_rules=5)
+
+        # A SELECT and DELETE for each batch of song sequence members (4 batches) and
+        # rules (2), one last SELECT of each and one of their (no) hourly activity,
+        # then the collector's 12 queries for the user and their other data.
+        with self.assertNumQueries(27):
+            delete_account(user.id, batch_size=4)
+
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Rule.objects.exists())
+        self.assertFalse(SongSequenceMember.objects.exists())
+
+    def test_already_deleted(self):
+        user = make_user("test")
+        delete_account(user.id)
+
+        delete_account(user.id)
+
+        self.assertFalse(User.objects.exists())
+
+    @mock.patch("data.accounts.connections")
+    @mock.patch("data.accounts.delete_account", side_effect=Exception("boom"))
+    def test_in_thread_error(self, mock_delete_account, mock_connections):
+        with self.assertLogs("data.accounts", logging.ERROR):
+            _delete_account_in_thread(1)
+
+        mock_delete_account.assert_called_once_with(1)
+        mock_connections.close_all.assert_called_once_with()
+
+
+class TestDeletePendingAccountsCommand(TestCase):
+    def test_no_pending_accounts(self):
+        make_user("test")
+
+        out = StringIO()
+        call_command("delete_pending_accounts", stdout=out)
+
+        self.assertEqual(User.objects.count(), 1)
+        self.assertIn("Deleted 0 accounts.", out.getvalue())
+
+    def test_pending_accounts(self):
+        for username in ("test1", "test2"):
+            AccountDeletion.objects.create(user=make_user(username))
+        kept = make_user("test3")
+
+        out = StringIO()
+        call_command("delete_pending_accounts", batch_size=2, stdout=out)
+
+        self.assertEqual(list(User.objects.all()), [kept])
+        self.assertEqual(Rule.objects.filter(owner=kept).count(), 3)
+        self.assertIn("Deleted 2 accounts.", out.getvalue())
+
+    def test_bad_batch_size(self):
+        with self.assertRaises(CommandError):
+            call_command("delete_pending_accounts", batch_size=0, stdout=StringIO())
@@ -0,0 +1,145 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from data.admin import EstimatedCountPaginator
+from data.models import (
+    AccountDeletion,
+    LastCheckLog,
+    Rule,
+    RuleHourlyActivity,
+    SongSequenceMember,
+    UserHourlyActivity,
+    UserLock,
+)
+
+
+class TestChangeLists(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username="admin", password="admin")
+        self.client.force_login(self.admin)
+
+    def add_users(self, count):
+        for n in range(count):
+            user = User.objects.create(username=f"test{User.objects.count()}")
+            rule = Rule.objects.create(owner=user, trigger_song_spotify_id="foo")
+            SongSequenceMember.objects.create(
+                rule=rule, song_spotify_id="bar", sequence_number=0
+            )
+            LastCheckLog.objects.create(user=user, last_checked="2020-01-01T00:00:00Z")
+            UserLock.objects.create(user=user)
+            AccountDeletion.objects.create(user=user)
+            RuleHourlyActivity.objects.create(rule=rule, hour="2020-01-01T00:00:00Z")
+            UserHourlyActivity.objects.create(user=user, hour="2020-01-01T00:00:00Z")
+
+    def get(self, model, **params):
+        response = self.client.get(
+            reverse(f"admin:data_{model._meta.model_name}_changelist"), params
+        )
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_queries_dont_grow_with_rows(self):
+        models = (
+            Rule,
+            SongSequenceMember,
+            LastCheckLog,
+            UserLock,
+            AccountDeletion,
+            RuleHourlyActivity,
+            UserHourlyActivity,
+        )
+
+        self.add_users(2)
+        query_counts = {}
+        for model in models:
+            with CaptureQueriesContext(connection) as queries:
+                self.get(model)
+            query_counts[model] = len(queries)
+
+        self.add_users(8)
+        for model in models:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.get(model)
+            self.assertEqual(len(queries), query_counts[model], model)
+            self.assertEqual(response.context["cl"].result_count, 10)
+
+    def test_filters_and_search(self):
+        self.add_users(3)
+        Rule.objects.filter(owner__username="test1").update(is_active=False)
+
+        response = self.get(Rule, is_active__exact=0)
+        self.assertEqual(response.context["cl"].result_count, 1)
+
+        response = self.get(Rule, q="test2")
+        self.assertEqual(
+            [rule.owner.username for rule in response.context["cl"].result_list],
+            ["test2"],
+        )
+
+        response = self.get(LastCheckLog, last_checked__gte="2019-12-31 00:00:00+00:00")
+        self.assertEqual(response.context["cl"].result_count, 3)
+
+        response = self.get(UserLock, q="test3")
+        self.assertEqual(response.context["cl"].result_count, 1)
+
+    def test_change_forms(self):
+        # Related objects are entered by ID, rather than listing every one of them.
+        self.add_users(1)
+
+        for obj in (
+            Rule.objects.get(),
+            SongSequenceMember.objects.get(),
+            LastCheckLog.objects.get(),
+            UserLock.objects.get(),
+            RuleHourlyActivity.objects.get(),
+        ):
+            response = self.client.get(
+                reverse(f"admin:data_{obj._meta.model_name}_change", args=[obj.id])
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, "vForeignKeyRawIdAdminField")
+
+
+class TestEstimatedCountPaginator(TestCase):
+    def setUp(self):
+        for n in range(3):
+            User.objects.create(username=f"test{n}")
+
+    @mock.patch("data.admin._estimate_count")
+    def test_not_postgresql(self, mock_estimate_count):
+        with mock.patch.object(connection, "vendor", "sqlite"):
+            paginator = EstimatedCountPaginator(User.objects.order_by("id"), 100)
+            self.assertEqual(paginator.count, 3)
+
+        mock_estimate_count.assert_not_called()
+
+    @mock.patch("data.admin.ESTIMATED_COUNT_THRESHOLD", 1000)
+    @mock.patch("data.admin._estimate_count", return_value=123456)
+    def test_big_table(self, mock_estimate_count):
+        with mock.patch.object(connection, "vendor", "postgresql"):
+            paginator = EstimatedCountPaginator(User.objects.order_by("id"), 100)
+            with self.assertNumQueries(0):
+                self.assertEqual(paginator.count, 123456)
+
+    @mock.patch("data.admin.ESTIMATED_COUNT_THRESHOLD", 1000)
+    @mock.patch("data.admin._estimate_count", return_value=5)
+    def test_small_table(self, mock_estimate_count):
+        with mock.patch.object(connection, "vendor", "postgresql"):
+            paginator = EstimatedCountPaginator(User.objects.order_by("id"), 100)
+            self.assertEqual(paginator.count, 3)
+
+    @mock.patch("data.admin.ESTIMATED_COUNT_THRESHOLD", 1000)
+    @mock.patch("data.admin._estimate_count", return_value=123456)
+    def test_filtered(self, mock_estimate_count):
+        with mock.patch.object(connection, "vendor", "postgresql"):
+            paginator = EstimatedCountPaginator(
+                User.objects.filter(username__startswith="test").order_by("id"), 100
+            )
+            self.assertEqual(paginator.count, 3)
+
+        mock_estimate_count.assert_not_called()
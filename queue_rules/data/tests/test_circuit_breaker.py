@@ -0,0 +1,151 @@
+import logging
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from data.circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+from data.exceptions import CircuitOpen
+
+
+@mock.patch("data.circuit_breaker.random.uniform", return_value=1.0)
+@mock.patch("data.circuit_breaker.monotonic", return_value=100.0)
+class TestCircuitBreaker(SimpleTestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.on_change = mock.MagicMock()
+        self.breaker = CircuitBreaker(
+            "test",
+            window=4,
+            failure_rate=0.5,
+            slow_call=2,
+            open_time=10,
+            max_open_time=30,
+            on_change=self.on_change,
+        )
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def call(self, failed=False, seconds=0.1):
+        probe = self.breaker.before_call()
+        self.breaker.after_call(probe, seconds, failed)
+
+    def test_stays_closed(self, mock_monotonic, mock_uniform):
+        for failed in [True, False, False, False, True, False, False]:
+            self.call(failed)
+
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.assertEqual(self.breaker.seconds_until_probe(), 0.0)
+        self.on_change.assert_not_called()
+
+    def test_opens_on_failures(self, mock_monotonic, mock_uniform):
+        # Not until the window's full.
+        self.call(failed=True)
+        self.call(failed=True)
+        self.assertEqual(self.breaker.state(), CLOSED)
+
+        self.call()
+        self.call()
+
+        self.assertEqual(self.breaker.state(), OPEN)
+        self.assertEqual(self.breaker.seconds_until_probe(), 10.0)
+        self.on_change.assert_called_once_with("test", OPEN)
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+
+    def test_opens_on_slow_calls(self, mock_monotonic, mock_uniform):
+        for _ in range(4):
+            self.call(seconds=2.5)
+
+        self.assertEqual(self.breaker.state(), OPEN)
+
+    def test_jittered(self, mock_monotonic, mock_uniform):
+        mock_uniform.return_value = 0.7
+        for _ in range(4):
+            self.call(failed=True)
+
+        self.assertEqual(self.breaker.seconds_until_probe(), 7.0)
+        mock_uniform.assert_called_with(0.5, 1.0)
+
+    def test_probe_closes(self, mock_monotonic, mock_uniform):
+        for _ in range(4):
+            self.call(failed=True)
+
+        mock_monotonic.return_value = 110.0
+        probe = self.breaker.before_call()
+
+        self.assertTrue(probe)
+        self.assertEqual(self.breaker.state(), HALF_OPEN)
+        # Only the one call gets through.
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+
+        self.breaker.after_call(probe, 0.1, failed=False)
+
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.assertFalse(self.breaker.before_call())
+        self.assertEqual(
+            self.on_change.call_args_list,
+            [
+                mock.call("test", OPEN),
+                mock.call("test", HALF_OPEN),
+                mock.call("test", CLOSED),
+            ],
+        )
+
+    def test_failed_probe_backs_off(self, mock_monotonic, mock_uniform):
+        for _ in range(4):
+            self.call(failed=True)
+
+        for now, wait in [(110.0, 20.0), (130.0, 30.0), (160.0, 30.0)]:
+            mock_monotonic.return_value = now
+            self.call(failed=True)
+
+            self.assertEqual(self.breaker.state(), OPEN)
+            self.assertEqual(self.breaker.seconds_until_probe(), wait)
+
+        # A good probe starts the delays over.
+        mock_monotonic.return_value = 190.0
+        self.call()
+        for _ in range(4):
+            self.call(failed=True)
+        self.assertEqual(self.breaker.seconds_until_probe(), 10.0)
+
+    def test_calls_in_flight_when_opened(self, mock_monotonic, mock_uniform):
+        late = self.breaker.before_call()
+        for _ in range(4):
+            self.call(failed=True)
+
+        self.breaker.after_call(late, 0.1, failed=False)
+
+        self.assertEqual(self.breaker.state(), OPEN)
+
+    def test_lost_probe(self, mock_monotonic, mock_uniform):
+        for _ in range(4):
+            self.call(failed=True)
+        mock_monotonic.return_value = 110.0
+        self.breaker.before_call()
+
+        mock_monotonic.return_value = 120.0
+
+        self.assertTrue(self.breaker.before_call())
+
+    def test_cancelled_probe(self, mock_monotonic, mock_uniform):
+        for _ in range(4):
+            self.call(failed=True)
+        mock_monotonic.return_value = 110.0
+        probe = self.breaker.before_call()
+
+        self.breaker.cancel_call(probe)
+
+        self.assertEqual(self.breaker.seconds_until_probe(), 0.0)
+        self.assertTrue(self.breaker.before_call())
+
+    def test_reset(self, mock_monotonic, mock_uniform):
+        for _ in range(4):
+            self.call(failed=True)
+
+        self.breaker.reset()
+
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.assertFalse(self.breaker.before_call())
@@ -1,8 +1,11 @@
 from datetime import datetime, timezone
 from io import StringIO
+from unittest import mock
 
 from django.contrib.auth.models import User
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import QuerySet
 from django.test import SimpleTestCase, TestCase
 from freezegun import freeze_time
 
@@ -71,3 +74,77 @@ class TestCommand(TestCase):
             UserLock.objects.get(),
             test_lock_2,
         )
+
+    @freeze_time("2020-08-31 00:00:00")
+    def test_delete_older_than_seconds(self):
+        with freeze_time("2020-08-30 23:59:00"):
+            UserLock.objects.create(user=User.objects.create(username="test1"))
+        test_lock_2 = UserLock.objects.create(
+            user=User.objects.create(username="test2")
+        )
+
+        call_command("clear_user_locks", older_than_seconds=30, stdout=StringIO())
+
+        self.assertEqual(UserLock.objects.get(), test_lock_2)
+
+    def test_created_before_and_older_than_seconds(self):
+        with self.assertRaises(CommandError):
+            call_command(
+                "clear_user_locks",
+                "--created-before",
+                "2020-08-31T00:00:00",
+                "--older-than-seconds",
+                "30",
+                stdout=StringIO(),
+            )
+
+    def test_dry_run(self):
+        UserLock.objects.create(user=User.objects.create(username="test1"))
+        UserLock.objects.create(user=User.objects.create(username="test2"))
+
+        out = StringIO()
+        call_command("clear_user_locks", dry_run=True, stdout=out)
+
+        self.assertEqual(UserLock.objects.count(), 2)
+        self.assertIn("Would delete 2 locks.", out.getvalue())
+
+    def test_batches(self):
+        for n in range(5):
+            UserLock.objects.create(user=User.objects.create(username=f"test{n}"))
+
+        out = StringIO()
+        # Counting, finding where to stop, then a SELECT and DELETE per batch and one
+        # last SELECT that finds nothing left.
+        with self.assertNumQueries(9):
+            call_command("clear_user_locks", batch_size=2, stdout=out)
+
+        self.assertFalse(UserLock.objects.exists())
+        self.assertEqual(
+            out.getvalue().splitlines(),
+            [
+                "Deleted 2 of 5 locks...",
+                "Deleted 4 of 5 locks...",
+                "Deleted 5 of 5 locks...",
+                "Deleted 5 locks.",
+            ],
+        )
+
+    def test_leaves_new_locks(self):
+        UserLock.objects.create(user=User.objects.create(username="test1"))
+        test_user_2 = User.objects.create(username="test2")
+
+        # A worker takes a lock once the command's started.
+        count = QuerySet.count
+
+        def take_lock(queryset):
+            UserLock.objects.get_or_create(user=test_user_2)
+            return count(queryset)
+
+        with mock.patch.object(QuerySet, "count", autospec=True, side_effect=take_lock):
+            call_command("clear_user_locks", stdout=StringIO())
+
+        self.assertEqual(UserLock.objects.get().user, test_user_2)
+
+    def test_bad_batch_size(self):
+        with self.assertRaises(CommandError):
+            call_command("clear_user_locks", batch_size=0, stdout=StringIO())
@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth.models import User
+from django.test import override_settings, TestCase
+from django.urls import reverse
+from freezegun import freeze_time
+
+from data.dashboard import dashboard, lock_ages, worker_series
+from data.models import UserLock, WorkerRollup
+
+
+NOW = datetime(2020, 9, 1, 12, 30, 15, tzinfo=timezone.utc)
+MINUTE = datetime(2020, 9, 1, 12, 30, tzinfo=timezone.utc)
+
+
+class TestWorkerSeries(TestCase):
+    def test_no_rollups(self):
+        series = worker_series(NOW, 3)
+
+        self.assertEqual(
+            [row["minute"] for row in series],
+            [MINUTE - timedelta(minutes=2), MINUTE - timedelta(minutes=1), MINUTE],
+        )
+        for row in series:
+            self.assertFalse(row["reported"])
+            self.assertEqual(row["checks_per_second"], 0)
+            self.assertEqual(row["error_rate"], 0)
+
+    def test_added_up_across_workers(self):
+        last_minute = MINUTE - timedelta(minutes=1)
+        WorkerRollup.objects.create(
+            minute=last_minute,
+            worker="host/0",
+            checks=600,
+            rules_applied=10,
+            check_errors=25,
+            check_timeouts=15,
+            backlog=3,
+        )
+        WorkerRollup.objects.create(
+            minute=last_minute,
+            worker="host/1",
+            checks=600,
+            rules_applied=5,
+            check_errors=10,
+            shed_checks=2,
+            backlog=4,
+        )
+        WorkerRollup.objects.create(minute=MINUTE, worker="host/0", checks=30)
+        # Too long ago.
+        WorkerRollup.objects.create(
+            minute=MINUTE - timedelta(hours=1), worker="host/0", checks=1000
+        )
+
+        series = worker_series(NOW, 2)
+
+        self.assertEqual(
+            series[0],
+            {
+                "minute": last_minute,
+                "reported": True,
+                "checks_per_second": 20.0,
+                "rules_applied": 15,
+                "error_rate": 50 / 1250,
+                "shed_checks": 2,
+                "backlog": 7,
+            },
+        )
+        # The current minute's only 15 seconds old.
+        self.assertEqual(series[1]["checks_per_second"], 2.0)
+
+    def test_one_query(self):
+        for n in range(10):
+            WorkerRollup.objects.create(
+                minute=MINUTE - timedelta(minutes=n), worker="host", checks=n
+            )
+
+        with self.assertNumQueries(1):
+            worker_series(NOW, 60)
+
+
+@override_settings(STALE_LOCK_THRESHOLD=15)
+class TestLockAges(TestCase):
+    def test_lock_ages(self):
+        for n, seconds_ago in enumerate((0, 5, 20, 59, 61, 3600)):
+            with freeze_time(NOW - timedelta(seconds=seconds_ago)):
+                UserLock.objects.create(user=User.objects.create(username=f"test{n}"))
+
+        with self.assertNumQueries(1):
+            ages = lock_ages(NOW)
+
+        self.assertEqual(
+            ages,
+            [
+                {"age": "Under 15s", "count": 2},
+                {"age": "15s to 60s", "count": 2},
+                {"age": "Over 60s", "count": 2},
+            ],
+        )
+
+
+class TestDashboard(TestCase):
+    def test_latest_reported_minute(self):
+        WorkerRollup.objects.create(
+            minute=MINUTE - timedelta(minutes=1), worker="host", checks=60, backlog=5
+        )
+
+        data = dashboard(NOW, 5)
+
+        self.assertEqual(data["latest"]["backlog"], 5)
+        self.assertEqual(data["peak_checks_per_second"], 1.0)
+
+    @freeze_time(NOW)
+    def test_view(self):
+        WorkerRollup.objects.create(minute=MINUTE, worker="host", checks=30, backlog=9)
+        staff = User.objects.create(username="staff", is_staff=True)
+        self.client.force_login(staff)
+
+        # Rollups and locks, then the session and user.
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("dashboard"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["latest"]["backlog"], 9)
+        self.assertContains(response, "queuerd dashboard")
+
+    def test_not_staff(self):
+        self.client.force_login(User.objects.create(username="test"))
+
+        response = self.client.get(reverse("dashboard"))
+
+        # Off to the admin login page.
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse("admin:login"), response["Location"])
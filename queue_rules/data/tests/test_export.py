@@ -0,0 +1,202 @@
+import csv
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase
+from freezegun import freeze_time
+
+from data.export import CSV_COLUMNS, export_rules, spool, stream
+from data.models import Rule, SongSequenceMember
+
+
+class TestExportRules(TestCase):
+    def setUp(self):
+        self.test_user_1 = User.objects.create(username="test1")
+        self.test_user_2 = User.objects.create(username="test2")
+
+        with freeze_time("2020-08-15"):
+            self.test_rule_1 = Rule.objects.create(
+                owner=self.test_user_1, name="First", trigger_song_spotify_id="foo"
+            )
+            self.test_rule_2 = Rule.objects.create(
+                owner=self.test_user_2, trigger_song_spotify_id="bar", is_active=False
+            )
+
+        SongSequenceMember.objects.create(
+            rule=self.test_rule_1, song_spotify_id="a", name="A", sequence_number=1
+        )
+        SongSequenceMember.objects.create(
+            rule=self.test_rule_1, song_spotify_id="b", name="B", sequence_number=0
+        )
+        self.test_rule_1.update_cached_song_sequence()
+        self.test_rule_2.update_cached_song_sequence()
+
+    def test_ndjson(self):
+        lines = list(export_rules(Rule.objects.all(), "ndjson"))
+
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(all(line.endswith("\n") for line in lines))
+        self.assertEqual(
+            json.loads(lines[0]),
+            {
+                "id": self.test_rule_1.id,
+                "owner": "test1",
+                "name": "First",
+                "trigger_song_spotify_id": "foo",
+                "is_active": True,
+                "created": "2020-08-15T00:00:00+00:00",
+                "last_applied": None,
+                "song_sequence": [
+                    {"name": "B", "song_spotify_id": "b", "sequence_number": 0},
+                    {"name": "A", "song_spotify_id": "a", "sequence_number": 1},
+                ],
+            },
+        )
+        self.assertEqual(json.loads(lines[1])["song_sequence"], [])
+
+    def test_csv(self):
+        rows = list(
+            csv.reader(StringIO("".join(export_rules(Rule.objects.all(), "csv"))))
+        )
+
+        self.assertEqual(rows[0], list(CSV_COLUMNS))
+        self.assertEqual(
+            rows[1:],
+            [
+                [
+                    str(self.test_rule_1.id),
+                    "test1",
+                    "First",
+                    "foo",
+                    "True",
+                    "2020-08-15T00:00:00+00:00",
+                    "",
+                    "0",
+                    "b",
+                    "B",
+                ],
+                [
+                    str(self.test_rule_1.id),
+                    "test1",
+                    "First",
+                    "foo",
+                    "True",
+                    "2020-08-15T00:00:00+00:00",
+                    "",
+                    "1",
+                    "a",
+                    "A",
+                ],
+                # Rules without a sequence still get a row.
+                [
+                    str(self.test_rule_2.id),
+                    "test2",
+                    "Unnamed",
+                    "bar",
+                    "False",
+                    "2020-08-15T00:00:00+00:00",
+                    "",
+                    "",
+                    "",
+                    "",
+                ],
+            ],
+        )
+
+    def test_filtered(self):
+        lines = list(export_rules(self.test_user_2.rules.all(), "ndjson"))
+        self.assertEqual(
+            [json.loads(line)["id"] for line in lines], [self.test_rule_2.id]
+        )
+
+    def test_queries_dont_grow_with_rules(self):
+        for n in range(10):
+            Rule.objects.create(
+                owner=self.test_user_1, trigger_song_spotify_id=f"song{n}"
+            ).update_cached_song_sequence()
+
+        with self.assertNumQueries(1):
+            lines = list(export_rules(Rule.objects.all(), "ndjson"))
+        self.assertEqual(len(lines), 12)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            list(export_rules(Rule.objects.all(), "xml"))
+
+
+class TestStream(SimpleTestCase):
+    def lines(self, count):
+        for n in range(count):
+            yield f"{n}\n"
+
+    @mock.patch("data.export.EXPORT_CHUNK_LENGTH", 10)
+    def test_chunks(self):
+        chunks = list(stream(self.lines(12)))
+
+        self.assertEqual("".join(chunks), "".join(self.lines(12)))
+        self.assertEqual(chunks[0], "0\n1\n2\n3\n4\n")
+        self.assertEqual(chunks[-1], "10\n11\n")
+
+    @mock.patch("data.export.EXPORT_CHUNK_LENGTH", 10)
+    def test_spool(self):
+        spooled = spool(self.lines(12))
+
+        self.assertEqual(spooled.read().decode(), "".join(self.lines(12)))
+        # Small exports don't touch the disk.
+        self.assertFalse(spooled._rolled)
+
+    @mock.patch("data.export.SPOOL_MAX_SIZE", 10)
+    def test_spool_to_disk(self):
+        spooled = spool(self.lines(12))
+
+        self.assertTrue(spooled._rolled)
+        self.assertEqual(spooled.read().decode(), "".join(self.lines(12)))
+
+
+class TestExportRulesCommand(TestCase):
+    def setUp(self):
+        self.test_user_1 = User.objects.create(username="test1")
+        self.test_user_2 = User.objects.create(username="test2")
+        self.test_rule_1 = Rule.objects.create(
+            owner=self.test_user_1, trigger_song_spotify_id="foo"
+        )
+        self.test_rule_2 = Rule.objects.create(
+            owner=self.test_user_2, trigger_song_spotify_id="bar"
+        )
+
+    def test_stdout(self):
+        out = StringIO()
+        call_command("export_rules", stdout=out)
+
+        ids = [json.loads(line)["id"] for line in out.getvalue().splitlines()]
+        self.assertEqual(ids, [self.test_rule_1.id, self.test_rule_2.id])
+
+    def test_user_csv_to_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "rules.csv")
+            call_command(
+                "export_rules", "--user", "test2", "--format", "csv", "-o", path
+            )
+
+            with open(path, newline="") as f:
+                rows = list(csv.reader(f))
+
+        self.assertEqual(rows[0], list(CSV_COLUMNS))
+        self.assertEqual([row[0] for row in rows[1:]], [str(self.test_rule_2.id)])
+
+    def test_user_without_rules(self):
+        User.objects.create(username="test3")
+
+        out = StringIO()
+        call_command("export_rules", "--user", "test3", stdout=out)
+        self.assertEqual(out.getvalue(), "")
+
+    def test_unknown_user(self):
+        with self.assertRaises(CommandError):
+            call_command("export_rules", "--user", "nobody")
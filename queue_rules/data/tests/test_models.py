@@ -7,11 +7,12 @@ from django.test import SimpleTestCase, TestCase
 from freezegun import freeze_time
 from spotipy.exceptions import SpotifyException
 
-from data.exceptions import BadSpotifyTrackID
+from data.exceptions import BadSpotifyTrackID, DeadlineExceeded
 from data.models import (
     Rule,
     LastCheckLog,
     SongSequenceMember,
+    update_cached_song_sequences,
     UserLock,
     _make_track_name,
 )
@@ -90,6 +91,58 @@ class TestRule(TestCase):
             (self.test_song_seq_2, self.test_song_seq_1),
         )
 
+    def test_get_song_sequence_prefetched(self):
+        rule = Rule.objects.prefetch_related("song_sequence").get(id=self.test_rule.id)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                tuple(rule.get_song_sequence()),
+                (self.test_song_seq_2, self.test_song_seq_1),
+            )
+
+    def test_update_cached_song_sequence(self):
+        self.test_rule.update_cached_song_sequence()
+
+        rule = Rule.objects.get(id=self.test_rule.id)
+        with self.assertNumQueries(0):
+            sequence = rule.get_song_sequence()
+        self.assertEqual(tuple(sequence), (self.test_song_seq_2, self.test_song_seq_1))
+        self.assertEqual(
+            [(song.rule_id, song.name, song.song_spotify_id) for song in sequence],
+            [
+                (rule.id, "Unnamed", self.TEST_SONG_SEQ_2),
+                (rule.id, "Unnamed", self.TEST_SONG_SEQ_1),
+            ],
+        )
+
+    def test_update_cached_song_sequence_with_members(self):
+        with self.assertNumQueries(0):
+            self.test_rule.update_cached_song_sequence(
+                [self.test_song_seq_1, self.test_song_seq_2], save=False
+            )
+
+        self.assertEqual(
+            tuple(self.test_rule.get_song_sequence()),
+            (self.test_song_seq_2, self.test_song_seq_1),
+        )
+        self.test_rule.refresh_from_db()
+        self.assertIsNone(self.test_rule.cached_song_sequence)
+
+    def test_update_cached_song_sequences(self):
+        other_rule = Rule.objects.create(
+            owner=self.test_user_2, trigger_song_spotify_id=self.TEST_SONG
+        )
+
+        update_cached_song_sequences(Rule.objects.all())
+
+        self.test_rule.refresh_from_db()
+        other_rule.refresh_from_db()
+        self.assertEqual(
+            [song["id"] for song in self.test_rule.cached_song_sequence],
+            [self.test_song_seq_2.id, self.test_song_seq_1.id],
+        )
+        self.assertEqual(other_rule.cached_song_sequence, [])
+
     @freeze_time("2026-08-16")
     @mock.patch("data.models.get_spotify_client")
     def test_apply_no_client(self, mock_get_client):
@@ -131,6 +184,40 @@ class TestRule(TestCase):
             datetime(2029, 8, 16, tzinfo=timezone.utc),
         )
 
+    def test_apply_keeps_edits(self):
+        # Edited since we loaded it.
+        Rule.objects.filter(id=self.test_rule.id).update(is_active=False)
+
+        self.test_rule.apply(mock.MagicMock())
+
+        self.test_rule.refresh_from_db()
+        self.assertFalse(self.test_rule.is_active)
+        self.assertIsNotNone(self.test_rule.last_applied)
+
+    def test_apply_queued(self):
+        mock_client = mock.MagicMock()
+        mock_client.add_to_queue.side_effect = [None, DeadlineExceeded()]
+        queued = []
+
+        with self.assertRaises(DeadlineExceeded):
+            self.test_rule.apply(mock_client, queued=queued)
+
+        self.assertEqual(queued, [self.TEST_SONG_SEQ_2])
+        self.assertIsNone(self.test_rule.last_applied)
+
+    @freeze_time("2029-08-16")
+    def test_apply_without_saving(self):
+        mock_client = mock.MagicMock()
+
+        self.test_rule.apply(mock_client, save=False)
+
+        self.assertEqual(
+            self.test_rule.last_applied,
+            datetime(2029, 8, 16, tzinfo=timezone.utc),
+        )
+        self.test_rule.refresh_from_db()
+        self.assertIsNone(self.test_rule.last_applied)
+
     @mock.patch("data.models._make_track_name")
     @mock.patch("data.models.get_spotify_client")
     def test_set_name_no_client(self, mock_get_client, mock_make_track_name):
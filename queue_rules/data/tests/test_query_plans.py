@@ -0,0 +1,94 @@
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase
+
+from data.models import Rule, UserLock
+
+
+@skipUnless(
+    connection.vendor in {"sqlite", "postgresql"}, "Query plans are backend specific."
+)
+class TestRuleQueryPlans(TestCase):
+    """
+    Rule lookups must be index searches, so they don't slow down as the table grows.
+    """
+
+    def setUp(self):
+        User.objects.bulk_create([User(username=f"test{n}") for n in range(20)])
+        self.users = list(User.objects.order_by("id"))
+        Rule.objects.bulk_create(
+            [
+                Rule(
+                    owner=user,
+                    trigger_song_spotify_id=f"song{n}",
+                    # Mostly inactive, as a big table would be.
+                    is_active=n == 0,
+                )
+                for user in self.users
+                for n in range(10)
+            ]
+        )
+
+        # Let the planner see how the data's spread, and (on PostgreSQL) stop it
+        # reading a table this small in full regardless.
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+            if connection.vendor == "postgresql":
+                cursor.execute("SET enable_seqscan = off")
+
+    def tearDown(self):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("RESET enable_seqscan")
+
+    def assertUsesIndex(self, queryset: QuerySet, *index_names: str) -> str:
+        plan = queryset.explain()
+        self.assertTrue(
+            any(index_name in plan for index_name in index_names),
+            f"Expected one of {index_names} to be used:\n{plan}",
+        )
+        for full_scan in (f"SCAN {queryset.model._meta.db_table}\n", "Seq Scan"):
+            self.assertNotIn(full_scan, plan + "\n")
+        return plan
+
+    def test_matching_rule(self):
+        # get_matching_rule() for users without their active rules loaded.
+        self.assertUsesIndex(
+            self.users[0].rules.filter(trigger_song_spotify_id="song0", is_active=True),
+            "rule_active_owner_trigger",
+            "unique_song_owner",
+            # SQLite's name for the unique constraint's index.
+            "sqlite_autoindex_data_rule",
+        )
+
+    def test_active_rules(self):
+        # Loading due users' rules.
+        owner_ids = [user.id for user in self.users[:3]]
+        self.assertUsesIndex(
+            Rule.objects.filter(is_active=True, owner_id__in=owner_ids),
+            "rule_active_owner_trigger",
+        )
+
+    def test_rule_list(self):
+        plan = self.assertUsesIndex(
+            Rule.objects.filter(owner=self.users[0]).order_by("-created"),
+            "rule_owner_created",
+        )
+
+        # Already in order, without sorting.
+        self.assertNotIn("TEMP B-TREE", plan)
+        self.assertNotIn("Sort", plan)
+
+    def test_stale_locks(self):
+        # The stale locks service check, and clear_user_locks with a cutoff.
+        UserLock.objects.bulk_create([UserLock(user=user) for user in self.users])
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        self.assertUsesIndex(
+            UserLock.objects.filter(created__lte="2020-01-01T00:00:00Z"),
+            "data_userlock_created",
+        )
@@ -1,11 +1,18 @@
+import logging
+import time
 from unittest import mock
 
+import requests
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.test import override_settings, SimpleTestCase, TestCase
 from social_django.models import UserSocialAuth
 from spotipy.exceptions import SpotifyException
 
 from data import user_utils
+from data.circuit_breaker import CircuitBreaker, CLOSED, OPEN
+from data.exceptions import CircuitOpen, DeadlineExceeded
+from data.models import CircuitBreakerState
 
 
 class TestUserUtils(TestCase):
@@ -40,14 +47,54 @@ class TestUserUtils(TestCase):
             "test_access_token",
         )
 
-    @mock.patch("data.user_utils.Spotify")
+    @mock.patch("data.user_utils.DeadlineSpotify")
     def test_get_spotify_client_no_check(self, mock_spotify_class):
         _ = user_utils.get_spotify_client(self.test_user, False)
         mock_spotify_class.assert_called_once_with(
-            auth=self.test_social_auth_extra_data["access_token"]
+            auth=self.test_social_auth_extra_data["access_token"],
+            requests_session=user_utils._get_spotify_session(),
+            deadline=None,
         )
 
-    @mock.patch("data.user_utils.Spotify")
+    def test_spotify_session_shared(self):
+        session = user_utils.get_spotify_client(
+            self.test_user, check_access=False
+        )._session
+        other_session = user_utils.get_spotify_client(
+            self.test_user, check_access=False
+        )._session
+
+        self.assertIs(session, other_session)
+        # Spotify clients close their session when they're garbage collected.
+        session.close()
+        self.assertTrue(session.adapters)
+
+    def test_spotify_session_retries(self):
+        session = user_utils._get_spotify_session()
+        retry = session.get_adapter("https://api.spotify.com/").max_retries
+
+        # The same as Spotipy sets up for a client of its own.
+        self.assertEqual(retry.total, 3)
+        self.assertEqual(retry.status, 3)
+        self.assertEqual(set(retry.status_forcelist), {429, 500, 502, 503, 504})
+        self.assertIn("POST", retry.allowed_methods)
+
+    def test_spotify_session_no_retries_with_deadline(self):
+        session = user_utils.get_spotify_client(
+            self.test_user, check_access=False, deadline=user_utils.Deadline(10)
+        )._session
+        retry = session.get_adapter("https://api.spotify.com/").max_retries
+
+        self.assertIsNot(session, user_utils._get_spotify_session())
+        self.assertEqual(retry.total, 0)
+        self.assertFalse(retry.status_forcelist)
+
+    @override_settings(SPOTIFY_API_PREFIX="http://localhost:8080/v1/")
+    def test_get_spotify_client_api_prefix(self):
+        client = user_utils.get_spotify_client(self.test_user, False)
+        self.assertEqual(client.prefix, "http://localhost:8080/v1/")
+
+    @mock.patch("data.user_utils.DeadlineSpotify")
     def test_get_spotify_client_check_no_refresh(self, mock_spotify_class):
         mock_spotify_client = mock.MagicMock()
         mock_spotify_client.currently_playing.return_value = True
@@ -57,7 +104,7 @@ class TestUserUtils(TestCase):
         mock_spotify_client.currently_playing.assert_called_once()
 
     @mock.patch("data.user_utils.refresh_spotify_tokens")
-    @mock.patch("data.user_utils.Spotify")
+    @mock.patch("data.user_utils.DeadlineSpotify")
     def test_get_spotify_client_check_refresh_sucess(
         self,
         mock_spotify_class,
@@ -75,19 +122,27 @@ class TestUserUtils(TestCase):
         _ = user_utils.get_spotify_client(self.test_user, True)
 
         self.assertEqual(len(mock_spotify_client.currently_playing.mock_calls), 2)
-        mock_refresh_function.assert_called_once_with(self.test_user)
+        mock_refresh_function.assert_called_once_with(self.test_user, None)
         self.assertEqual(
             mock_spotify_class.mock_calls,
             [
-                mock.call(auth=self.test_social_auth_extra_data["access_token"]),
+                mock.call(
+                    auth=self.test_social_auth_extra_data["access_token"],
+                    requests_session=user_utils._get_spotify_session(),
+                    deadline=None,
+                ),
                 mock.call().currently_playing(),
-                mock.call(auth="refreshed_auth"),
+                mock.call(
+                    auth="refreshed_auth",
+                    requests_session=user_utils._get_spotify_session(),
+                    deadline=None,
+                ),
                 mock.call().currently_playing(),
             ],
         )
 
     @mock.patch("data.user_utils.refresh_spotify_tokens")
-    @mock.patch("data.user_utils.Spotify")
+    @mock.patch("data.user_utils.DeadlineSpotify")
     def test_get_spotify_client_check_refresh_fail(
         self,
         mock_spotify_class,
@@ -107,13 +162,21 @@ class TestUserUtils(TestCase):
             _ = user_utils.get_spotify_client(self.test_user, True)
 
         self.assertEqual(len(mock_spotify_client.currently_playing.mock_calls), 2)
-        mock_refresh_function.assert_called_once_with(self.test_user)
+        mock_refresh_function.assert_called_once_with(self.test_user, None)
         self.assertEqual(
             mock_spotify_class.mock_calls,
             [
-                mock.call(auth=self.test_social_auth_extra_data["access_token"]),
+                mock.call(
+                    auth=self.test_social_auth_extra_data["access_token"],
+                    requests_session=user_utils._get_spotify_session(),
+                    deadline=None,
+                ),
                 mock.call().currently_playing(),
-                mock.call(auth="refreshed_auth"),
+                mock.call(
+                    auth="refreshed_auth",
+                    requests_session=user_utils._get_spotify_session(),
+                    deadline=None,
+                ),
                 mock.call().currently_playing(),
             ],
         )
@@ -135,6 +198,9 @@ class TestUserUtils(TestCase):
         mock_oauth_instance.refresh_access_token.assert_called_once_with(
             "test_refresh_token"
         )
+        self.assertEqual(
+            mock_oauth_instance.OAUTH_TOKEN_URL, settings.SPOTIFY_TOKEN_URL
+        )
         self.assertEqual(
             self.test_user.social_auth.get(provider="spotify").extra_data[
                 "access_token"
@@ -147,3 +213,328 @@ class TestUserUtils(TestCase):
             ],
             "refreshed_refresh_token",
         )
+
+    def test_credentials_cached(self):
+        user_utils._get_spotify_access_token(self.test_user)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                user_utils._get_spotify_access_token(self.test_user),
+                "test_access_token",
+            )
+            self.assertEqual(
+                user_utils._get_spotify_refresh_token(self.test_user),
+                "test_refresh_token",
+            )
+
+    def test_preload_spotify_credentials(self):
+        other_user = User.objects.create(username="other")
+        UserSocialAuth.objects.create(
+            user=other_user,
+            provider="spotify",
+            uid="other",
+            extra_data={
+                "access_token": "other_access_token",
+                "refresh_token": "other_refresh_token",
+            },
+        )
+
+        with self.assertNumQueries(1):
+            user_utils.preload_spotify_credentials([self.test_user.id, other_user.id])
+        with self.assertNumQueries(0):
+            user_utils.preload_spotify_credentials([self.test_user.id, other_user.id])
+            self.assertEqual(
+                user_utils._get_spotify_access_token(other_user), "other_access_token"
+            )
+
+    def test_credentials_invalidated_by_social_auth_update(self):
+        user_utils._get_spotify_access_token(self.test_user)
+
+        # As happens when the user logs in again.
+        self.test_social_auth.extra_data = {
+            "access_token": "new_access_token",
+            "refresh_token": "new_refresh_token",
+        }
+        self.test_social_auth.save()
+
+        self.assertEqual(
+            user_utils._get_spotify_access_token(self.test_user), "new_access_token"
+        )
+
+    @mock.patch("data.user_utils.monotonic")
+    @mock.patch("data.user_utils.SpotifyOAuth")
+    def test_refresh_spotify_tokens_with_deadline(
+        self, mock_oauth_class, mock_monotonic
+    ):
+        mock_oauth_class.return_value.refresh_access_token.return_value = {
+            "access_token": "refreshed_access_token",
+            "refresh_token": "refreshed_refresh_token",
+        }
+        mock_monotonic.return_value = 100.0
+        deadline = user_utils.Deadline(3)
+        mock_monotonic.return_value = 101.0
+
+        user_utils.refresh_spotify_tokens(self.test_user, deadline)
+
+        self.assertEqual(mock_oauth_class.call_args.kwargs["requests_timeout"], 2.0)
+
+        mock_monotonic.return_value = 103.0
+        with self.assertRaises(DeadlineExceeded):
+            user_utils.refresh_spotify_tokens(self.test_user, deadline)
+
+    @mock.patch("data.user_utils.SpotifyOAuth")
+    def test_refresh_spotify_tokens_updates_cache(self, mock_oauth_class):
+        mock_oauth_class.return_value.refresh_access_token.return_value = {
+            "access_token": "refreshed_access_token",
+            "refresh_token": "refreshed_refresh_token",
+        }
+        user_utils._get_spotify_access_token(self.test_user)
+
+        user_utils.refresh_spotify_tokens(self.test_user)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                user_utils._get_spotify_access_token(self.test_user),
+                "refreshed_access_token",
+            )
+
+    @mock.patch("data.user_utils.SpotifyOAuth")
+    def test_refresh_spotify_tokens_reads_database(self, mock_oauth_class):
+        mock_oauth_class.return_value.refresh_access_token.return_value = {
+            "access_token": "refreshed_access_token",
+            "refresh_token": "refreshed_refresh_token",
+        }
+        user_utils._get_spotify_access_token(self.test_user)
+        # Another process refreshed without us hearing about it.
+        UserSocialAuth.objects.filter(id=self.test_social_auth.id).update(
+            extra_data={
+                "access_token": "other_access_token",
+                "refresh_token": "other_refresh_token",
+            }
+        )
+
+        user_utils.refresh_spotify_tokens(self.test_user)
+
+        mock_oauth_class.return_value.refresh_access_token.assert_called_once_with(
+            "other_refresh_token"
+        )
+
+    @mock.patch("data.user_utils.refresh_spotify_tokens")
+    @mock.patch("data.user_utils.DeadlineSpotify")
+    def test_get_spotify_client_expired_token(
+        self, mock_spotify_class, mock_refresh_function
+    ):
+        self.test_social_auth.extra_data = {
+            **self.test_social_auth_extra_data,
+            "auth_time": int(time.time()) - 3600,
+            "expires": 3600,
+        }
+        self.test_social_auth.save()
+        mock_refresh_function.return_value = {
+            "access_token": "refreshed_auth",
+            "refresh_token": "test_refresh_token",
+        }
+
+        user_utils.get_spotify_client(self.test_user, True)
+
+        # Refreshed up front, rather than after a failed request.
+        mock_refresh_function.assert_called_once_with(self.test_user, None)
+        self.assertEqual(
+            mock_spotify_class.mock_calls,
+            [
+                mock.call(
+                    auth="refreshed_auth",
+                    requests_session=user_utils._get_spotify_session(),
+                    deadline=None,
+                ),
+                mock.call().currently_playing(),
+            ],
+        )
+
+
+class TestSpotifyCredentials(SimpleTestCase):
+    def test_no_expiry(self):
+        credentials = user_utils.SpotifyCredentials.from_extra_data(
+            {"access_token": "access", "refresh_token": "refresh"}
+        )
+
+        self.assertIsNone(credentials.expires_at)
+        self.assertFalse(credentials.has_expired())
+
+    def test_login_expiry(self):
+        credentials = user_utils.SpotifyCredentials.from_extra_data(
+            {
+                "access_token": "access",
+                "refresh_token": "refresh",
+                "auth_time": 1000,
+                "expires": 3600,
+            }
+        )
+
+        self.assertEqual(credentials.expires_at, 4600)
+
+    @mock.patch("data.user_utils.time")
+    def test_refreshed_expiry(self, mock_time):
+        credentials = user_utils.SpotifyCredentials.from_extra_data(
+            {"access_token": "access", "refresh_token": "refresh", "expires_at": 4600}
+        )
+
+        mock_time.return_value = 4600 - user_utils.TOKEN_EXPIRY_MARGIN - 1
+        self.assertFalse(credentials.has_expired())
+        mock_time.return_value = 4600 - user_utils.TOKEN_EXPIRY_MARGIN
+        self.assertTrue(credentials.has_expired())
+
+
+@mock.patch("data.user_utils.monotonic")
+class TestDeadline(SimpleTestCase):
+    def test_timeout(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        deadline = user_utils.Deadline(3)
+
+        mock_monotonic.return_value = 101.0
+        self.assertEqual(deadline.remaining(), 2.0)
+        self.assertEqual(deadline.timeout(), 2.0)
+        self.assertEqual(deadline.timeout(1.5), 1.5)
+        self.assertEqual(deadline.timeout(5), 2.0)
+
+    def test_exceeded(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        deadline = user_utils.Deadline(3)
+
+        mock_monotonic.return_value = 103.0
+        self.assertEqual(deadline.remaining(), 0.0)
+        with self.assertRaises(DeadlineExceeded):
+            deadline.timeout()
+
+    def test_client_timeouts(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        client = user_utils.DeadlineSpotify(
+            auth="access", deadline=user_utils.Deadline(3)
+        )
+
+        # Spotipy's own timeout for each call still applies.
+        self.assertEqual(client.requests_timeout, 3.0)
+        client.requests_timeout = 1
+        self.assertEqual(client.requests_timeout, 1)
+
+        mock_monotonic.return_value = 102.5
+        self.assertEqual(client.requests_timeout, 0.5)
+
+    def test_client_deadline_exceeded(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        session = mock.MagicMock()
+        client = user_utils.DeadlineSpotify(
+            auth="access", requests_session=session, deadline=user_utils.Deadline(3)
+        )
+
+        mock_monotonic.return_value = 103.0
+        with self.assertRaises(DeadlineExceeded):
+            client.currently_playing()
+        session.request.assert_not_called()
+
+    def test_client_without_deadline(self, mock_monotonic):
+        client = user_utils.DeadlineSpotify(auth="access", requests_timeout=5)
+
+        self.assertEqual(client.requests_timeout, 5)
+
+
+def _response(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = b"{}"
+    response.url = "https://api.spotify.com/v1/me/player/currently-playing"
+    return response
+
+
+class TestSpotifyCircuitBreaker(TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        self.breaker = CircuitBreaker(
+            "spotify",
+            window=2,
+            failure_rate=0.5,
+            slow_call=5,
+            open_time=30,
+            max_open_time=300,
+            on_change=user_utils._save_breaker_state,
+        )
+        patcher = mock.patch("data.user_utils.spotify_breaker", self.breaker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.session = mock.MagicMock(spec=requests.Session)
+        self.client = user_utils.DeadlineSpotify(
+            auth="access", requests_session=self.session
+        )
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_opens_on_outage(self):
+        self.session.request.return_value = _response(503)
+
+        for _ in range(2):
+            with self.assertRaises(SpotifyException):
+                self.client.currently_playing()
+
+        self.assertEqual(self.breaker.state(), OPEN)
+        self.assertEqual(CircuitBreakerState.objects.get(name="spotify").state, OPEN)
+
+        # Calls fail fast without reaching Spotify.
+        with self.assertRaises(CircuitOpen):
+            self.client.currently_playing()
+        self.assertEqual(self.session.request.call_count, 2)
+
+    def test_opens_on_timeouts(self):
+        self.session.request.side_effect = requests.exceptions.ReadTimeout()
+
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                self.client.currently_playing()
+
+        self.assertEqual(self.breaker.state(), OPEN)
+
+    def test_ignores_client_errors(self):
+        self.session.request.return_value = _response(401)
+
+        for _ in range(2):
+            with self.assertRaises(SpotifyException):
+                self.client.currently_playing()
+
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.assertFalse(CircuitBreakerState.objects.exists())
+
+    def test_probe(self):
+        self.session.request.return_value = _response(503)
+        for _ in range(2):
+            with self.assertRaises(SpotifyException):
+                self.client.currently_playing()
+
+        self.session.request.return_value = _response(200)
+        with mock.patch("data.circuit_breaker.monotonic", return_value=1e12):
+            self.client.currently_playing()
+
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.assertEqual(CircuitBreakerState.objects.get(name="spotify").state, CLOSED)
+
+    @mock.patch("data.user_utils.SpotifyOAuth")
+    def test_refresh(self, mock_oauth):
+        test_user = User.objects.create(username="test")
+        UserSocialAuth.objects.create(
+            user=test_user,
+            provider="spotify",
+            uid="test",
+            extra_data={"access_token": "access", "refresh_token": "refresh"},
+        )
+        mock_oauth.return_value.refresh_access_token.side_effect = (
+            requests.exceptions.ConnectionError()
+        )
+
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                user_utils.refresh_spotify_tokens(test_user)
+
+        with self.assertRaises(CircuitOpen):
+            user_utils.refresh_spotify_tokens(test_user)
+        self.assertEqual(mock_oauth.return_value.refresh_access_token.call_count, 2)
@@ -1,15 +1,67 @@
 import logging
+from contextlib import contextmanager
+from threading import Lock
+from time import monotonic, time
+from typing import ContextManager, Dict, Iterable, NamedTuple, Optional
 
+import requests
+import urllib3
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import DatabaseError
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from social_django.models import UserSocialAuth
 from spotipy import Spotify
 from spotipy.exceptions import SpotifyException
 from spotipy.oauth2 import SpotifyOAuth
 
+from .circuit_breaker import CircuitBreaker
+from .exceptions import DeadlineExceeded
 
+
+logger = logging.getLogger(__name__)
 spotipy_logger = logging.getLogger("spotipy.client")
 
+# Treat access tokens as expired this many seconds early, so they don't run out
+# mid-check.
+TOKEN_EXPIRY_MARGIN = 60
+
+
+class SpotifyCredentials(NamedTuple):
+    access_token: str
+    refresh_token: str
+    expires_at: Optional[float]
+
+    @classmethod
+    def from_extra_data(cls, extra_data: dict) -> "SpotifyCredentials":
+        # Refreshed tokens come with an expiry time from Spotipy, while the ones from
+        # logging in have when they were issued and how long they last.
+        expires_at = extra_data.get("expires_at")
+        if (
+            expires_at is None
+            and extra_data.get("expires")
+            and "auth_time" in extra_data
+        ):
+            expires_at = extra_data["auth_time"] + extra_data["expires"]
+
+        return cls(
+            access_token=extra_data["access_token"],
+            refresh_token=extra_data["refresh_token"],
+            expires_at=expires_at,
+        )
+
+    def has_expired(self) -> bool:
+        return self.expires_at is not None and (
+            self.expires_at - TOKEN_EXPIRY_MARGIN <= time()
+        )
+
+
+# Per-process cache of users' Spotify credentials, so checking a user with a valid
+# token doesn't need to query their UserSocialAuth at all.
+_credentials_cache: Dict[int, SpotifyCredentials] = {}
+_credentials_cache_lock = Lock()
+
 
 def _get_spotify_social_auth(user: User) -> UserSocialAuth:
     return user.social_auth.get(provider="spotify")
@@ -19,16 +71,238 @@ def _get_spotify_extra_data(user: User) -> dict:
     return _get_spotify_social_auth(user).extra_data
 
 
+def _cache_spotify_credentials(user_id: int, extra_data: dict) -> SpotifyCredentials:
+    credentials = SpotifyCredentials.from_extra_data(extra_data)
+    with _credentials_cache_lock:
+        _credentials_cache[user_id] = credentials
+
+    return credentials
+
+
+def _get_spotify_credentials(user: User) -> SpotifyCredentials:
+    with _credentials_cache_lock:
+        credentials = _credentials_cache.get(user.id)
+
+    if credentials is None:
+        credentials = _cache_spotify_credentials(user.id, _get_spotify_extra_data(user))
+
+    return credentials
+
+
+def preload_spotify_credentials(user_ids: Iterable[int]) -> None:
+    """
+    Cache the credentials of any of these users that aren't cached yet, in one query.
+    """
+    with _credentials_cache_lock:
+        missing = [user_id for user_id in user_ids if user_id not in _credentials_cache]
+
+    if not missing:
+        return
+
+    social_auths = UserSocialAuth.objects.filter(
+        provider="spotify", user_id__in=missing
+    ).values_list("user_id", "extra_data")
+    for user_id, extra_data in social_auths:
+        _cache_spotify_credentials(user_id, extra_data)
+
+
+def invalidate_spotify_credentials(user_id: int) -> None:
+    with _credentials_cache_lock:
+        _credentials_cache.pop(user_id, None)
+
+
+@receiver(post_save, sender=UserSocialAuth)
+@receiver(post_delete, sender=UserSocialAuth)
+def _social_auth_changed(sender, instance, **kwargs):
+    # Covers logging in again through the social auth pipeline, as well as our own
+    # refreshes.
+    invalidate_spotify_credentials(instance.user_id)
+
+
 def _get_spotify_access_token(user: User) -> str:
-    return _get_spotify_extra_data(user)["access_token"]
+    return _get_spotify_credentials(user).access_token
 
 
 def _get_spotify_refresh_token(user: User) -> str:
-    return _get_spotify_extra_data(user)["refresh_token"]
+    return _get_spotify_credentials(user).refresh_token
+
+
+class Deadline:
+    """
+    A time budget shared by several calls to Spotify, such as everything queuerd does
+    for one check.
+    """
+
+    def __init__(self, seconds: float):
+        self.expires_at = monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(self.expires_at - monotonic(), 0.0)
+
+    def timeout(self, default: Optional[float] = None) -> float:
+        """
+        Return the timeout for the next call, which is whatever's left, or default if
+        that's less. Raises DeadlineExceeded if there's nothing left.
+        """
+        remaining = self.expires_at - monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+
+        return remaining if default is None else min(default, remaining)
+
 
+def _save_breaker_state(name: str, state: str) -> None:
+    # Imported here, as the models use this module.
+    from .models import CircuitBreakerState
 
-def get_spotify_client(user: User, check_access: bool = True) -> Spotify:
-    client = Spotify(auth=_get_spotify_access_token(user))
+    try:
+        CircuitBreakerState.objects.update_or_create(
+            name=name, defaults={"state": state}
+        )
+    except DatabaseError:
+        # Spotify's the one having trouble, so carry on.
+        logger.exception(f"Couldn't save the {name} circuit breaker's state")
+
+
+# One breaker per process, which every Spotify client and token refresh goes through.
+spotify_breaker = CircuitBreaker(
+    "spotify",
+    window=settings.SPOTIFY_BREAKER_WINDOW,
+    failure_rate=settings.SPOTIFY_BREAKER_FAILURE_RATE,
+    slow_call=settings.SPOTIFY_BREAKER_SLOW_CALL,
+    open_time=settings.SPOTIFY_BREAKER_OPEN_TIME,
+    max_open_time=settings.SPOTIFY_BREAKER_MAX_OPEN_TIME,
+    on_change=_save_breaker_state,
+)
+
+
+def is_spotify_outage(error: Exception) -> bool:
+    # Errors that are down to Spotify rather than the request or the user's tokens.
+    if isinstance(error, SpotifyException):
+        return error.http_status >= 500 or error.http_status == 429
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+@contextmanager
+def _spotify_call() -> ContextManager[None]:
+    """
+    Wrap a request to Spotify with the circuit breaker, which raises CircuitOpen
+    instead of making the request while Spotify's down.
+    """
+    probe = spotify_breaker.before_call()
+    started = monotonic()
+    try:
+        yield
+    except DeadlineExceeded:
+        # Out of time before the request was even sent.
+        spotify_breaker.cancel_call(probe)
+        raise
+    except Exception as e:
+        spotify_breaker.after_call(probe, monotonic() - started, is_spotify_outage(e))
+        raise
+
+    spotify_breaker.after_call(probe, monotonic() - started, failed=False)
+
+
+class DeadlineSpotify(Spotify):
+    """
+    Spotify client that gives each call at most what's left of a deadline as its
+    timeout, if it has one, and makes every call through the circuit breaker.
+    """
+
+    def __init__(self, *args, deadline: Optional[Deadline] = None, **kwargs):
+        self.deadline = deadline
+        super().__init__(*args, **kwargs)
+
+    @property
+    def requests_timeout(self) -> Optional[float]:
+        # Spotipy reads this for every request.
+        if self.deadline is None:
+            return self._requests_timeout
+        return self.deadline.timeout(self._requests_timeout)
+
+    @requests_timeout.setter
+    def requests_timeout(self, value: Optional[float]) -> None:
+        self._requests_timeout = value
+
+    def _internal_call(self, method, url, payload, params):
+        with _spotify_call():
+            return super()._internal_call(method, url, payload, params)
+
+
+class _SharedSession(requests.Session):
+    def close(self):
+        # Spotify clients close their session when they're garbage collected, but this
+        # one belongs to all of them.
+        pass
+
+
+_spotify_sessions: Dict[bool, requests.Session] = {}
+_spotify_session_lock = Lock()
+
+
+def _get_spotify_session(retry: bool = True) -> requests.Session:
+    """
+    One connection pool for every Spotify client in the process, with enough
+    connections for each of queuerd's check threads, and the same retries Spotipy
+    would have set up for each client on its own.
+
+    Those retries, and any waiting for Retry-After, all happen within a single call,
+    where a deadline's timeouts can't reach them. So clients with a deadline use a
+    pool of their own without retries, and leave it to queuerd to back off.
+    """
+    with _spotify_session_lock:
+        if retry not in _spotify_sessions:
+            max_retries = 0
+            if retry:
+                max_retries = urllib3.Retry(
+                    total=3,
+                    connect=None,
+                    read=False,
+                    allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+                    status=3,
+                    backoff_factor=0.3,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                )
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=max(settings.QUEUERD_THREADS, 10), max_retries=max_retries
+            )
+
+            session = _SharedSession()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _spotify_sessions[retry] = session
+
+        return _spotify_sessions[retry]
+
+
+def _make_spotify_client(
+    access_token: str, deadline: Optional[Deadline] = None
+) -> Spotify:
+    client = DeadlineSpotify(
+        auth=access_token,
+        requests_session=_get_spotify_session(retry=deadline is None),
+        deadline=deadline,
+    )
+    client.prefix = settings.SPOTIFY_API_PREFIX
+    return client
+
+
+def get_spotify_client(
+    user: User, check_access: bool = True, deadline: Optional[Deadline] = None
+) -> Spotify:
+    """
+    Get a client for the user's Spotify account. With a deadline, every call made
+    here and with the client has to finish before it, or raises a Timeout.
+    """
+    credentials = _get_spotify_credentials(user)
+    if check_access and credentials.has_expired():
+        # No point finding out the hard way.
+        credentials = SpotifyCredentials.from_extra_data(
+            refresh_spotify_tokens(user, deadline)
+        )
+
+    client = _make_spotify_client(credentials.access_token, deadline)
 
     if check_access:
         # Squelch logging for Spotipy, as it causes some noise for
@@ -38,8 +312,8 @@ def get_spotify_client(user: User, check_access: bool = True) -> Spotify:
         try:
             client.currently_playing()
         except SpotifyException:
-            new_auth = refresh_spotify_tokens(user)
-            client = Spotify(auth=new_auth["access_token"])
+            new_auth = refresh_spotify_tokens(user, deadline)
+            client = _make_spotify_client(new_auth["access_token"], deadline)
 
             # If an exception gets raised here, then the refresh failed.
             client.currently_playing()
@@ -50,15 +324,24 @@ def get_spotify_client(user: User, check_access: bool = True) -> Spotify:
     return client
 
 
-def refresh_spotify_tokens(user: User) -> dict:
+def refresh_spotify_tokens(user: User, deadline: Optional[Deadline] = None) -> dict:
     auth_manager = SpotifyOAuth(
         client_id=settings.SOCIAL_AUTH_SPOTIFY_KEY,
         client_secret=settings.SOCIAL_AUTH_SPOTIFY_SECRET,
         redirect_uri=settings.SPOTIFY_REDIRECT_URI,
+        requests_timeout=None if deadline is None else deadline.timeout(),
     )
-    new_auth = auth_manager.refresh_access_token(_get_spotify_refresh_token(user))
+    auth_manager.OAUTH_TOKEN_URL = settings.SPOTIFY_TOKEN_URL
+
+    # Always refresh using what's in the database, in case another process has
+    # already refreshed since we cached this user's credentials.
     spotify_social_auth = _get_spotify_social_auth(user)
+    with _spotify_call():
+        new_auth = auth_manager.refresh_access_token(
+            spotify_social_auth.extra_data["refresh_token"]
+        )
     spotify_social_auth.extra_data = new_auth
     spotify_social_auth.save()
+    _cache_spotify_credentials(user.id, new_auth)
 
     return new_auth
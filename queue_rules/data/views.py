@@ -0,0 +1,14 @@
+from django.contrib import admin
+from django.shortcuts import render
+
+from .dashboard import dashboard as dashboard_data
+
+
+def dashboard(request):
+    # Wrapped in admin_view() where it's routed, so it's for staff only.
+    context = {
+        **admin.site.each_context(request),
+        **dashboard_data(),
+        "title": "queuerd dashboard",
+    }
+    return render(request, "admin/data/dashboard.html", context)
@@ -25,7 +25,7 @@ INSTALLED_APPS = [
     "social_django",
     "data",
     "frontend",
-    "worker",
+    "worker.apps.WorkerConfig",
     "api",
 ]
 
@@ -124,6 +124,19 @@ SPOTIFY_REDIRECT_URI = config("SPOTIFY_REDIRECT_URI")
 SOCIAL_AUTH_REDIRECT_IS_HTTPS = config(
     "SOCIAL_AUTH_REDIRECT_IS_HTTPS", default=False, cast=bool
 )
+SPOTIFY_API_PREFIX = config("SPOTIFY_API_PREFIX", default="https://api.spotify.com/v1/")
+SPOTIFY_TOKEN_URL = config(
+    "SPOTIFY_TOKEN_URL", default="https://accounts.spotify.com/api/token"
+)
+SPOTIFY_BREAKER_WINDOW = config("SPOTIFY_BREAKER_WINDOW", default=20, cast=int)
+SPOTIFY_BREAKER_FAILURE_RATE = config(
+    "SPOTIFY_BREAKER_FAILURE_RATE", default=0.5, cast=float
+)
+SPOTIFY_BREAKER_SLOW_CALL = config("SPOTIFY_BREAKER_SLOW_CALL", default=5, cast=float)
+SPOTIFY_BREAKER_OPEN_TIME = config("SPOTIFY_BREAKER_OPEN_TIME", default=30, cast=float)
+SPOTIFY_BREAKER_MAX_OPEN_TIME = config(
+    "SPOTIFY_BREAKER_MAX_OPEN_TIME", default=300, cast=float
+)
 
 MOST_RECENT_CHECK_AGE_THRESHOLD = config(
     "MOST_RECENT_CHECK_AGE_THRESHOLD", default=15, cast=int
@@ -131,8 +144,33 @@ MOST_RECENT_CHECK_AGE_THRESHOLD = config(
 STALE_LOCK_THRESHOLD = config("STALE_LOCK_THRESHOLD", default=15, cast=int)
 
 # Queuerd config
-QUEUERD_SLEEP_TIME = config("QUEUERD_SLEEP_TIME", default=1, cast=float)
+QUEUERD_SLEEP_TIME = config("QUEUERD_SLEEP_TIME", default=5, cast=float)
 QUEUERD_CHECK_INTERVAL = config("QUEUERD_CHECK_INTERVAL", default=5, cast=float)
+QUEUERD_FLUSH_INTERVAL = config("QUEUERD_FLUSH_INTERVAL", default=1, cast=float)
+QUEUERD_FLUSH_MAX_PENDING = config("QUEUERD_FLUSH_MAX_PENDING", default=100, cast=int)
+QUEUERD_SHUTDOWN_TIMEOUT = config("QUEUERD_SHUTDOWN_TIMEOUT", default=8, cast=float)
+QUEUERD_BATCH_SIZE = config("QUEUERD_BATCH_SIZE", default=10, cast=int)
+QUEUERD_PROCESSES = config("QUEUERD_PROCESSES", default=1, cast=int)
+QUEUERD_THREADS = config("QUEUERD_THREADS", default=4, cast=int)
+QUEUERD_CHECK_TIMEOUT = config("QUEUERD_CHECK_TIMEOUT", default=10, cast=float)
+QUEUERD_SYNC_INTERVAL = config("QUEUERD_SYNC_INTERVAL", default=10, cast=float)
+QUEUERD_FULL_SYNC_INTERVAL = config(
+    "QUEUERD_FULL_SYNC_INTERVAL", default=300, cast=float
+)
+QUEUERD_SNAPSHOT_DIR = config("QUEUERD_SNAPSHOT_DIR", default=None)
+QUEUERD_SNAPSHOT_SEGMENT_ROWS = config(
+    "QUEUERD_SNAPSHOT_SEGMENT_ROWS", default=1000000, cast=int
+)
+QUEUERD_ROLLUP_INTERVAL = config("QUEUERD_ROLLUP_INTERVAL", default=10, cast=float)
+QUEUERD_ROLLUP_RETENTION_DAYS = config(
+    "QUEUERD_ROLLUP_RETENTION_DAYS", default=14, cast=int
+)
+QUEUERD_ACTIVITY_FLUSH_INTERVAL = config(
+    "QUEUERD_ACTIVITY_FLUSH_INTERVAL", default=60, cast=float
+)
+QUEUERD_ACTIVITY_RETENTION_DAYS = config(
+    "QUEUERD_ACTIVITY_RETENTION_DAYS", default=90, cast=int
+)
 
 # Sentry
 if not DEBUG:  # pragma: no cover
@@ -18,7 +18,14 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import include, path
 
+from data import views as data_views
+
 urlpatterns = [
+    path(
+        "admin/dashboard/",
+        admin.site.admin_view(data_views.dashboard),
+        name="dashboard",
+    ),
     path("admin/", admin.site.urls),
     path("auth/", include("social_django.urls")),
     path("api/", include("api.urls")),
@@ -0,0 +1,250 @@
+import os
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from time import monotonic
+from typing import Dict, List, Optional, Tuple, Type
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.transaction import atomic
+
+from data.models import HourlyActivity, Rule, RuleHourlyActivity, UserHourlyActivity
+
+
+# What came of checking a rule, each counted in the HourlyActivity field of the same
+# name.
+APPLIED = "applied"
+SKIPPED_NOT_PLAYING = "skipped_not_playing"
+SKIPPED_TOO_EARLY = "skipped_too_early"
+SKIPPED_APPLIED_RECENTLY = "skipped_applied_recently"
+ERRORS = "errors"
+OUTCOMES = (
+    APPLIED,
+    SKIPPED_NOT_PLAYING,
+    SKIPPED_TOO_EARLY,
+    SKIPPED_APPLIED_RECENTLY,
+    ERRORS,
+)
+
+# Not counted, as inactive rules shouldn't have been matched in the first place.
+SKIPPED_INACTIVE = "skipped_inactive"
+
+# Rows per INSERT, which keeps well within databases' limits on query parameters.
+UPSERT_BATCH_SIZE = 100
+
+Counts = Dict[str, int]
+
+
+def _hour(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _add(totals: Counts, counts: Counts) -> None:
+    for outcome, count in counts.items():
+        totals[outcome] += count
+
+
+def _upsert(
+    model: Type[HourlyActivity],
+    key: str,
+    rows: List[Tuple[int, datetime, Counts]],
+) -> None:
+    """
+    Add each row's counts to the model's row for the key and hour, creating it if
+    there isn't one yet, with one INSERT ... ON CONFLICT DO UPDATE per batch of rows.
+    Both PostgreSQL and SQLite understand it.
+    """
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    key_column = qn(model._meta.get_field(key).column)
+    hour_field = model._meta.get_field("hour")
+
+    columns = ", ".join([key_column, qn("hour"), *map(qn, OUTCOMES)])
+    row_placeholders = f"({', '.join(['%s'] * (len(OUTCOMES) + 2))})"
+    updates = ", ".join(
+        f"{qn(outcome)} = {table}.{qn(outcome)} + EXCLUDED.{qn(outcome)}"
+        for outcome in OUTCOMES
+    )
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start : start + UPSERT_BATCH_SIZE]
+            params = []
+            for key_id, hour, counts in batch:
+                params.append(key_id)
+                params.append(hour_field.get_db_prep_value(hour, connection))
+                params.extend(counts[outcome] for outcome in OUTCOMES)
+
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) "
+                f"VALUES {', '.join([row_placeholders] * len(batch))} "
+                f"ON CONFLICT ({key_column}, {qn('hour')}) DO UPDATE SET {updates}",
+                params,
+            )
+
+
+class RuleActivityBuffer:
+    """
+    Counts what queuerd does with each rule it checks, by the hour, in memory. flush()
+    adds the counts to the rules' RuleHourlyActivity rows and their owners'
+    UserHourlyActivity rows, a few upserts for however many checks there were, and is
+    due every QUEUERD_ACTIVITY_FLUSH_INTERVAL seconds. Rows older than
+    QUEUERD_ACTIVITY_RETENTION_DAYS are deleted as each hour starts.
+
+    A user's errors are their failed checks, counted with record_failed_check(),
+    whatever the check failed at, rather than their rules' errors added up.
+    """
+
+    def __init__(
+        self, interval: Optional[float] = None, retention: Optional[timedelta] = None
+    ):
+        self._interval = interval
+        self._retention = retention
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Drop any counts that haven't been flushed, such as in a forked process that
+        would otherwise flush its parent's counts a second time.
+        """
+        # A forked process might have been started while another thread held the lock.
+        self._lock = Lock()
+        # Keyed by rule ID and hour.
+        self._counts: Dict[Tuple[int, datetime], Counts] = {}
+        self._owners: Dict[int, int] = {}
+        # Keyed by user ID and hour.
+        self._failed_checks: Dict[Tuple[int, datetime], int] = {}
+        self._last_flush = monotonic()
+        self._hour: Optional[datetime] = None
+
+    @property
+    def interval(self) -> float:
+        if self._interval is None:
+            return settings.QUEUERD_ACTIVITY_FLUSH_INTERVAL
+        return self._interval
+
+    @property
+    def retention(self) -> timedelta:
+        if self._retention is None:
+            return timedelta(days=settings.QUEUERD_ACTIVITY_RETENTION_DAYS)
+        return self._retention
+
+    def record(self, rule: Rule, outcome: str, now: Optional[datetime] = None) -> None:
+        if now is None:
+            now = datetime.now(timezone.utc)
+        key = (rule.id, _hour(now))
+
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = dict.fromkeys(OUTCOMES, 0)
+            counts[outcome] += 1
+            self._owners[rule.id] = rule.owner_id
+
+    def record_failed_check(self, user: User, now: Optional[datetime] = None) -> None:
+        if now is None:
+            now = datetime.now(timezone.utc)
+        key = (user.id, _hour(now))
+
+        with self._lock:
+            self._failed_checks[key] = self._failed_checks.get(key, 0) + 1
+
+    def is_due(self) -> bool:
+        return (
+            bool(self._counts or self._failed_checks)
+            and monotonic() - self._last_flush >= self.interval
+        )
+
+    def flush(self, now: Optional[datetime] = None) -> None:
+        if now is None:
+            now = datetime.now(timezone.utc)
+
+        # Counting carries on in other threads while the counts so far are written.
+        with self._lock:
+            counts, owners = self._counts, self._owners
+            failed_checks = self._failed_checks
+            self._counts, self._owners, self._failed_checks = {}, {}, {}
+            # Even if this flush fails, wait until the next one's due to try again.
+            self._last_flush = monotonic()
+
+        if counts or failed_checks:
+            try:
+                self._write(counts, owners, failed_checks)
+            except Exception:
+                # Put them back, so they go in the next flush instead.
+                with self._lock:
+                    for key, key_counts in counts.items():
+                        _add(
+                            self._counts.setdefault(key, dict.fromkeys(OUTCOMES, 0)),
+                            key_counts,
+                        )
+                    self._owners.update(owners)
+                    for key, failed in failed_checks.items():
+                        self._failed_checks[key] = (
+                            self._failed_checks.get(key, 0) + failed
+                        )
+                raise
+
+        hour = _hour(now)
+        if hour != self._hour:
+            self._hour = hour
+            cutoff = hour - self.retention
+            RuleHourlyActivity.objects.filter(hour__lt=cutoff).delete()
+            UserHourlyActivity.objects.filter(hour__lt=cutoff).delete()
+
+    def _write(
+        self,
+        counts: Dict[Tuple[int, datetime], Counts],
+        owners: Dict[int, int],
+        failed_checks: Dict[Tuple[int, datetime], int],
+    ) -> None:
+        # Rules deleted since they were checked would fail the foreign key, and so
+        # would their owners, if it was their account that was deleted.
+        existing = set(
+            Rule.objects.filter(id__in={rule_id for rule_id, _ in counts}).values_list(
+                "id", flat=True
+            )
+        )
+
+        rule_rows = []
+        user_counts: Dict[Tuple[int, datetime], Counts] = {}
+        # In the same order in every worker, so concurrent flushes can't deadlock.
+        for (rule_id, hour), rule_counts in sorted(counts.items()):
+            if rule_id not in existing:
+                continue
+            rule_rows.append((rule_id, hour, rule_counts))
+            user_totals = user_counts.setdefault(
+                (owners[rule_id], hour), dict.fromkeys(OUTCOMES, 0)
+            )
+            _add(user_totals, rule_counts)
+            # Failing to apply a rule fails the check, which counts for the user below.
+            user_totals[ERRORS] -= rule_counts[ERRORS]
+
+        if failed_checks:
+            existing_users = set(
+                User.objects.filter(
+                    id__in={user_id for user_id, _ in failed_checks}
+                ).values_list("id", flat=True)
+            )
+            for (user_id, hour), failed in failed_checks.items():
+                if user_id not in existing_users:
+                    continue
+                user_totals = user_counts.setdefault(
+                    (user_id, hour), dict.fromkeys(OUTCOMES, 0)
+                )
+                user_totals[ERRORS] += failed
+
+        user_rows = [
+            (user_id, hour, user_counts[user_id, hour])
+            for user_id, hour in sorted(user_counts)
+        ]
+        with atomic():
+            _upsert(RuleHourlyActivity, "rule", rule_rows)
+            _upsert(UserHourlyActivity, "user", user_rows)
+
+
+rule_activity = RuleActivityBuffer()
+
+# Forked queuerd workers count their own checks.
+os.register_at_fork(after_in_child=rule_activity.reset)
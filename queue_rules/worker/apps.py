@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class WorkerConfig(AppConfig):
     name = "worker"
+
+    def ready(self):
+        # Connects the receiver that wakes queuerd up for new users.
+        import worker.wakeup  # noqa: F401
@@ -0,0 +1,300 @@
+import json
+import random
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import sleep
+from typing import List, Optional, Sequence
+from urllib.parse import urlparse
+
+from django.contrib.auth.models import User
+from social_django.models import UserSocialAuth
+
+from data.models import Rule, SongSequenceMember, update_cached_song_sequences
+
+
+BENCHMARK_USERNAME_PREFIX = "queuerd-benchmark-"
+BENCHMARK_TRACK_DURATION_MS = 180000
+
+
+def make_track_ids(pool_size: int) -> List[str]:
+    return [f"benchmarktrack{n:06d}" for n in range(pool_size)]
+
+
+def seed_benchmark_data(
+    num_users: int,
+    rules_per_user: int,
+    sequence_length: int,
+    track_ids: Sequence[str],
+) -> None:
+    """
+    Create users with Spotify credentials, rules and song sequences for the benchmark.
+    Every seeded username starts with BENCHMARK_USERNAME_PREFIX so the data can be
+    told apart from (and cleaned up without touching) real users.
+    """
+    if rules_per_user > len(track_ids):
+        raise ValueError("Need at least as many tracks as rules per user.")
+
+    User.objects.bulk_create(
+        [User(username=f"{BENCHMARK_USERNAME_PREFIX}{n}") for n in range(num_users)]
+    )
+    users = list(User.objects.filter(username__startswith=BENCHMARK_USERNAME_PREFIX))
+
+    UserSocialAuth.objects.bulk_create(
+        [
+            UserSocialAuth(
+                user=user,
+                provider="spotify",
+                uid=user.username,
+                extra_data={
+                    "access_token": f"access-{user.id}",
+                    "refresh_token": f"refresh-{user.id}",
+                },
+            )
+            for user in users
+        ]
+    )
+
+    rng = random.Random(0)
+    Rule.objects.bulk_create(
+        [
+            Rule(owner=user, name=trigger_id, trigger_song_spotify_id=trigger_id)
+            for user in users
+            for trigger_id in rng.sample(track_ids, rules_per_user)
+        ]
+    )
+
+    rules = Rule.objects.filter(owner__username__startswith=BENCHMARK_USERNAME_PREFIX)
+    SongSequenceMember.objects.bulk_create(
+        [
+            SongSequenceMember(
+                rule=rule,
+                name=song_id,
+                song_spotify_id=song_id,
+                sequence_number=sequence_number,
+            )
+            for rule in rules.iterator()
+            for sequence_number, song_id in enumerate(
+                rng.sample(track_ids, min(sequence_length, len(track_ids)))
+            )
+        ]
+    )
+    update_cached_song_sequences(rules)
+
+
+def clear_benchmark_data() -> None:
+    User.objects.filter(username__startswith=BENCHMARK_USERNAME_PREFIX).delete()
+
+
+class _FakeSpotifyHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        # Keep the benchmark output readable.
+        pass
+
+    def _send_json(self, status: int, body: Optional[dict] = None) -> None:
+        payload = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if status == 429:
+            self.send_header("Retry-After", str(self.server.fake.retry_after))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self) -> None:
+        fake = self.server.fake
+        path = urlparse(self.path).path
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+        status, body = fake.respond(self.command, path)
+        self._send_json(status, body)
+
+    do_GET = _handle
+    do_POST = _handle
+    do_PUT = _handle
+
+
+class FakeSpotifyServer:
+    """
+    A local stand-in for the parts of Spotify's Web API and token endpoint that the app
+    uses. Every response is delayed by the configured latency; a fraction of requests
+    can be answered with a 429 (asking to retry after retry_after seconds) or a 503,
+    or stalled for timeout_delay seconds to simulate upstream trouble.
+    """
+
+    def __init__(
+        self,
+        track_ids: Sequence[str],
+        latency: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: int = 0,
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        timeout_delay: float = 6.0,
+        seed: Optional[int] = None,
+    ):
+        self.track_ids = list(track_ids)
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_delay = timeout_delay
+
+        self.requests = Counter()
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.timed_out = 0
+
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeSpotifyServer":
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _FakeSpotifyHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = Thread(
+            target=self._httpd.serve_forever,
+            kwargs={"poll_interval": 0.05},
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self) -> "FakeSpotifyServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _roll(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def respond(self, method: str, path: str) -> tuple:
+        endpoint = self._endpoint_name(method, path)
+        with self._lock:
+            self.requests[endpoint] += 1
+
+        if self.latency:
+            sleep(self.latency)
+
+        if self._roll() < self.rate_limit_rate:
+            with self._lock:
+                self.rate_limited += 1
+            return 429, {"error": {"status": 429, "message": "API rate limit exceeded"}}
+
+        if self._roll() < self.error_rate:
+            with self._lock:
+                self.server_errors += 1
+            return 503, {"error": {"status": 503, "message": "Service unavailable"}}
+
+        if self._roll() < self.timeout_rate:
+            with self._lock:
+                self.timed_out += 1
+            sleep(self.timeout_delay)
+
+        if endpoint == "currently_playing":
+            # Like Spotify, answer with no content when nothing is playing.
+            if not self.track_ids:
+                return 204, None
+            return 200, self._currently_playing()
+        elif endpoint == "add_to_queue":
+            return 204, None
+        elif endpoint == "track":
+            track_id = path.rsplit("/", 1)[-1]
+            return 200, self._track(track_id)
+        elif endpoint == "token":
+            return 200, {
+                "access_token": "refreshed-access-token",
+                "token_type": "Bearer",
+                "expires_in": 3600,
+                "scope": "user-modify-playback-state user-read-playback-state",
+            }
+
+        return 404, {"error": {"status": 404, "message": "Not found"}}
+
+    @staticmethod
+    def _endpoint_name(method: str, path: str) -> str:
+        if path == "/v1/me/player/currently-playing":
+            return "currently_playing"
+        elif path == "/v1/me/player/queue":
+            return "add_to_queue"
+        elif path.startswith("/v1/tracks/"):
+            return "track"
+        elif path == "/api/token":
+            return "token"
+
+        return f"{method} {path}"
+
+    def _track(self, track_id: str) -> dict:
+        return {
+            "id": track_id,
+            "name": track_id,
+            "artists": [{"name": "Benchmark"}],
+            "duration_ms": BENCHMARK_TRACK_DURATION_MS,
+        }
+
+    def _currently_playing(self) -> dict:
+        with self._lock:
+            track_id = self._random.choice(self.track_ids)
+            progress_ms = self._random.randrange(BENCHMARK_TRACK_DURATION_MS)
+
+        return {
+            "is_playing": True,
+            "progress_ms": progress_ms,
+            "item": self._track(track_id),
+        }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        "Ran queuerd for {duration:.1f}s against {users} seeded users.".format(
+            **report
+        ),
+        "Throughput: {throughput:.2f} checks/sec ({checks} checks, {idle} idle loops, "
+        "{errors} errors, {rules_applied} rules applied, {read_timeouts} read "
+        "timeouts)".format(**report),
+        "",
+        "{:<16}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}".format(
+            "Phase (ms)", "count", "mean", "p50", "p95", "p99", "max"
+        ),
+    ]
+
+    for name, summary in sorted(report["phases"].items()):
+        lines.append(
+            "{:<16}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+                name,
+                summary["count"],
+                *(summary[key] * 1000 for key in ("mean", "p50", "p95", "p99", "max")),
+            )
+        )
+
+    lag = report["scheduling_lag"]
+    lines += [
+        "",
+        "Scheduling lag (s): mean {mean:.2f}, p50 {p50:.2f}, p95 {p95:.2f}, "
+        "max {max:.2f}".format(**lag),
+        "",
+        "Fake Spotify: {rate_limited} 429s, {server_errors} 503s and {timed_out} "
+        "timeouts served".format(**report["spotify"]),
+    ]
+    for endpoint, count in sorted(report["spotify"]["requests"].items()):
+        lines.append(f"  {endpoint}: {count} requests")
+
+    return "\n".join(lines)
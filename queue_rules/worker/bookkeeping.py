@@ -0,0 +1,129 @@
+from datetime import datetime
+from threading import Lock
+from time import monotonic
+from typing import Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.transaction import atomic
+
+from data.models import LastCheckLog, Rule, UserLock
+
+
+class Bookkeeping:
+    """
+    Write-behind buffer for the writes queuerd makes after each check: last checked
+    times, rules' last applied times and releasing user locks. Pending writes are
+    combined into a handful of bulk queries when flushed.
+
+    A user's lock is only released in the same transaction that stores their new
+    last checked time, so no worker can see them as due in between.
+    """
+
+    def __init__(
+        self,
+        flush_interval: Optional[float] = None,
+        max_pending: Optional[int] = None,
+    ):
+        if flush_interval is None:
+            flush_interval = settings.QUEUERD_FLUSH_INTERVAL
+        if max_pending is None:
+            max_pending = settings.QUEUERD_FLUSH_MAX_PENDING
+
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._lock = Lock()
+        self._checks = {}
+        self._rules = {}
+        self._user_lock_ids = set()
+        self._last_flush = monotonic()
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._checks) + len(self._rules) + len(self._user_lock_ids)
+
+    def record_check(self, last_check_log: LastCheckLog, checked_at: datetime) -> None:
+        # The log won't have been saved yet if this is the user's first check.
+        with self._lock:
+            self._checks[last_check_log.user_id] = (last_check_log.pk, checked_at)
+
+    def record_apply(self, rule: Rule) -> None:
+        with self._lock:
+            self._rules[rule.id] = rule.last_applied
+
+    def release_lock(self, user_lock: UserLock) -> None:
+        with self._lock:
+            self._user_lock_ids.add(user_lock.id)
+
+    def is_due(self) -> bool:
+        return (
+            self.pending >= self.max_pending
+            or monotonic() - self._last_flush >= self.flush_interval
+        )
+
+    def flush(self) -> None:
+        with self._lock:
+            checks = self._checks
+            rules = self._rules
+            user_lock_ids = list(self._user_lock_ids)
+
+            self._checks = {}
+            self._rules = {}
+            self._user_lock_ids = set()
+            self._last_flush = monotonic()
+
+        if not (checks or rules or user_lock_ids):
+            return
+
+        try:
+            self._write(checks, rules, user_lock_ids)
+        except Exception:
+            # Put everything back so the next flush can retry it.
+            with self._lock:
+                for user_id, check in checks.items():
+                    self._checks.setdefault(user_id, check)
+                for rule_id, last_applied in rules.items():
+                    self._rules.setdefault(rule_id, last_applied)
+                self._user_lock_ids.update(user_lock_ids)
+            raise
+
+    def _write(self, checks: dict, rules: dict, user_lock_ids: list) -> None:
+        new_logs = [
+            LastCheckLog(user_id=user_id, last_checked=checked_at)
+            for user_id, (log_id, checked_at) in checks.items()
+            if log_id is None
+        ]
+        existing_logs = [
+            LastCheckLog(id=log_id, user_id=user_id, last_checked=checked_at)
+            for user_id, (log_id, checked_at) in checks.items()
+            if log_id is not None
+        ]
+
+        with atomic():
+            if new_logs:
+                # Users can delete their accounts while we're holding their check.
+                user_ids = set(
+                    User.objects.filter(
+                        id__in=[log.user_id for log in new_logs]
+                    ).values_list("id", flat=True)
+                )
+                LastCheckLog.objects.bulk_create(
+                    [log for log in new_logs if log.user_id in user_ids]
+                )
+
+            if existing_logs:
+                LastCheckLog.objects.bulk_update(existing_logs, ["last_checked"])
+
+            if rules:
+                Rule.objects.bulk_update(
+                    [
+                        Rule(id=rule_id, last_applied=last_applied)
+                        for rule_id, last_applied in rules.items()
+                    ],
+                    ["last_applied"],
+                )
+
+            if user_lock_ids:
+                UserLock.objects.filter(id__in=user_lock_ids).delete()
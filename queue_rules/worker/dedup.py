@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta, timezone
+from time import monotonic, time
+from typing import NamedTuple, Optional
+
+from django.db import IntegrityError
+from django.db.transaction import atomic
+
+from data.models import Rule, RuleApplyClaim
+
+
+# Checks that put a track's start at most about this many seconds apart count as the
+# same play of it.
+PLAY_START_TOLERANCE = 5
+
+# How often each process deletes claims that have expired.
+PRUNE_INTERVAL = 60
+
+
+class Claim(NamedTuple):
+    rule_id: int
+    slot: int
+
+
+class AppliedRules:
+    """
+    Remembers which play of a track each rule was last applied for, so it isn't
+    applied twice for the same play before its last_applied is written, such as while
+    it's waiting on bookkeeping, or by another worker.
+
+    Plays are told apart by when the track started, going by the local clock and the
+    playback's progress. Claims are RuleApplyClaim rows, so they're shared by every
+    queuerd process on every host, and a claim is a single INSERT that the database
+    only lets one worker make for each play. They expire once the track would have
+    finished.
+    """
+
+    def __init__(self):
+        self._last_prune = monotonic()
+
+    def claim(self, rule: Rule, playback_info: dict) -> Optional[Claim]:
+        """
+        Claim applying the rule for the play of the track in playback_info. Returns
+        the claim, or None if the rule has already been applied for this play.
+        """
+        now = time()
+        started = now - playback_info["progress_ms"] / 1000
+        slot = round(started / PLAY_START_TOLERANCE)
+        expires = datetime.fromtimestamp(now, timezone.utc) + timedelta(
+            seconds=playback_info["item"]["duration_ms"] / 1000 + PLAY_START_TOLERANCE
+        )
+
+        self._prune_if_due(now)
+
+        # Checks of the same play can put its start in the slot either side, so claim
+        # those too. Any other claim on the play overlaps with this one somewhere.
+        try:
+            with atomic():
+                RuleApplyClaim.objects.bulk_create(
+                    [
+                        RuleApplyClaim(
+                            rule_id=rule.id, slot=slot + offset, expires=expires
+                        )
+                        for offset in (-1, 0, 1)
+                    ]
+                )
+        except IntegrityError:  # Someone got there first.
+            return None
+
+        return Claim(rule.id, slot)
+
+    def release(self, claim: Claim) -> None:
+        """
+        Give up a claim, for when the rule couldn't be applied after all.
+        """
+        RuleApplyClaim.objects.filter(
+            rule_id=claim.rule_id, slot__range=(claim.slot - 1, claim.slot + 1)
+        ).delete()
+
+    def _prune_if_due(self, now: float) -> None:
+        if monotonic() - self._last_prune < PRUNE_INTERVAL:
+            return
+
+        self._last_prune = monotonic()
+        RuleApplyClaim.objects.filter(
+            expires__lt=datetime.fromtimestamp(now, timezone.utc)
+        ).delete()
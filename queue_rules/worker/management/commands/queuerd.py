@@ -1,34 +1,96 @@
 import logging
-from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta, timezone
-from time import sleep
-from typing import ContextManager, Optional
+from time import monotonic, time
+from typing import Callable, ContextManager, Dict, List, Optional, Tuple
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+from django.db.models import Prefetch
+from django.db.transaction import atomic
 from django.db.utils import IntegrityError
-from requests.exceptions import ReadTimeout
+from requests.exceptions import ReadTimeout, Timeout
 from spotipy import Spotify
 
+from data.circuit_breaker import CLOSED
+from data.exceptions import CircuitOpen
 from data.models import LastCheckLog, Rule, UserLock
-from data.user_utils import get_spotify_client
+from data.user_utils import (
+    Deadline,
+    get_spotify_client,
+    is_spotify_outage,
+    preload_spotify_credentials,
+    spotify_breaker,
+)
+from worker.activity import (
+    APPLIED,
+    ERRORS,
+    SKIPPED_APPLIED_RECENTLY,
+    SKIPPED_INACTIVE,
+    SKIPPED_NOT_PLAYING,
+    SKIPPED_TOO_EARLY,
+    rule_activity,
+)
+from worker.bookkeeping import Bookkeeping
+from worker.dedup import AppliedRules
+from worker.metrics import Metrics
+from worker.rollups import RollupWriter, worker_name
+from worker.schedule import Schedule, UserState
+from worker.shutdown import DrainTimeout, GracefulShutdown
+from worker.snapshots import Decision, snapshot_log
+from worker.supervisor import Supervisor
+from worker.wakeup import wakeup
 
 
 SHORT_TRACK_CUTOFF_MS = 60000
 TRACK_PROGRESS_CUTOFF = 0.5
 
+# How much longer than a check's deadline we wait on its thread, which should have
+# noticed the deadline itself by then.
+DEADLINE_GRACE = 1
+
 
 logger = logging.getLogger("queuerd")
 
+# Counters and per-phase timings for this process, read by the benchmark harness.
+metrics = Metrics()
+
+applied_rules = AppliedRules()
+
+
+def _start_last_check_log(user: User, bookkeeping: Optional[Bookkeeping]) -> None:
+    # Go ahead and create a last check log while we're at it. With bookkeeping, it gets
+    # inserted when the user's check is flushed instead.
+    last_check_log = LastCheckLog(user=user, last_checked=datetime.now(timezone.utc))
+    if bookkeeping is None:
+        last_check_log.save()
+
+
+def _release_lock(lock: UserLock, bookkeeping: Optional[Bookkeeping]) -> None:
+    if bookkeeping is None:
+        lock.delete()
+    else:
+        bookkeeping.release_lock(lock)
+
 
 @contextmanager
-def get_user() -> ContextManager[Optional[User]]:
+def get_user(
+    bookkeeping: Optional[Bookkeeping] = None,
+    schedule: Optional[Schedule] = None,
+) -> ContextManager[Optional[User]]:
+    if schedule is not None:
+        with get_scheduled_users(schedule, bookkeeping, batch_size=1) as users:
+            yield users[0] if users else None
+        return
+
     # Prioritize users with no last checked data.
-    user = User.objects.filter(lock=None, last_check_log=None).first()
+    user = User.objects.filter(is_active=True, lock=None, last_check_log=None).first()
     if user is not None:
-        # Go ahead and create a last check log while we're at it.
-        LastCheckLog.objects.create(user=user, last_checked=datetime.now(timezone.utc))
+        _start_last_check_log(user, bookkeeping)
     else:
         # Otherwise, find users that haven't been checked for QUEUERD_CHECK_INTERVAL
         # seconds.
@@ -37,6 +99,7 @@ def get_user() -> ContextManager[Optional[User]]:
         )
         user = (
             User.objects.filter(
+                is_active=True,
                 lock=None,
                 last_check_log__last_checked__lte=last_checked_upper_bound,
             )
@@ -56,26 +119,180 @@ def get_user() -> ContextManager[Optional[User]]:
             try:
                 yield user
             finally:
-                lock.delete()
+                _release_lock(lock, bookkeeping)
+
+
+def _load_due_users(
+    schedule: Schedule, states: Dict[int, UserState], now: float
+) -> List[User]:
+    """
+    Load the users who are still due and unlocked, along with everything their checks
+    need, in a fixed number of queries. Our schedule can be behind on other workers'
+    checks, so anyone who isn't actually due is put back on it.
+    """
+    # Rules carry a copy of their song sequences, so those don't need loading.
+    active_rules = Rule.objects.filter(is_active=True).only(
+        "id",
+        "owner_id",
+        "trigger_song_spotify_id",
+        "is_active",
+        "last_applied",
+        "cached_song_sequence",
+    )
+    users = (
+        User.objects.filter(id__in=states, is_active=True, lock=None)
+        .select_related("last_check_log")
+        .only("id", "username", "last_check_log__user", "last_check_log__last_checked")
+        .prefetch_related(
+            Prefetch("rules", queryset=active_rules, to_attr="active_rules")
+        )
+    )
+
+    due_users = []
+    for user in users:
+        state = states[user.id]
+        try:
+            last_checked = user.last_check_log.last_checked
+        except LastCheckLog.DoesNotExist:
+            due_users.append(user)
+            continue
+
+        next_due = last_checked.timestamp() + schedule.interval_for(state)
+        if next_due > now:
+            schedule.schedule(user.id, next_due)
+        else:
+            due_users.append(user)
+
+    # Whoever's left over was locked by someone else, deactivated or deleted. Either
+    # way, try again later, by which time a full sync will have dropped anyone who's
+    # gone.
+    loaded = {user.id for user in users}
+    for user_id in states:
+        if user_id not in loaded:
+            schedule.schedule(user_id, now + schedule.check_interval)
+
+    return due_users
+
+
+def _lock_users(
+    schedule: Schedule, users: List[User], now: float
+) -> Tuple[List[User], List[UserLock]]:
+    locks = [UserLock(user=user) for user in users]
+    try:
+        with atomic():
+            UserLock.objects.bulk_create(locks)
+    except IntegrityError:
+        # Someone else got to one of them first, so go through them one by one.
+        logger.warn("Race condition when trying to lock a batch of users")
+        locks = []
+        for user in users:
+            try:
+                with atomic():
+                    locks.append(UserLock.objects.create(user=user))
+            except IntegrityError:
+                schedule.schedule(user.id, now + schedule.check_interval)
+
+        locked = {lock.user_id for lock in locks}
+        return [user for user in users if user.id in locked], locks
+
+    # Not every database gives us back the IDs from a bulk insert.
+    if any(lock.id is None for lock in locks):
+        lock_ids = dict(
+            UserLock.objects.filter(user__in=users).values_list("user_id", "id")
+        )
+        for lock in locks:
+            lock.id = lock_ids[lock.user_id]
+
+    return users, locks
+
+
+def _attach_locks(users: List[User], locks: List[UserLock]) -> None:
+    locks_by_user = {lock.user_id: lock for lock in locks}
+    for user in users:
+        user.lock = locks_by_user[user.id]
+
+
+@contextmanager
+def get_scheduled_users(
+    schedule: Schedule,
+    bookkeeping: Optional[Bookkeeping] = None,
+    batch_size: Optional[int] = None,
+) -> ContextManager[List[User]]:
+    """
+    Like get_user(), but claims a batch of due users from the in-memory schedule
+    instead of asking the database to sort everyone, and loads them with their
+    credentials, last check logs and active rules up front. Anyone who doesn't get
+    checked is put straight back on the schedule.
+
+    Users are unlocked on the way out, except any taken out of the batch, which are
+    left to whoever took them.
+    """
+    if batch_size is None:
+        batch_size = settings.QUEUERD_BATCH_SIZE
+
+    now = time()
+    states = {}
+    while len(states) < batch_size:
+        state = schedule.pop_due(now)
+        if state is None:
+            break
+        states[state.user_id] = state
+
+    users = _load_due_users(schedule, states, now) if states else []
+    if users:
+        users, locks = _lock_users(schedule, users, now)
+        _attach_locks(users, locks)
+        preload_spotify_credentials([user.id for user in users])
+
+    for user in users:
+        if not hasattr(user, "last_check_log"):
+            _start_last_check_log(user, bookkeeping)
+
+    try:
+        yield users
+    finally:
+        for user in users:
+            _release_lock(user.lock, bookkeeping)
+
+        for user in users:
+            if states[user.id].next_due is None:
+                schedule.schedule(user.id, now)
 
 
 def get_matching_rule(user: User, song_id: str) -> Optional[Rule]:
+    # Users loaded by get_scheduled_users() come with their active rules.
+    if hasattr(user, "active_rules"):
+        for rule in user.active_rules:
+            if rule.trigger_song_spotify_id == song_id:
+                return rule
+        return None
+
     try:
         return user.rules.get(trigger_song_spotify_id=song_id, is_active=True)
     except Rule.DoesNotExist:
         return None
 
 
-def should_apply_rule(rule: Rule, playback_info: dict) -> bool:
+def skip_reason(
+    rule: Rule, playback_info: dict, now: Optional[datetime] = None
+) -> Optional[str]:
+    """
+    Why the rule shouldn't be applied to the playback, as one of the outcomes counted
+    by worker.activity, or None if it should be. Decides as of now, which defaults to
+    the current time.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+
     # Deffo do not apply the rule if the track isn't playing.
     if not playback_info["is_playing"]:
-        return False
+        return SKIPPED_NOT_PLAYING
 
     # Don't apply the rule if it's disabled.
     # This should be a redundant check due to the query in get_matching_rule(),
     # but worth checking anyway here.
     if not rule.is_active:
-        return False
+        return SKIPPED_INACTIVE
 
     # Since we can't inspect the queue with Spotify's API, do some finnicky guesswork.
 
@@ -83,76 +300,485 @@ def should_apply_rule(rule: Rule, playback_info: dict) -> bool:
     # This attempts to avoid the most naive case of applying a rule twice during a
     # song's single play, where the user has not paused at all.
     track_duration_ms = playback_info["item"]["duration_ms"]
-    upper_bound = datetime.now(timezone.utc) - timedelta(milliseconds=track_duration_ms)
+    upper_bound = now - timedelta(milliseconds=track_duration_ms)
     if rule.last_applied is not None and rule.last_applied >= upper_bound:
-        return False
+        return SKIPPED_APPLIED_RECENTLY
 
     # Secondly, if the track is short, just say yes. Further calculations are somewhat
     # meaningless for shorter tracks.
     if track_duration_ms < SHORT_TRACK_CUTOFF_MS:
-        return True
+        return None
 
     # Thirdly, are we sufficiently through enough of the track? If we aren't yet, maybe
     # we just wait for the next run.
     progress_ms = playback_info["progress_ms"]
     if progress_ms / track_duration_ms < TRACK_PROGRESS_CUTOFF:
-        return False
+        return SKIPPED_TOO_EARLY
 
     # If we're at this point, we should apply the rule.
-    return True
+    return None
 
 
-def run_for_user(user: User, client: Spotify) -> None:
-    # Get the user's currently playing track.
-    currently_playing = None
+def should_apply_rule(
+    rule: Rule, playback_info: dict, now: Optional[datetime] = None
+) -> bool:
+    return skip_reason(rule, playback_info, now) is None
 
+
+def run_for_user(
+    user: User, client: Spotify, bookkeeping: Optional[Bookkeeping] = None
+) -> None:
+    # Get the user's currently playing track.
     # Catch ReadTimeout specifically because it happens frequently.
     try:
         currently_playing = client.currently_playing()
     except ReadTimeout:
-        pass
+        metrics.increment("read_timeouts")
+        rule_activity.record_failed_check(user)
+        return
+
+    decision = Decision.FAILED
+    try:
+        decision = _run_for_playback(user, client, currently_playing, bookkeeping)
+    finally:
+        snapshot_log.record(user.id, currently_playing, decision)
 
+
+def _run_for_playback(
+    user: User,
+    client: Spotify,
+    currently_playing: Optional[dict],
+    bookkeeping: Optional[Bookkeeping],
+) -> Decision:
     if currently_playing is None:
-        return
+        return Decision.NOTHING_PLAYING
 
     # Sometimes item can be None.
     if currently_playing["item"] is None:
-        return
+        return Decision.NOTHING_PLAYING
 
     # See if there's a rule for the track.
     currently_playing_track_id = currently_playing["item"]["id"]
     rule = get_matching_rule(user, currently_playing_track_id)
     if rule is None:
         logger.debug(f"Skipping user {user.username}, no matching rule")
-        return
+        return Decision.NO_RULE
 
     # See if we should apply the rule.
-    should_apply = should_apply_rule(rule, currently_playing)
-    if not should_apply:
+    reason = skip_reason(rule, currently_playing)
+    if reason is not None:
         logger.debug(
             f"Not applying existing rule {rule.id} for {currently_playing_track_id}"
         )
-        return
+        if reason != SKIPPED_INACTIVE:
+            rule_activity.record(rule, reason)
+        return Decision.NOT_APPLIED
+
+    # Our last_applied guard can be behind, as bookkeeping writes it later and other
+    # workers may have applied the rule too, so also check no one has applied it for
+    # this play of the track.
+    claim = applied_rules.claim(rule, currently_playing)
+    if claim is None:
+        logger.debug(f"Rule {rule.id} already applied for this play")
+        metrics.increment("duplicate_applies")
+        rule_activity.record(rule, SKIPPED_APPLIED_RECENTLY)
+        return Decision.ALREADY_APPLIED
 
     # Apply the rule.
     logger.info(f"Applying rule {rule.id} for {currently_playing_track_id}")
-    rule.apply(client)
+    queued = []
+    try:
+        if bookkeeping is None:
+            rule.apply(client, queued=queued)
+        else:
+            rule.apply(client, save=False, queued=queued)
+            bookkeeping.record_apply(rule)
+    except Timeout as e:
+        rule_activity.record(rule, ERRORS)
+        if not queued and not isinstance(e, ReadTimeout):
+            # Ran out of time before a single song was sent, so let the next check
+            # try again.
+            applied_rules.release(claim)
+            raise
+        # Some of the sequence might be queued already, so count the rule as applied
+        # rather than risk queueing all of it again next time.
+        rule.last_applied = datetime.now(timezone.utc)
+        if bookkeeping is None:
+            rule.save()
+        else:
+            bookkeeping.record_apply(rule)
+        raise
+    except Exception:
+        rule_activity.record(rule, ERRORS)
+        # The rule isn't recorded as applied either, so let the next check try again.
+        applied_rules.release(claim)
+        raise
+    metrics.increment("rules_applied")
+    rule_activity.record(rule, APPLIED)
+    return Decision.APPLIED
+
+
+def _observe_scheduling_lag(user: User) -> None:
+    # How long past their due time the user was picked up. Users that were just given
+    # a log by get_user() count as on time.
+    due = user.last_check_log.last_checked + timedelta(
+        seconds=settings.QUEUERD_CHECK_INTERVAL
+    )
+    lag = datetime.now(timezone.utc) - due
+    metrics.observe("scheduling_lag", max(lag.total_seconds(), 0.0))
+
+
+def _start_check(user: User) -> None:
+    logger.info(f"Checking user {user.username}")
+    _observe_scheduling_lag(user)
+
+
+def _call_spotify(
+    user: User, bookkeeping: Optional[Bookkeeping], deadline: Deadline
+) -> None:
+    # The part of a check that's spent waiting on Spotify, all of which has to finish
+    # by the deadline. Everything it records goes through bookkeeping or metrics, so
+    # it's safe to run on a check thread.
+    with metrics.timer("client"):
+        client = get_spotify_client(user, deadline=deadline)
+
+    with metrics.timer("check"):
+        run_for_user(user, client, bookkeeping)
+
+
+def _call_spotify_in_thread(
+    user: User, bookkeeping: Optional[Bookkeeping], started: Future
+) -> None:
+    # The check's time starts once a thread picks it up, rather than when it was
+    # queued for one.
+    deadline = Deadline(settings.QUEUERD_CHECK_TIMEOUT)
+    started.set_result(deadline)
+    try:
+        _call_spotify(user, bookkeeping, deadline)
+    finally:
+        # Each check thread has its own database connection, which it only needs to
+        # refresh tokens. Close it if it's past its age, like Django would after a
+        # request.
+        close_old_connections()
+
+
+def _wait_for_check(future: Future, started: Future) -> None:
+    """
+    Wait for a check on the executor to finish, raising whatever it raised, or
+    FutureTimeoutError if it hasn't by shortly after its deadline. A check that's still
+    waiting for a thread after a check's worth of time, as they're all tied up with
+    abandoned checks, is called off.
+    """
+    try:
+        deadline = started.result(
+            timeout=settings.QUEUERD_CHECK_TIMEOUT + DEADLINE_GRACE
+        )
+    except FutureTimeoutError:
+        if future.cancel():
+            raise
+        # It's only just started.
+        deadline = started.result()
 
+    future.result(timeout=deadline.remaining() + DEADLINE_GRACE)
+
+
+def _record_check(
+    user: User, bookkeeping: Optional[Bookkeeping], schedule: Optional[Schedule]
+) -> None:
+    with metrics.timer("bookkeeping"):
+        last_check_log = user.last_check_log
+        if bookkeeping is None:
+            last_check_log.last_checked = datetime.now(timezone.utc)
+            last_check_log.save()
+        else:
+            bookkeeping.record_check(last_check_log, datetime.now(timezone.utc))
+
+        if schedule is not None:
+            schedule.record_check(user.id, time())
+
+    metrics.increment("checks")
+
+
+def _record_timeout(user: User, schedule: Optional[Schedule]) -> None:
+    # A user whose checks keep running out of time is backed off like any other
+    # failure, but they're not worth stopping everyone else's checks for.
+    logger.warning(f"Ran out of time checking user {user.username}")
+    metrics.increment("check_timeouts")
+    rule_activity.record_failed_check(user)
+    if schedule is not None:
+        schedule.record_check(user.id, time(), failed=True)
+
+
+def _record_error(user: User, schedule: Optional[Schedule], error: Exception) -> None:
+    # Errors that are down to Spotify have already been counted by the circuit
+    # breaker, and are backed off like timeouts rather than taking the daemon down
+    # with them. The caller raises anything else.
+    if is_spotify_outage(error):
+        logger.warning(f"Spotify failed checking user {user.username}: {error}")
+    metrics.increment("check_errors")
+    rule_activity.record_failed_check(user)
+    if schedule is not None:
+        schedule.record_check(user.id, time(), failed=True)
+
+
+def _record_shed(user: User, schedule: Optional[Schedule]) -> None:
+    # Spotify's down, which isn't the user's fault, so they're not backed off. They're
+    # not checked either, so their last check stays as it was.
+    metrics.increment("shed_checks")
+    rule_activity.record_failed_check(user)
+    if schedule is not None:
+        delay = max(schedule.check_interval, spotify_breaker.seconds_until_probe())
+        schedule.schedule(user.id, time() + delay)
+
+
+def check_user(
+    user: User,
+    bookkeeping: Optional[Bookkeeping] = None,
+    schedule: Optional[Schedule] = None,
+) -> None:
+    _start_check(user)
+
+    try:
+        _call_spotify(user, bookkeeping, Deadline(settings.QUEUERD_CHECK_TIMEOUT))
+    except Timeout:
+        _record_timeout(user, schedule)
+        return
+    except CircuitOpen:
+        _record_shed(user, schedule)
+        return
+    except Exception as e:
+        _record_error(user, schedule, e)
+        if not is_spotify_outage(e):
+            raise
+        return
+
+    _record_check(user, bookkeeping, schedule)
+
+
+def check_users(
+    users: List[User],
+    bookkeeping: Bookkeeping,
+    schedule: Schedule,
+    executor: ThreadPoolExecutor,
+) -> None:
+    """
+    Check a batch from get_scheduled_users() on the executor's threads, so their time
+    waiting on Spotify overlaps. The schedule is only touched from this thread, and
+    the database too, other than refreshing tokens and claiming rule applies.
+
+    Each check gets QUEUERD_CHECK_TIMEOUT seconds from when one of the executor's
+    threads picks it up, not counting any time spent queued behind other checks.
+    Checks that run out of time count as failed, and checks refused by the circuit
+    breaker are put back without counting either way. If a check's thread hasn't
+    given up by shortly after its deadline, it's taken out of the batch and its user
+    stays locked until it finishes. Checks that fail because of Spotify count as
+    failed too. If any checks fail for other reasons, the first failure is raised
+    once the rest have finished.
+    """
+    futures = []
+    for user in users:
+        _start_check(user)
+        started = Future()
+        future = executor.submit(_call_spotify_in_thread, user, bookkeeping, started)
+        futures.append((user, started, future))
+
+    error = None
+    for user, started, future in futures:
+        try:
+            _wait_for_check(future, started)
+        except FutureTimeoutError:
+            _record_timeout(user, schedule)
+            metrics.increment("abandoned_checks")
+
+            users.remove(user)
+            future.add_done_callback(
+                lambda _, lock=user.lock: _release_lock(lock, bookkeeping)
+            )
+        except Timeout:
+            _record_timeout(user, schedule)
+        except CircuitOpen:
+            _record_shed(user, schedule)
+        except Exception as e:
+            _record_error(user, schedule, e)
+            if error is None and not is_spotify_outage(e):
+                error = e
+        else:
+            _record_check(user, bookkeeping, schedule)
+
+    if error is not None:
+        raise error
+
+
+def run_one(
+    bookkeeping: Optional[Bookkeeping] = None, schedule: Optional[Schedule] = None
+) -> bool:
+    claim_started = monotonic()
+    with get_user(bookkeeping, schedule) as user:
+        metrics.observe("claim", monotonic() - claim_started)
 
-def run_one() -> None:
-    with get_user() as user:
         if user is None:
             logger.debug("No users to check now")
-            return
+            metrics.increment("idle")
+            return False
 
-        logger.info(f"Checking user {user.username}")
+        check_user(user, bookkeeping, schedule)
 
-        client = get_spotify_client(user)
-        run_for_user(user, client)
+    if bookkeeping is None:
+        snapshot_log.flush()
+        if rule_activity.is_due():
+            flush_rule_activity()
+
+    return True
 
-        last_check_log = user.last_check_log
-        last_check_log.last_checked = datetime.now(timezone.utc)
-        last_check_log.save()
+
+def run_batch(
+    bookkeeping: Bookkeeping,
+    schedule: Schedule,
+    executor: Optional[ThreadPoolExecutor] = None,
+    batch_size: Optional[int] = None,
+) -> int:
+    claim_started = monotonic()
+    with get_scheduled_users(schedule, bookkeeping, batch_size) as users:
+        metrics.observe("claim", monotonic() - claim_started)
+
+        if not users:
+            logger.debug("No users to check now")
+            metrics.increment("idle")
+            return 0
+
+        checked = len(users)
+        if executor is None or checked == 1:
+            for user in users:
+                check_user(user, bookkeeping, schedule)
+        else:
+            check_users(users, bookkeeping, schedule, executor)
+
+    return checked
+
+
+def seconds_until_next_due(schedule: Schedule) -> float:
+    # Don't sleep through a sync, as that's how we hear about new users and other
+    # workers' checks.
+    longest = min(settings.QUEUERD_SLEEP_TIME, schedule.seconds_until_sync())
+
+    state = schedule.peek()
+    if state is None:
+        return longest
+
+    return min(max(state.next_due - time(), 0.0), longest)
+
+
+def flush_bookkeeping(bookkeeping: Bookkeeping) -> None:
+    with metrics.timer("flush"):
+        bookkeeping.flush()
+        snapshot_log.flush()
+
+
+def write_rollups(rollups: RollupWriter, schedule: Schedule) -> None:
+    # Only for the dashboard, so not worth stopping checks over.
+    try:
+        with metrics.timer("rollups"):
+            rollups.write(schedule.count_due(time()))
+    except DatabaseError:
+        logger.exception("Couldn't write rollups")
+
+
+def flush_rule_activity() -> None:
+    # Kept in memory until the next flush if it fails, so there's no need to stop
+    # checks over it either.
+    try:
+        with metrics.timer("activity"):
+            rule_activity.flush()
+    except DatabaseError:
+        logger.exception("Couldn't flush rule activity")
+
+
+def _sleep(bookkeeping: Bookkeeping, schedule: Schedule, timeout: float) -> None:
+    # Anyone we've checked stays locked until we flush, so do that first.
+    flush_bookkeeping(bookkeeping)
+    if wakeup.wait(timeout):
+        metrics.increment("woken_early")
+        schedule.request_sync()
+    metrics.observe("idle_sleep", timeout)
+
+
+def run_forever(
+    should_stop: Callable[[], bool] = lambda: False,
+    partition: Optional[Tuple[int, int]] = None,
+    shield: Callable[[], ContextManager] = nullcontext,
+) -> None:
+    bookkeeping = Bookkeeping()
+    # Rebuilt from everyone's last checked times on startup, so there's nothing to
+    # recover after a crash beyond what bookkeeping has already written.
+    schedule = Schedule(partition=partition)
+    rollups = RollupWriter(metrics, worker_name(partition))
+    # Checks mostly wait on Spotify, so a batch's checks are run side by side.
+    executor = None
+    if settings.QUEUERD_THREADS > 1:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.QUEUERD_THREADS, thread_name_prefix="queuerd-check"
+        )
+
+    try:
+        while not should_stop():
+            with metrics.timer("sync"):
+                schedule.sync_if_due()
+
+            # While Spotify's down, don't claim anyone until the circuit breaker's
+            # ready to try it again, and then only claim the one user to probe it with.
+            batch_size = None
+            if spotify_breaker.state() != CLOSED:
+                pause = spotify_breaker.seconds_until_probe()
+                if pause:
+                    metrics.increment("breaker_pauses")
+                    pause = min(pause, settings.QUEUERD_SLEEP_TIME)
+                    _sleep(bookkeeping, schedule, pause)
+                    continue
+                batch_size = 1
+
+            checked = run_batch(bookkeeping, schedule, executor, batch_size)
+
+            if bookkeeping.is_due():
+                flush_bookkeeping(bookkeeping)
+            if rollups.is_due():
+                write_rollups(rollups, schedule)
+            if rule_activity.is_due():
+                flush_rule_activity()
+
+            if should_stop():
+                break
+
+            # Keep going without a pause while there's a backlog.
+            if checked:
+                continue
+
+            # Otherwise sleep until the next user is due, unless something wakes us up
+            # sooner.
+            _sleep(bookkeeping, schedule, seconds_until_next_due(schedule))
+    finally:
+        # Don't leave anyone locked or lose their last check on the way out, even if
+        # we're told to stop again meanwhile. Any checks that timed out and are still
+        # going are left to finish on their own, and their users' locks to go stale.
+        with shield():
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+            flush_bookkeeping(bookkeeping)
+            write_rollups(rollups, schedule)
+            flush_rule_activity()
+
+
+def run_worker(index: int, count: int) -> None:
+    # One of several worker processes started by queuerd --processes, each checking
+    # its own share of the users.
+    try:
+        with GracefulShutdown(settings.QUEUERD_SHUTDOWN_TIMEOUT) as shutdown:
+            run_forever(
+                should_stop=shutdown.should_stop,
+                partition=(index, count),
+                shield=shutdown.shielded,
+            )
+    except DrainTimeout as e:
+        logger.warning(e.message)
 
 
 class Command(BaseCommand):
@@ -166,12 +792,34 @@ class Command(BaseCommand):
             default=False,
             help="Check and run for one user and then exit.",
         )
+        parser.add_argument(
+            "-p",
+            "--processes",
+            type=int,
+            default=settings.QUEUERD_PROCESSES,
+            help=(
+                "Run this many worker processes, sharing the users out between them "
+                "and restarting any that crash."
+            ),
+        )
 
     def handle(self, *args, **options):
         if options["run_once"]:
             run_one()
             return
 
-        while True:
-            run_one()
-            sleep(settings.QUEUERD_SLEEP_TIME)
+        # Stop taking new users on SIGTERM or SIGINT. run_forever() releases every
+        # claim on the way out, even if the check in flight has to be abandoned.
+        try:
+            with GracefulShutdown(settings.QUEUERD_SHUTDOWN_TIMEOUT) as shutdown:
+                if options["processes"] > 1:
+                    supervisor = Supervisor(run_worker, options["processes"], metrics)
+                    supervisor.run(should_stop=shutdown.should_stop)
+                else:
+                    run_forever(
+                        should_stop=shutdown.should_stop, shield=shutdown.shielded
+                    )
+        except DrainTimeout as e:
+            logger.warning(e.message)
+
+        logger.info("queuerd stopped")
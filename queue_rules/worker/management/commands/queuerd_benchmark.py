@@ -0,0 +1,184 @@
+import json
+import logging
+from time import monotonic
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from worker.benchmark import (
+    clear_benchmark_data,
+    FakeSpotifyServer,
+    format_report,
+    make_track_ids,
+    seed_benchmark_data,
+)
+from worker.management.commands import queuerd
+from worker.metrics import summarize
+
+
+PHASES = ("sync", "claim", "client", "check", "bookkeeping", "flush")
+
+
+logger = logging.getLogger("queuerd")
+
+
+def run_benchmark(server: FakeSpotifyServer, duration: float) -> dict:
+    queuerd.metrics.reset()
+
+    started = monotonic()
+    deadline = started + duration
+    errors = 0
+
+    # Spotify's own failures are backed off rather than raised, so anything that gets
+    # out is a real crash. That means a container restart for the real daemon; here we
+    # just count it and carry on, so one crash doesn't end the run.
+    while monotonic() < deadline:
+        try:
+            queuerd.run_forever(should_stop=lambda: monotonic() >= deadline)
+        except Exception:
+            logger.debug("queuerd raised during the benchmark", exc_info=True)
+            errors += 1
+
+    elapsed = monotonic() - started
+    counters = queuerd.metrics.counters()
+    timings = queuerd.metrics.timings()
+
+    return {
+        "duration": elapsed,
+        "checks": counters.get("checks", 0),
+        "idle": counters.get("idle", 0),
+        "errors": errors,
+        "rules_applied": counters.get("rules_applied", 0),
+        "read_timeouts": counters.get("read_timeouts", 0),
+        "throughput": counters.get("checks", 0) / elapsed,
+        "phases": {
+            name: summarize(timings[name]) for name in PHASES if name in timings
+        },
+        "scheduling_lag": summarize(timings.get("scheduling_lag", [])),
+        "spotify": {
+            "requests": dict(server.requests),
+            "rate_limited": server.rate_limited,
+            "server_errors": server.server_errors,
+            "timed_out": server.timed_out,
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds benchmark users, runs queuerd against a fake Spotify server for a fixed "
+        "duration and reports throughput, per-phase latencies and scheduling lag. "
+        "Writes to the configured database, so point it at a disposable one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--rules-per-user", type=int, default=5)
+        parser.add_argument("--sequence-length", type=int, default=3)
+        parser.add_argument(
+            "--track-pool-size",
+            type=int,
+            default=20,
+            help="Number of distinct tracks the fake server plays and rules use.",
+        )
+        parser.add_argument(
+            "-d", "--duration", type=float, default=10, help="Seconds to run for."
+        )
+        parser.add_argument(
+            "--sleep-time",
+            type=float,
+            default=None,
+            help="Override QUEUERD_SLEEP_TIME for the run.",
+        )
+        parser.add_argument(
+            "--check-interval",
+            type=float,
+            default=None,
+            help="Override QUEUERD_CHECK_INTERVAL for the run.",
+        )
+        parser.add_argument(
+            "--latency-ms",
+            type=float,
+            default=0,
+            help="Latency added to every fake Spotify response.",
+        )
+        parser.add_argument(
+            "--rate-limit-rate",
+            type=float,
+            default=0,
+            help="Fraction of fake Spotify requests answered with a 429.",
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=0,
+            help="Fraction of fake Spotify requests answered with a 503.",
+        )
+        parser.add_argument(
+            "--timeout-rate",
+            type=float,
+            default=0,
+            help="Fraction of fake Spotify requests stalled for --timeout-delay.",
+        )
+        parser.add_argument("--timeout-delay", type=float, default=6.0)
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument(
+            "--keep-data",
+            action="store_true",
+            default=False,
+            help="Don't delete the seeded users once the run finishes.",
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            default=False,
+            help="Print the report as JSON for comparing across commits.",
+        )
+
+    def handle(self, *args, **options):
+        if options["verbosity"] < 2:
+            logging.getLogger("queuerd").setLevel(logging.WARNING)
+
+        track_ids = make_track_ids(options["track_pool_size"])
+
+        clear_benchmark_data()
+        seed_benchmark_data(
+            options["users"],
+            options["rules_per_user"],
+            options["sequence_length"],
+            track_ids,
+        )
+
+        overrides = {}
+        if options["sleep_time"] is not None:
+            overrides["QUEUERD_SLEEP_TIME"] = options["sleep_time"]
+        if options["check_interval"] is not None:
+            overrides["QUEUERD_CHECK_INTERVAL"] = options["check_interval"]
+
+        server = FakeSpotifyServer(
+            track_ids,
+            latency=options["latency_ms"] / 1000,
+            rate_limit_rate=options["rate_limit_rate"],
+            error_rate=options["error_rate"],
+            timeout_rate=options["timeout_rate"],
+            timeout_delay=options["timeout_delay"],
+            seed=options["seed"],
+        )
+
+        try:
+            with server, override_settings(
+                SPOTIFY_API_PREFIX=f"{server.url}/v1/",
+                SPOTIFY_TOKEN_URL=f"{server.url}/api/token",
+                **overrides,
+            ):
+                report = run_benchmark(server, options["duration"])
+        finally:
+            if not options["keep_data"]:
+                clear_benchmark_data()
+
+        report["users"] = options["users"]
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+        else:
+            self.stdout.write(format_report(report))
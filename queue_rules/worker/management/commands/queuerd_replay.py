@@ -0,0 +1,134 @@
+import json
+from time import monotonic
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from worker.benchmark import make_track_ids
+from worker.replay import (
+    format_report,
+    heuristics,
+    recorded_timelines,
+    replay,
+    synthetic_timelines,
+)
+from worker.snapshots import read_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays recorded or synthetic listening through queuerd's schedule and "
+        "decision logic on a simulated clock, and reports missed and double rule "
+        "applications and Spotify API calls per user-hour for each check interval. "
+        "Doesn't touch the database or Spotify."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--snapshot-dir",
+            default=None,
+            help="Replay the playback snapshots in this directory instead of "
+            "synthetic listening.",
+        )
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument(
+            "--hours", type=float, default=24, help="Hours of synthetic listening."
+        )
+        parser.add_argument("--rules-per-user", type=int, default=5)
+        parser.add_argument("--track-pool-size", type=int, default=200)
+        parser.add_argument(
+            "--skip-rate",
+            type=float,
+            default=0.2,
+            help="Fraction of synthetic plays skipped part way through.",
+        )
+        parser.add_argument(
+            "--pause-rate",
+            type=float,
+            default=0.05,
+            help="Fraction of synthetic plays paused for a while.",
+        )
+        parser.add_argument(
+            "--repeat-rate",
+            type=float,
+            default=0.05,
+            help="Fraction of synthetic plays followed by the same track again.",
+        )
+        parser.add_argument(
+            "--check-interval",
+            type=float,
+            nargs="+",
+            default=None,
+            help="Check intervals to compare. Defaults to QUEUERD_CHECK_INTERVAL.",
+        )
+        parser.add_argument(
+            "--progress-cutoff",
+            type=float,
+            default=None,
+            help="Override TRACK_PROGRESS_CUTOFF for the replay.",
+        )
+        parser.add_argument(
+            "--short-track-cutoff-ms",
+            type=int,
+            default=None,
+            help="Override SHORT_TRACK_CUTOFF_MS for the replay.",
+        )
+        parser.add_argument(
+            "--failure-rate",
+            type=float,
+            default=0,
+            help="Fraction of checks that fail and are backed off.",
+        )
+        parser.add_argument(
+            "--sequence-length",
+            type=int,
+            default=3,
+            help="Songs queued per rule application, for counting API calls.",
+        )
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            default=False,
+            help="Print the reports as JSON for comparing across commits.",
+        )
+
+    def handle(self, *args, **options):
+        if options["snapshot_dir"] is not None:
+            timelines = recorded_timelines(read_snapshots(options["snapshot_dir"]))
+            if not timelines:
+                raise CommandError(f"No snapshots in {options['snapshot_dir']}")
+        else:
+            timelines = synthetic_timelines(
+                options["users"],
+                options["hours"],
+                make_track_ids(options["track_pool_size"]),
+                options["rules_per_user"],
+                skip_rate=options["skip_rate"],
+                pause_rate=options["pause_rate"],
+                repeat_rate=options["repeat_rate"],
+                seed=options["seed"],
+            )
+
+        check_intervals = options["check_interval"]
+        if check_intervals is None:
+            check_intervals = [settings.QUEUERD_CHECK_INTERVAL]
+
+        reports = []
+        with heuristics(options["progress_cutoff"], options["short_track_cutoff_ms"]):
+            for check_interval in check_intervals:
+                started = monotonic()
+                report = replay(
+                    timelines,
+                    check_interval,
+                    sequence_length=options["sequence_length"],
+                    failure_rate=options["failure_rate"],
+                    seed=options["seed"],
+                )
+                report["elapsed"] = monotonic() - started
+                reports.append(report)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(reports, indent=2, sort_keys=True))
+        else:
+            self.stdout.write(format_report(reports))
@@ -0,0 +1,120 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from math import ceil
+from threading import Lock
+from time import monotonic
+from typing import ContextManager, Dict, Iterable, Tuple
+
+
+# How many timing samples to keep per name. Older samples are dropped so a long-running
+# daemon doesn't grow without bound.
+MAX_SAMPLES = 10000
+
+
+def percentile(samples: Iterable[float], fraction: float) -> float:
+    """
+    Return the nearest-rank percentile of the samples, where fraction is between 0
+    and 1. Returns 0 for no samples.
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+
+    rank = max(ceil(fraction * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize(samples: Iterable[float]) -> dict:
+    samples = list(samples)
+    count = len(samples)
+
+    return {
+        "count": count,
+        "mean": sum(samples) / count if count else 0.0,
+        "p50": percentile(samples, 0.5),
+        "p95": percentile(samples, 0.95),
+        "p99": percentile(samples, 0.99),
+        "max": max(samples) if count else 0.0,
+    }
+
+
+class Metrics:
+    """
+    Thread-safe, in-process counters and timing samples. Timings are in seconds.
+    """
+
+    def __init__(self, max_samples: int = MAX_SAMPLES):
+        self.max_samples = max_samples
+        self._lock = Lock()
+        self._tallies = defaultdict(int)
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters = defaultdict(int)
+            self._timings = defaultdict(lambda: deque(maxlen=self.max_samples))
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+            self._tallies[name] += amount
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            self._timings[name].append(value)
+
+    @contextmanager
+    def timer(self, name: str) -> ContextManager[None]:
+        started = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, monotonic() - started)
+
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def timings(self) -> Dict[str, list]:
+        with self._lock:
+            return {name: list(samples) for name, samples in self._timings.items()}
+
+    def drain(self) -> Tuple[Dict[str, int], Dict[str, list]]:
+        """
+        Return the counters and timings recorded so far and start again from nothing,
+        so they can be handed to merge() elsewhere without counting anything twice.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            timings = {name: list(samples) for name, samples in self._timings.items()}
+            self._counters.clear()
+            self._timings.clear()
+
+        return counters, timings
+
+    def tally(self) -> Dict[str, int]:
+        """
+        Return what's been counted in this process since the last tally. Unlike
+        drain(), it's unaffected by drain(), merge() and reset(), so rollups can be
+        kept alongside the supervisor collecting workers' metrics.
+        """
+        with self._lock:
+            tallies = dict(self._tallies)
+            self._tallies.clear()
+
+        return tallies
+
+    def merge(self, counters: Dict[str, int], timings: Dict[str, list]) -> None:
+        with self._lock:
+            for name, amount in counters.items():
+                self._counters[name] += amount
+            for name, samples in timings.items():
+                self._timings[name].extend(samples)
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": self.counters(),
+            "timings": {
+                name: summarize(samples) for name, samples in self.timings().items()
+            },
+        }
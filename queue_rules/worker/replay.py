@@ -0,0 +1,436 @@
+import random
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import (
+    ContextManager,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+)
+
+from data.models import Rule
+from worker.management.commands import queuerd
+from worker.schedule import Schedule
+from worker.snapshots import Decision, Snapshot
+
+
+# Snapshots with these decisions were of a track the user had a rule for.
+RULE_DECISIONS = frozenset(
+    [
+        Decision.NOT_APPLIED,
+        Decision.APPLIED,
+        Decision.ALREADY_APPLIED,
+        Decision.FAILED,
+    ]
+)
+
+# Synthetic listening: sessions of back to back tracks, with idle gaps between them.
+MEAN_SESSION_SECONDS = 45 * 60
+MEAN_IDLE_SECONDS = 3 * 60 * 60
+MIN_TRACK_DURATION_MS = 30000
+MAX_TRACK_DURATION_MS = 360000
+MAX_PAUSE_SECONDS = 600
+
+
+class Segment(NamedTuple):
+    # Seconds since the epoch. The track's progress moves on from progress_ms at start
+    # while it's playing, and stays put while it's paused.
+    start: float
+    end: float
+    track_id: str
+    duration_ms: int
+    progress_ms: int
+    is_playing: bool
+    # Which play of the track this is, counting from 0 for each timeline.
+    play: int
+
+
+class Timeline:
+    """
+    What one user listened to between start and end, as non-overlapping segments in
+    order. Nothing's playing whenever there's no segment. finished is the plays that
+    were listened to all the way through, which are the ones a rule for the track
+    should have been applied during.
+    """
+
+    def __init__(
+        self,
+        user_id: int,
+        trigger_track_ids: Iterable[str],
+        start: float,
+        end: float,
+    ):
+        self.user_id = user_id
+        self.trigger_track_ids = frozenset(trigger_track_ids)
+        self.start = start
+        self.end = end
+        self.segments: List[Segment] = []
+        self.finished: Set[int] = set()
+        self.plays = 0
+
+    def new_play(self) -> int:
+        self.plays += 1
+        return self.plays - 1
+
+    def add(
+        self,
+        start: float,
+        end: float,
+        track_id: str,
+        duration_ms: int,
+        progress_ms: int,
+        is_playing: bool,
+        play: int,
+    ) -> None:
+        self.segments.append(
+            Segment(start, end, track_id, duration_ms, progress_ms, is_playing, play)
+        )
+
+
+def synthetic_timelines(
+    num_users: int,
+    hours: float,
+    track_ids: Sequence[str],
+    rules_per_user: int,
+    skip_rate: float = 0.2,
+    pause_rate: float = 0.05,
+    repeat_rate: float = 0.05,
+    seed: Optional[int] = None,
+) -> List[Timeline]:
+    """
+    Made-up listening for num_users users over the given number of hours, each with
+    rules for rules_per_user of the tracks. A fraction of plays are skipped part way
+    through, paused for a while, or followed by the same track again.
+    """
+    if rules_per_user > len(track_ids):
+        raise ValueError("Need at least as many tracks as rules per user.")
+
+    rng = random.Random(seed)
+    durations = {
+        track_id: rng.randint(MIN_TRACK_DURATION_MS, MAX_TRACK_DURATION_MS)
+        for track_id in track_ids
+    }
+    end = hours * 60 * 60
+
+    timelines = []
+    for user_id in range(1, num_users + 1):
+        timeline = Timeline(user_id, rng.sample(track_ids, rules_per_user), 0.0, end)
+        now = rng.uniform(0, MEAN_IDLE_SECONDS)
+        while now < end:
+            session_end = now + rng.expovariate(1 / MEAN_SESSION_SECONDS)
+            track_id = None
+            while now < min(session_end, end):
+                if track_id is None or rng.random() >= repeat_rate:
+                    track_id = rng.choice(track_ids)
+                now = _add_synthetic_play(
+                    timeline,
+                    rng,
+                    now,
+                    track_id,
+                    durations[track_id],
+                    skip_rate,
+                    pause_rate,
+                )
+
+            now += rng.expovariate(1 / MEAN_IDLE_SECONDS)
+
+        timelines.append(timeline)
+
+    return timelines
+
+
+def _add_synthetic_play(
+    timeline: Timeline,
+    rng: random.Random,
+    now: float,
+    track_id: str,
+    duration_ms: int,
+    skip_rate: float,
+    pause_rate: float,
+) -> float:
+    play = timeline.new_play()
+    stop_ms = duration_ms
+    if rng.random() < skip_rate:
+        stop_ms = rng.randrange(duration_ms)
+
+    progress_ms = 0
+    if rng.random() < pause_rate:
+        pause_ms = rng.randrange(stop_ms + 1)
+        paused_at = now + pause_ms / 1000
+        resumed_at = paused_at + rng.uniform(0, MAX_PAUSE_SECONDS)
+        timeline.add(now, paused_at, track_id, duration_ms, 0, True, play)
+        timeline.add(
+            paused_at, resumed_at, track_id, duration_ms, pause_ms, False, play
+        )
+        now = resumed_at
+        progress_ms = pause_ms
+
+    stopped_at = now + (stop_ms - progress_ms) / 1000
+    timeline.add(now, stopped_at, track_id, duration_ms, progress_ms, True, play)
+    # Plays cut off by the end of the timeline weren't seen to finish.
+    if stop_ms == duration_ms and stopped_at <= timeline.end:
+        timeline.finished.add(play)
+
+    return stopped_at
+
+
+def recorded_timelines(snapshots: Iterable[Snapshot]) -> List[Timeline]:
+    """
+    Timelines rebuilt from queuerd's playback snapshots. Playback is assumed to have
+    carried on as it was last seen until the next snapshot, or until the track ended.
+    Each user's rules are the tracks they were seen with a rule for.
+    """
+    by_user = defaultdict(list)
+    for snapshot in snapshots:
+        by_user[snapshot.user_id].append(snapshot)
+
+    timelines = []
+    for user_id, user_snapshots in sorted(by_user.items()):
+        user_snapshots.sort(key=lambda snapshot: snapshot.checked_at_ms)
+        timeline = Timeline(
+            user_id,
+            {
+                snapshot.track_id
+                for snapshot in user_snapshots
+                if snapshot.track_id is not None and snapshot.decision in RULE_DECISIONS
+            },
+            user_snapshots[0].checked_at_ms / 1000,
+            user_snapshots[-1].checked_at_ms / 1000,
+        )
+
+        previous = None
+        play = None
+        for snapshot, following in zip(user_snapshots, user_snapshots[1:]):
+            if (
+                snapshot.track_id is None
+                or snapshot.progress_ms is None
+                or snapshot.duration_ms is None
+            ):
+                previous = None
+                continue
+
+            # The same play carries on until the track changes or goes back to the
+            # start.
+            if (
+                previous is None
+                or snapshot.track_id != previous.track_id
+                or snapshot.progress_ms < previous.progress_ms
+            ):
+                play = timeline.new_play()
+            previous = snapshot
+
+            start = snapshot.checked_at_ms / 1000
+            end = following.checked_at_ms / 1000
+            if snapshot.is_playing:
+                ends_at = start + (snapshot.duration_ms - snapshot.progress_ms) / 1000
+                if ends_at <= end:
+                    end = ends_at
+                    timeline.finished.add(play)
+                    previous = None
+
+            timeline.add(
+                start,
+                end,
+                snapshot.track_id,
+                snapshot.duration_ms,
+                snapshot.progress_ms,
+                snapshot.is_playing,
+                play,
+            )
+
+        timelines.append(timeline)
+
+    return timelines
+
+
+@contextmanager
+def heuristics(
+    progress_cutoff: Optional[float] = None,
+    short_track_cutoff_ms: Optional[int] = None,
+) -> ContextManager[None]:
+    """
+    Try different cutoffs in queuerd's decision logic for the duration.
+    """
+    overrides = {
+        "TRACK_PROGRESS_CUTOFF": progress_cutoff,
+        "SHORT_TRACK_CUTOFF_MS": short_track_cutoff_ms,
+    }
+    overrides = {name: value for name, value in overrides.items() if value is not None}
+    originals = {name: getattr(queuerd, name) for name in overrides}
+
+    for name, value in overrides.items():
+        setattr(queuerd, name, value)
+    try:
+        yield
+    finally:
+        for name, value in originals.items():
+            setattr(queuerd, name, value)
+
+
+def replay(
+    timelines: Sequence[Timeline],
+    check_interval: float,
+    sequence_length: int = 3,
+    failure_rate: float = 0.0,
+    seed: Optional[int] = None,
+) -> dict:
+    """
+    Run queuerd's schedule and decision logic over the timelines on a simulated clock,
+    checking each user whenever the schedule says they're due, and report how the
+    rules would have been applied. Checks fail (and are backed off) at failure_rate.
+
+    Only should_apply_rule() decides whether to apply a rule, so double applications
+    are the ones that nothing but the apply claim would have caught.
+    """
+    rng = random.Random(seed)
+    schedule = Schedule(check_interval)
+    timeline_for = {timeline.user_id: timeline for timeline in timelines}
+    cursors = dict.fromkeys(timeline_for, 0)
+    rules = {
+        timeline.user_id: {
+            track_id: Rule(trigger_song_spotify_id=track_id)
+            for track_id in timeline.trigger_track_ids
+        }
+        for timeline in timelines
+    }
+
+    for timeline in timelines:
+        schedule.schedule(
+            timeline.user_id, timeline.start + rng.uniform(0, check_interval)
+        )
+
+    checks = failed_checks = 0
+    applications = Counter()
+    while True:
+        state = schedule.peek()
+        if state is None:
+            break
+
+        now = state.next_due
+        moment = datetime.fromtimestamp(now, timezone.utc)
+        while True:
+            state = schedule.pop_due(now)
+            if state is None:
+                break
+
+            user_id = state.user_id
+            timeline = timeline_for[user_id]
+            if now >= timeline.end:
+                schedule.remove(user_id)
+                continue
+
+            checks += 1
+            if failure_rate and rng.random() < failure_rate:
+                failed_checks += 1
+                schedule.record_check(user_id, now, failed=True)
+                continue
+            schedule.record_check(user_id, now)
+
+            # Users are only ever checked later than last time, so pick up where the
+            # last check left off.
+            segments = timeline.segments
+            cursor = cursors[user_id]
+            while cursor < len(segments) and segments[cursor].end <= now:
+                cursor += 1
+            cursors[user_id] = cursor
+
+            if cursor == len(segments) or segments[cursor].start > now:
+                continue  # Nothing playing.
+
+            segment = segments[cursor]
+            rule = rules[user_id].get(segment.track_id)
+            if rule is None:
+                continue
+
+            progress_ms = segment.progress_ms
+            if segment.is_playing:
+                progress_ms += int((now - segment.start) * 1000)
+            playback_info = {
+                "is_playing": segment.is_playing,
+                "progress_ms": progress_ms,
+                "item": {"id": segment.track_id, "duration_ms": segment.duration_ms},
+            }
+            if queuerd.should_apply_rule(rule, playback_info, moment):
+                rule.last_applied = moment
+                applications[(user_id, segment.play)] += 1
+
+    return _report(
+        timelines, check_interval, sequence_length, checks, failed_checks, applications
+    )
+
+
+def _report(
+    timelines: Sequence[Timeline],
+    check_interval: float,
+    sequence_length: int,
+    checks: int,
+    failed_checks: int,
+    applications: Dict[tuple, int],
+) -> dict:
+    trigger_plays = {
+        (timeline.user_id, segment.play)
+        for timeline in timelines
+        for segment in timeline.segments
+        if segment.track_id in timeline.trigger_track_ids
+    }
+    finished = [
+        (timeline.user_id, play)
+        for timeline in timelines
+        for play in timeline.finished
+        if (timeline.user_id, play) in trigger_plays
+    ]
+
+    applied = sum(applications.values())
+    user_hours = sum(timeline.end - timeline.start for timeline in timelines) / 3600
+    # Two calls to see what's playing per check, as get_spotify_client() makes one to
+    # check the user's access before queuerd makes its own, and one per song queued.
+    api_calls = 2 * checks + applied * sequence_length
+
+    return {
+        "check_interval": check_interval,
+        "users": len(timelines),
+        "user_hours": user_hours,
+        "checks": checks,
+        "failed_checks": failed_checks,
+        "trigger_plays": len(trigger_plays),
+        "finished_trigger_plays": len(finished),
+        "applications": applied,
+        "missed_applications": sum(not applications[play] for play in finished),
+        "double_applications": sum(
+            count - 1 for count in applications.values() if count > 1
+        ),
+        "api_calls": api_calls,
+        "api_calls_per_user_hour": api_calls / user_hours if user_hours else 0.0,
+    }
+
+
+def format_report(reports: Sequence[dict]) -> str:
+    first = reports[0]
+    lines = [
+        "Replayed {users} users over {user_hours:.1f} user-hours, with "
+        "{trigger_plays} plays of tracks with rules, {finished_trigger_plays} of them "
+        "to the end.".format(**first),
+        "",
+        "{:>10}{:>12}{:>10}{:>10}{:>10}{:>10}{:>14}".format(
+            "interval",
+            "checks",
+            "failed",
+            "applied",
+            "missed",
+            "double",
+            "calls/user-h",
+        ),
+    ]
+    for report in reports:
+        lines.append(
+            "{check_interval:>10.1f}{checks:>12}{failed_checks:>10}{applications:>10}"
+            "{missed_applications:>10}{double_applications:>10}"
+            "{api_calls_per_user_hour:>14.1f}".format(**report)
+        )
+
+    return "\n".join(lines)
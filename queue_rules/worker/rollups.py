@@ -0,0 +1,99 @@
+import socket
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.db.transaction import atomic
+
+from data.models import WorkerRollup
+from worker.metrics import Metrics
+
+
+# The Metrics counters rolled up, by the WorkerRollup field they're added to.
+ROLLUP_COUNTERS = {
+    "checks": "checks",
+    "rules_applied": "rules_applied",
+    "check_errors": "check_errors",
+    "check_timeouts": "check_timeouts",
+    "shed_checks": "shed_checks",
+}
+
+
+def worker_name(partition: Optional[Tuple[int, int]] = None) -> str:
+    # Stays the same when a worker's restarted, so it carries on with the same rows.
+    name = socket.gethostname()
+    if partition is not None:
+        name = f"{name}/{partition[0]}"
+    return name[: WorkerRollup._meta.get_field("worker").max_length]
+
+
+def _minute(moment: datetime) -> datetime:
+    return moment.replace(second=0, microsecond=0)
+
+
+class RollupWriter:
+    """
+    Adds what's been counted in a Metrics since the last write to this worker's
+    WorkerRollup row for the current minute, every QUEUERD_ROLLUP_INTERVAL seconds.
+    Each write is an UPDATE of one row (or an INSERT, the first time in a minute), and
+    rows older than QUEUERD_ROLLUP_RETENTION_DAYS are deleted as each minute starts.
+    """
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        worker: str,
+        interval: Optional[float] = None,
+        retention: Optional[timedelta] = None,
+    ):
+        if interval is None:
+            interval = settings.QUEUERD_ROLLUP_INTERVAL
+        if retention is None:
+            retention = timedelta(days=settings.QUEUERD_ROLLUP_RETENTION_DAYS)
+
+        self.metrics = metrics
+        self.worker = worker
+        self.interval = interval
+        self.retention = retention
+
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._last_write = monotonic()
+        self._minute: Optional[datetime] = None
+
+    def is_due(self) -> bool:
+        return monotonic() - self._last_write >= self.interval
+
+    def write(self, backlog: int, now: Optional[datetime] = None) -> None:
+        if now is None:
+            now = datetime.now(timezone.utc)
+        minute = _minute(now)
+        # Even if this write fails, wait until the next one's due to try again.
+        self._last_write = monotonic()
+
+        for name, amount in self.metrics.tally().items():
+            if name in ROLLUP_COUNTERS:
+                self._pending[ROLLUP_COUNTERS[name]] += amount
+
+        deltas = {field: self._pending[field] for field in ROLLUP_COUNTERS.values()}
+        rows = WorkerRollup.objects.filter(minute=minute, worker=self.worker)
+        changes = {field: F(field) + delta for field, delta in deltas.items()}
+
+        if not rows.update(backlog=backlog, **changes):
+            try:
+                with atomic():
+                    WorkerRollup.objects.create(
+                        minute=minute, worker=self.worker, backlog=backlog, **deltas
+                    )
+            except IntegrityError:  # A previous run of this worker got there first.
+                rows.update(backlog=backlog, **changes)
+
+        # Only once it's written, so anything that failed to be goes in the next write.
+        self._pending.clear()
+
+        if minute != self._minute:
+            self._minute = minute
+            WorkerRollup.objects.filter(minute__lt=minute - self.retention).delete()
@@ -0,0 +1,248 @@
+from datetime import datetime, timedelta, timezone
+from heapq import heapify, heappop, heappush
+from time import monotonic
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.db.models.functions import Mod
+
+from data.models import LastCheckLog
+
+
+# Checks are written behind a buffer and workers' clocks drift, so each incremental sync
+# also re-reads checks from a little before the previous one started.
+SYNC_OVERLAP = timedelta(seconds=10)
+
+# Users who keep failing are checked at most 2 ** MAX_BACKOFF times less often.
+MAX_BACKOFF = 5
+
+
+class UserState:
+    """
+    Everything queuerd needs to schedule a user, without holding on to model instances.
+    Times are seconds since the epoch, and next_due is None while the user is claimed.
+    """
+
+    __slots__ = ("user_id", "next_due", "backoff")
+
+    def __init__(self, user_id: int, next_due: Optional[float], backoff: int = 0):
+        self.user_id = user_id
+        self.next_due = next_due
+        self.backoff = backoff
+
+    def __repr__(self):
+        return (
+            f"UserState(user_id={self.user_id}, next_due={self.next_due}, "
+            f"backoff={self.backoff})"
+        )
+
+
+class Schedule:
+    """
+    In-memory index of when each user is next due for a check, so picking the next user
+    doesn't need the database to sort everyone.
+
+    Users are compact UserState records kept in a min-heap by next due time. Moving a
+    user just pushes a new heap entry, and the old one is dropped once it reaches the
+    top (lazy deletion).
+    """
+
+    def __init__(
+        self,
+        check_interval: Optional[float] = None,
+        sync_interval: Optional[float] = None,
+        full_sync_interval: Optional[float] = None,
+        partition: Optional[Tuple[int, int]] = None,
+    ):
+        if check_interval is None:
+            check_interval = settings.QUEUERD_CHECK_INTERVAL
+        if sync_interval is None:
+            sync_interval = settings.QUEUERD_SYNC_INTERVAL
+        if full_sync_interval is None:
+            full_sync_interval = settings.QUEUERD_FULL_SYNC_INTERVAL
+
+        self.check_interval = check_interval
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        # (index, count) when this is one of several processes sharing the users out
+        # between them, in which case only users whose ID % count == index are ours.
+        self.partition = partition
+
+        self._states: Dict[int, UserState] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self._max_user_id = 0
+        self._synced_at: Optional[datetime] = None
+        self._next_sync = 0.0
+        self._next_full_sync = 0.0
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._states
+
+    def get(self, user_id: int) -> Optional[UserState]:
+        return self._states.get(user_id)
+
+    def states(self) -> Iterable[UserState]:
+        return self._states.values()
+
+    def interval_for(self, state: UserState) -> float:
+        return self.check_interval * 2 ** min(state.backoff, MAX_BACKOFF)
+
+    def schedule(self, user_id: int, next_due: float) -> UserState:
+        state = self._states.get(user_id)
+        if state is None:
+            state = UserState(user_id, None)
+            self._states[user_id] = state
+            self._max_user_id = max(self._max_user_id, user_id)
+
+        if state.next_due != next_due:
+            state.next_due = next_due
+            heappush(self._heap, (next_due, user_id))
+            self._compact_if_needed()
+
+        return state
+
+    def remove(self, user_id: int) -> None:
+        self._states.pop(user_id, None)
+
+    def peek(self) -> Optional[UserState]:
+        while self._heap:
+            next_due, user_id = self._heap[0]
+            state = self._states.get(user_id)
+            if state is not None and state.next_due == next_due:
+                return state
+
+            heappop(self._heap)
+
+        return None
+
+    def count_due(self, now: float) -> int:
+        # Goes through everyone, so it's for the occasional rollup, not every batch.
+        return sum(
+            1
+            for state in self._states.values()
+            if state.next_due is not None and state.next_due <= now
+        )
+
+    def pop_due(self, now: float) -> Optional[UserState]:
+        """
+        Take the user who's been due the longest, if anyone's due by now. They're out
+        of the schedule until they're rescheduled, normally by record_check().
+        """
+        state = self.peek()
+        if state is None or state.next_due > now:
+            return None
+
+        heappop(self._heap)
+        state.next_due = None
+        return state
+
+    def record_check(
+        self, user_id: int, checked_at: float, failed: bool = False
+    ) -> None:
+        state = self._states.get(user_id)
+        if state is None:
+            return
+
+        state.backoff = min(state.backoff + 1, MAX_BACKOFF) if failed else 0
+        self.schedule(user_id, checked_at + self.interval_for(state))
+
+    def request_sync(self) -> None:
+        self._next_sync = 0.0
+
+    def seconds_until_sync(self) -> float:
+        return max(self._next_sync - monotonic(), 0.0)
+
+    def sync_if_due(self) -> None:
+        now = monotonic()
+        if now < self._next_sync:
+            return
+
+        full = now >= self._next_full_sync
+        self.sync(full=full)
+
+        self._next_sync = now + self.sync_interval
+        if full:
+            self._next_full_sync = now + self.full_sync_interval
+
+    def sync(self, full: bool = False) -> None:
+        """
+        Bring the schedule up to date with the database. The first sync, or a full one,
+        reads every user; others only read new users and checks made since the
+        previous sync. Only full syncs notice deleted users.
+        """
+        started = datetime.now(timezone.utc)
+        full = full or self._synced_at is None
+
+        # Deactivated users, such as those whose accounts are being deleted, aren't
+        # checked.
+        users = self._partitioned(User.objects.filter(is_active=True), "id")
+        if not full:
+            users = users.filter(id__gt=self._max_user_id)
+
+        rows = list(users.values_list("id", "last_check_log__last_checked"))
+
+        if full:
+            user_ids = {user_id for user_id, _ in rows}
+            for user_id in list(self._states):
+                if user_id not in user_ids:
+                    self.remove(user_id)
+
+        for user_id, last_checked in rows:
+            self._load(user_id, last_checked)
+
+        if not full:
+            checks = self._partitioned(LastCheckLog.objects.all(), "user_id").filter(
+                last_checked__gt=self._synced_at - SYNC_OVERLAP,
+                user_id__lte=self._max_user_id,
+            )
+            for user_id, last_checked in checks.values_list("user_id", "last_checked"):
+                self._load(user_id, last_checked)
+
+        self._synced_at = started
+
+    def _partitioned(self, queryset: QuerySet, user_id_field: str) -> QuerySet:
+        if self.partition is None:
+            return queryset
+
+        index, count = self.partition
+        return queryset.annotate(partition=Mod(user_id_field, count)).filter(
+            partition=index
+        )
+
+    def _load(self, user_id: int, last_checked: Optional[datetime]) -> None:
+        state = self._states.get(user_id)
+        if state is None:
+            # Users who've never been checked are due straight away.
+            next_due = 0.0
+            if last_checked is not None:
+                next_due = last_checked.timestamp() + self.check_interval
+
+            self.schedule(user_id, next_due)
+            return
+
+        # Leave users we've claimed alone, and only ever move users later, as we might
+        # know about a check of theirs that hasn't been written yet.
+        if last_checked is None or state.next_due is None:
+            return
+
+        next_due = last_checked.timestamp() + self.interval_for(state)
+        if next_due > state.next_due:
+            self.schedule(user_id, next_due)
+
+    def _compact_if_needed(self) -> None:
+        # Don't let stale entries pile up when users are rescheduled faster than
+        # they're popped.
+        if len(self._heap) <= 2 * len(self._states) + 64:
+            return
+
+        self._heap = [
+            (state.next_due, state.user_id)
+            for state in self._states.values()
+            if state.next_due is not None
+        ]
+        heapify(self._heap)
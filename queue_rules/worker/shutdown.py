@@ -0,0 +1,100 @@
+import logging
+import signal
+from contextlib import contextmanager
+from threading import Event
+from typing import Iterator
+
+from worker.wakeup import wakeup
+
+
+logger = logging.getLogger("queuerd")
+
+
+class DrainTimeout(Exception):
+    def __init__(self, reason):
+        self.message = f"Gave up on in-flight checks: {reason}"
+        super().__init__(self.message)
+
+
+class GracefulShutdown:
+    """
+    Turns SIGTERM and SIGINT into a request for queuerd to stop taking new users.
+
+    Whatever is in flight when the signal arrives gets timeout seconds to finish. If it
+    hasn't by then, or if a second signal arrives, DrainTimeout is raised in the main
+    thread so the caller can still release its claims on the way out. Releasing them
+    happens inside shielded(), which nothing interrupts.
+    """
+
+    SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.requested = Event()
+        self._shielded = False
+        self._previous_handlers = {}
+
+    def __enter__(self) -> "GracefulShutdown":
+        for signum in self.SIGNALS + (signal.SIGALRM,):
+            self._previous_handlers[signum] = signal.getsignal(signum)
+
+        for signum in self.SIGNALS:
+            signal.signal(signum, self._handle_signal)
+        signal.signal(signal.SIGALRM, self._handle_alarm)
+
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._disarm()
+        for signum, handler in self._previous_handlers.items():
+            signal.signal(signum, handler)
+
+    def should_stop(self) -> bool:
+        if not self.requested.is_set():
+            return False
+
+        # Callers only ask between checks, so everything has drained and the deadline
+        # no longer applies.
+        self._disarm()
+        return True
+
+    @contextmanager
+    def shielded(self) -> Iterator[None]:
+        """
+        For the last writes on the way out, which would lose buffered checks and leave
+        users locked if DrainTimeout cut them short. Inside, the deadline's disarmed
+        and any more signals are ignored.
+        """
+        self._shielded = True
+        self._disarm()
+        try:
+            yield
+        finally:
+            self._shielded = False
+
+    def _disarm(self) -> None:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+    def _handle_signal(self, signum, frame) -> None:
+        name = signal.Signals(signum).name
+
+        if self._shielded:
+            logger.warning(f"Received {name}, but still finishing up")
+            self.requested.set()
+            return
+
+        if self.requested.is_set():
+            raise DrainTimeout(f"received {name} again")
+
+        logger.info(
+            f"Received {name}, stopping after in-flight checks "
+            f"(waiting up to {self.timeout} seconds)"
+        )
+        self.requested.set()
+        wakeup.interrupt()
+        signal.setitimer(signal.ITIMER_REAL, self.timeout)
+
+    def _handle_alarm(self, signum, frame) -> None:
+        if self._shielded:
+            return
+        raise DrainTimeout(f"still running after {self.timeout} seconds")
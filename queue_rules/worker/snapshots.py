@@ -0,0 +1,352 @@
+import logging
+import mmap
+import os
+import struct
+from array import array
+from enum import IntEnum
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Union
+
+from django.conf import settings
+
+
+# Segment files start with a header of MAGIC, how many rows the segment has room for
+# and how many it holds so far, padded out to HEADER_SIZE bytes. After that, each
+# column in COLUMNS takes up a contiguous block of capacity values, in native byte
+# order, so a column can be read straight out of a memory-mapped segment.
+MAGIC = b"QRSNAP01"
+HEADER = struct.Struct("=8sQQ")
+HEADER_SIZE = 64
+
+TRACK_ID_LENGTH = 22
+
+# Name and array type code (or width in bytes, for track IDs) of each column. Widest
+# first, so every column stays aligned as long as capacity is a multiple of 8.
+COLUMNS = (
+    ("checked_at_ms", "q"),
+    ("user_id", "q"),
+    ("progress_ms", "i"),
+    ("duration_ms", "i"),
+    ("track_id", TRACK_ID_LENGTH),
+    ("is_playing", "B"),
+    ("decision", "B"),
+)
+
+# Each process buffers up to this many snapshots between writes.
+MAX_BUFFERED = 1024
+
+SEGMENT_SUFFIX = ".snap"
+
+
+logger = logging.getLogger("queuerd")
+
+
+class Decision(IntEnum):
+    NOTHING_PLAYING = 0
+    NO_RULE = 1
+    NOT_APPLIED = 2
+    APPLIED = 3
+    ALREADY_APPLIED = 4
+    FAILED = 5
+
+
+class Snapshot(NamedTuple):
+    checked_at_ms: int
+    user_id: int
+    # None when Spotify didn't say.
+    track_id: Optional[str]
+    progress_ms: Optional[int]
+    duration_ms: Optional[int]
+    is_playing: bool
+    decision: Decision
+
+
+def _width(column_type: Union[str, int]) -> int:
+    if isinstance(column_type, int):
+        return column_type
+    return array(column_type).itemsize
+
+
+def _column_offsets(capacity: int) -> Dict[str, int]:
+    offsets = {}
+    offset = HEADER_SIZE
+    for name, column_type in COLUMNS:
+        offsets[name] = offset
+        offset += capacity * _width(column_type)
+
+    offsets[None] = offset  # The end of the segment.
+    return offsets
+
+
+def _encode_track_id(track_id: Optional[str]) -> bytes:
+    # Spotify's track IDs are all the same length, and anything else (such as a local
+    # file, which has no ID) is stored as unknown.
+    if track_id is None or len(track_id) != TRACK_ID_LENGTH:
+        return bytes(TRACK_ID_LENGTH)
+    return track_id.encode("ascii")
+
+
+def _decode_track_id(value: bytes) -> Optional[str]:
+    if not any(value):
+        return None
+    return value.decode("ascii")
+
+
+class SnapshotLog:
+    """
+    Append-only log of what queuerd saw on each check and what it decided, for tuning
+    how it decides offline. Snapshots are buffered and written to fixed-size segment
+    files in directory, each only ever written by the process that created it.
+
+    Writes are only ever appended, and a segment's row count is updated after its
+    rows are written, so a reader sees every complete row even if we crash mid-write.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[Union[str, Path]] = None,
+        segment_rows: Optional[int] = None,
+    ):
+        self._directory = directory
+        self._segment_rows = segment_rows
+        self._fd = None
+        self._segments = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Drop any buffered snapshots and start a new segment next time, such as in a
+        forked process that would otherwise write to its parent's.
+        """
+        # A forked process might have been started while another thread held the lock.
+        self._lock = Lock()
+        if self._fd is not None:
+            os.close(self._fd)
+
+        self._buffer = {name: self._new_column(name) for name, _ in COLUMNS}
+        self._buffered = 0
+        self._fd = None
+        self._capacity = 0
+        self._rows = 0
+        self._offsets = {}
+
+    @property
+    def directory(self) -> Optional[Path]:
+        directory = self._directory
+        if directory is None:
+            directory = settings.QUEUERD_SNAPSHOT_DIR
+        return None if directory is None else Path(directory)
+
+    @property
+    def segment_rows(self) -> int:
+        segment_rows = self._segment_rows
+        if segment_rows is None:
+            segment_rows = settings.QUEUERD_SNAPSHOT_SEGMENT_ROWS
+        # Keeps every column aligned.
+        return -(-segment_rows // 8) * 8
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def record(
+        self,
+        user_id: int,
+        playback_info: Optional[dict],
+        decision: Decision,
+    ) -> None:
+        if not self.enabled:
+            return
+
+        track_id = progress_ms = duration_ms = None
+        is_playing = False
+        if playback_info is not None:
+            is_playing = bool(playback_info.get("is_playing"))
+            progress_ms = playback_info.get("progress_ms")
+            item = playback_info.get("item")
+            if item is not None:
+                track_id = item.get("id")
+                duration_ms = item.get("duration_ms")
+
+        with self._lock:
+            self._buffer["checked_at_ms"].append(int(time() * 1000))
+            self._buffer["user_id"].append(user_id)
+            self._buffer["progress_ms"].append(
+                -1 if progress_ms is None else progress_ms
+            )
+            self._buffer["duration_ms"].append(
+                -1 if duration_ms is None else duration_ms
+            )
+            self._buffer["track_id"].extend(_encode_track_id(track_id))
+            self._buffer["is_playing"].append(is_playing)
+            self._buffer["decision"].append(decision)
+            self._buffered += 1
+
+            if self._buffered >= MAX_BUFFERED:
+                self._write_or_drop()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._buffered:
+                self._write_or_drop()
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self.reset()
+
+    def _new_column(self, name: str) -> Union[array, bytearray]:
+        column_type = dict(COLUMNS)[name]
+        return bytearray() if isinstance(column_type, int) else array(column_type)
+
+    def _open_segment(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+
+        directory = self.directory
+        directory.mkdir(parents=True, exist_ok=True)
+        # Named so segments sort in the order they were started.
+        self._segments += 1
+        name = (
+            f"{int(time() * 1000):015d}-{os.getpid():07d}-{self._segments:06d}"
+            f"{SEGMENT_SUFFIX}"
+        )
+
+        self._capacity = self.segment_rows
+        self._rows = 0
+        self._offsets = _column_offsets(self._capacity)
+        path = directory / name
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            # Sparse on most filesystems, so only the rows written take up space.
+            os.ftruncate(self._fd, self._offsets[None])
+            os.pwrite(self._fd, HEADER.pack(MAGIC, self._capacity, 0), 0)
+        except OSError:
+            # Don't leave a segment without a header behind for readers to trip on.
+            os.close(self._fd)
+            self._fd = None
+            path.unlink()
+            raise
+
+    def _write_or_drop(self) -> None:
+        # Snapshots are only for analysis, so they're not worth stopping checks for.
+        try:
+            self._write()
+        except OSError:
+            logger.exception(f"Dropped {self._buffered} playback snapshots")
+            self._buffer = {name: self._new_column(name) for name, _ in COLUMNS}
+            self._buffered = 0
+            # Whatever went wrong, start over with a new segment.
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def _write(self) -> None:
+        written = 0
+        while written < self._buffered:
+            if self._fd is None or self._rows == self._capacity:
+                self._open_segment()
+
+            count = min(self._buffered - written, self._capacity - self._rows)
+            for name, column_type in COLUMNS:
+                width = _width(column_type)
+                values = memoryview(self._buffer[name]).cast("B")
+                os.pwrite(
+                    self._fd,
+                    values[written * width : (written + count) * width],
+                    self._offsets[name] + self._rows * width,
+                )
+
+            self._rows += count
+            os.pwrite(self._fd, HEADER.pack(MAGIC, self._capacity, self._rows), 0)
+            written += count
+
+        self._buffer = {name: self._new_column(name) for name, _ in COLUMNS}
+        self._buffered = 0
+
+
+class SnapshotSegment:
+    """
+    One memory-mapped segment file. column() gives a column's values without copying
+    them, and iterating gives each row as a Snapshot. Views from column() need to be
+    released before the segment is closed.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.capacity, self.rows = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{self.path} isn't a snapshot segment")
+
+        self._offsets = _column_offsets(self.capacity)
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __enter__(self) -> "SnapshotSegment":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def column(self, name: str) -> memoryview:
+        """
+        The segment's values for the column, as a memoryview of ints. Track IDs come
+        as raw bytes, TRACK_ID_LENGTH per row.
+        """
+        column_type = dict(COLUMNS)[name]
+        width = _width(column_type)
+        start = self._offsets[name]
+        values = memoryview(self._mmap)[start : start + self.rows * width]
+        return values if isinstance(column_type, int) else values.cast(column_type)
+
+    def __iter__(self) -> Iterator[Snapshot]:
+        columns = {name: self.column(name) for name, _ in COLUMNS}
+        try:
+            for row in range(self.rows):
+                track_id = columns["track_id"][
+                    row * TRACK_ID_LENGTH : (row + 1) * TRACK_ID_LENGTH
+                ]
+                progress_ms = columns["progress_ms"][row]
+                duration_ms = columns["duration_ms"][row]
+                yield Snapshot(
+                    checked_at_ms=columns["checked_at_ms"][row],
+                    user_id=columns["user_id"][row],
+                    track_id=_decode_track_id(bytes(track_id)),
+                    progress_ms=None if progress_ms < 0 else progress_ms,
+                    duration_ms=None if duration_ms < 0 else duration_ms,
+                    is_playing=bool(columns["is_playing"][row]),
+                    decision=Decision(columns["decision"][row]),
+                )
+        finally:
+            for values in columns.values():
+                values.release()
+
+
+def list_segments(directory: Union[str, Path]) -> List[Path]:
+    return sorted(Path(directory).glob(f"*{SEGMENT_SUFFIX}"))
+
+
+def read_snapshots(directory: Union[str, Path]) -> Iterator[Snapshot]:
+    """
+    Every snapshot in the directory's segments, in roughly the order they were taken.
+    Segments written by different processes at the same time aren't interleaved.
+    """
+    for path in list_segments(directory):
+        with SnapshotSegment(path) as segment:
+            yield from segment
+
+
+snapshot_log = SnapshotLog()
+
+# Forked queuerd workers write segments of their own.
+os.register_at_fork(after_in_child=snapshot_log.reset)
@@ -0,0 +1,249 @@
+import logging
+import multiprocessing
+import os
+from multiprocessing.connection import Connection, wait
+from threading import Event, Thread
+from time import monotonic
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.db import connections
+
+from worker.metrics import Metrics
+
+
+# Crashed workers are restarted after this many seconds, doubling each time one crashes
+# again soon after starting, up to MAX_RESTART_DELAY.
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 60
+
+# Workers that ran for at least this many seconds before crashing are restarted with
+# the shortest delay again.
+STABLE_UPTIME = 60
+
+# How often workers send the supervisor their metrics, in seconds.
+REPORT_INTERVAL = 5
+
+# How long the supervisor goes without checking for crashed workers or a request to
+# stop, in seconds.
+POLL_INTERVAL = 1
+
+# On shutdown, workers get this many seconds on top of QUEUERD_SHUTDOWN_TIMEOUT to exit
+# before they're killed.
+KILL_GRACE = 2
+
+
+logger = logging.getLogger("queuerd")
+
+_fork = multiprocessing.get_context("fork")
+
+
+def _send_metrics(connection: Connection, metrics: Metrics) -> None:
+    try:
+        connection.send(metrics.drain())
+    except OSError:  # The supervisor's gone, so there's no one to tell.
+        pass
+
+
+def _run_worker(
+    target: Callable[[int, int], None],
+    index: int,
+    count: int,
+    metrics: Metrics,
+    connection: Connection,
+    report_interval: float,
+) -> None:
+    # Keep to our own process group, so ^C in a terminal only reaches the supervisor,
+    # which passes it on.
+    os.setpgid(0, 0)
+
+    # We start out with a copy of the supervisor's totals.
+    metrics.reset()
+
+    stopped = Event()
+
+    def report():
+        while not stopped.wait(report_interval):
+            _send_metrics(connection, metrics)
+
+    reporter = Thread(target=report, daemon=True)
+    reporter.start()
+    try:
+        target(index, count)
+    finally:
+        stopped.set()
+        reporter.join()
+        _send_metrics(connection, metrics)
+        connection.close()
+
+
+class _Worker:
+    def __init__(self, index: int, restart_delay: float):
+        self.index = index
+        self.process = None
+        self.connection = None
+        self.started_at = 0.0
+        self.restart_at = 0.0
+        self.restart_delay = restart_delay
+
+
+class Supervisor:
+    """
+    Runs queuerd as several worker processes on one host, restarting any that crash.
+
+    Each worker is forked to run target(index, count), which should only check users
+    whose ID % count == index, and opens its own database connection and Spotify
+    sessions. Workers send their metrics here every report_interval seconds, where
+    they're merged into metrics.
+    """
+
+    def __init__(
+        self,
+        target: Callable[[int, int], None],
+        processes: int,
+        metrics: Metrics,
+        shutdown_timeout: Optional[float] = None,
+        report_interval: float = REPORT_INTERVAL,
+        restart_delay: float = RESTART_DELAY,
+    ):
+        if shutdown_timeout is None:
+            shutdown_timeout = settings.QUEUERD_SHUTDOWN_TIMEOUT
+
+        self.target = target
+        self.processes = processes
+        self.metrics = metrics
+        self.shutdown_timeout = shutdown_timeout
+        self.report_interval = report_interval
+        self.restart_delay = restart_delay
+
+        self._workers = [_Worker(index, restart_delay) for index in range(processes)]
+
+    def run(self, should_stop: Callable[[], bool] = lambda: False) -> None:
+        try:
+            for worker in self._workers:
+                self._start(worker)
+
+            while not should_stop():
+                self._wait(self._seconds_until_restart())
+
+                for worker in self._workers:
+                    if worker.process is not None and not worker.process.is_alive():
+                        self._reap(worker)
+                    elif worker.process is None and worker.restart_at <= monotonic():
+                        self._start(worker)
+        finally:
+            self._stop()
+
+        logger.info(f"queuerd workers' totals: {self.metrics.counters()}")
+
+    def _start(self, worker: _Worker) -> None:
+        # Don't let the worker share our database connection, if we have one.
+        connections.close_all()
+
+        reader, writer = _fork.Pipe(duplex=False)
+        worker.process = _fork.Process(
+            target=_run_worker,
+            args=(
+                self.target,
+                worker.index,
+                self.processes,
+                self.metrics,
+                writer,
+                self.report_interval,
+            ),
+            name=f"queuerd-{worker.index}",
+            # Killed on our way out, should we somehow not stop them ourselves.
+            daemon=True,
+        )
+        worker.process.start()
+        writer.close()
+
+        worker.connection = reader
+        worker.started_at = monotonic()
+        logger.info(f"Started queuerd worker {worker.index} (pid {worker.process.pid})")
+
+    def _seconds_until_restart(self) -> float:
+        timeout = POLL_INTERVAL
+        for worker in self._workers:
+            if worker.process is None:
+                timeout = min(timeout, max(worker.restart_at - monotonic(), 0.0))
+
+        return timeout
+
+    def _wait(self, timeout: float) -> None:
+        """
+        Wait up to timeout seconds for a worker to report its metrics or exit, merging
+        any metrics that arrive.
+        """
+        waitables = []
+        for worker in self._workers:
+            if worker.connection is not None:
+                waitables.append(worker.connection)
+            if worker.process is not None and worker.process.exitcode is None:
+                waitables.append(worker.process.sentinel)
+
+        if not waitables:
+            return
+
+        ready = wait(waitables, timeout)
+        for worker in self._workers:
+            if worker.connection is not None and worker.connection in ready:
+                self._receive(worker)
+
+    def _receive(self, worker: _Worker) -> None:
+        try:
+            while worker.connection.poll():
+                self.metrics.merge(*worker.connection.recv())
+        except EOFError:  # The worker has finished.
+            worker.connection.close()
+            worker.connection = None
+
+    def _disconnect(self, worker: _Worker) -> None:
+        # Take whatever the worker managed to send before it exited.
+        if worker.connection is not None:
+            self._receive(worker)
+        if worker.connection is not None:
+            worker.connection.close()
+            worker.connection = None
+
+    def _reap(self, worker: _Worker) -> None:
+        exitcode = worker.process.exitcode
+        self._disconnect(worker)
+        worker.process = None
+
+        # Only back off for workers that keep crashing.
+        if monotonic() - worker.started_at >= STABLE_UPTIME:
+            worker.restart_delay = self.restart_delay
+        worker.restart_at = monotonic() + worker.restart_delay
+
+        logger.error(
+            f"queuerd worker {worker.index} exited with code {exitcode}, restarting "
+            f"in {worker.restart_delay} seconds"
+        )
+        self.metrics.increment("worker_restarts")
+        worker.restart_delay = min(worker.restart_delay * 2, MAX_RESTART_DELAY)
+
+    def _stop(self) -> None:
+        running = [worker for worker in self._workers if worker.process is not None]
+        try:
+            # Each worker drains its in-flight checks and releases its claims.
+            for worker in running:
+                worker.process.terminate()
+
+            deadline = monotonic() + self.shutdown_timeout + KILL_GRACE
+            while monotonic() < deadline and any(
+                worker.process.is_alive() for worker in running
+            ):
+                self._wait(min(deadline - monotonic(), POLL_INTERVAL))
+        finally:
+            for worker in running:
+                if worker.process.is_alive():
+                    logger.warning(
+                        f"Killing queuerd worker {worker.index}, which didn't stop "
+                        "in time"
+                    )
+                    worker.process.kill()
+                    self.metrics.increment("worker_kills")
+                worker.process.join()
+                self._disconnect(worker)
+                worker.process = None
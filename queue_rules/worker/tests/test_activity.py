@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db.utils import DatabaseError
+from django.test import override_settings, TestCase
+
+from data.models import Rule, RuleHourlyActivity, UserHourlyActivity
+from worker.activity import (
+    APPLIED,
+    ERRORS,
+    SKIPPED_NOT_PLAYING,
+    SKIPPED_TOO_EARLY,
+    RuleActivityBuffer,
+)
+
+
+NOW = datetime(2020, 9, 1, 12, 30, 15, tzinfo=timezone.utc)
+HOUR = datetime(2020, 9, 1, 12, tzinfo=timezone.utc)
+
+
+class TestRuleActivityBuffer(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test")
+        self.rule1 = Rule.objects.create(owner=self.user, trigger_song_spotify_id="foo")
+        self.rule2 = Rule.objects.create(owner=self.user, trigger_song_spotify_id="bar")
+        self.buffer = RuleActivityBuffer(interval=60, retention=timedelta(days=1))
+
+    def test_flush(self):
+        self.buffer.record(self.rule1, APPLIED, NOW)
+        self.buffer.record(self.rule1, SKIPPED_TOO_EARLY, NOW)
+        self.buffer.record(self.rule1, SKIPPED_TOO_EARLY, NOW)
+        self.buffer.record(self.rule2, ERRORS, NOW)
+        self.buffer.record(self.rule2, SKIPPED_NOT_PLAYING, NOW - timedelta(hours=1))
+
+        self.buffer.flush(NOW)
+
+        rule1 = RuleHourlyActivity.objects.get(rule=self.rule1)
+        self.assertEqual(rule1.hour, HOUR)
+        self.assertEqual(rule1.applied, 1)
+        self.assertEqual(rule1.skipped_too_early, 2)
+        self.assertEqual(rule1.errors, 0)
+        self.assertEqual(
+            list(
+                RuleHourlyActivity.objects.filter(rule=self.rule2)
+                .order_by("hour")
+                .values_list("hour", "skipped_not_playing", "errors")
+            ),
+            [(HOUR - timedelta(hours=1), 1, 0), (HOUR, 0, 1)],
+        )
+        # Added up across the user's rules, apart from errors, which are the user's
+        # failed checks.
+        user = UserHourlyActivity.objects.get(user=self.user, hour=HOUR)
+        self.assertEqual(user.applied, 1)
+        self.assertEqual(user.skipped_too_early, 2)
+        self.assertEqual(user.errors, 0)
+
+    def test_failed_checks(self):
+        other_user = User.objects.create(username="other")
+        self.buffer.record(self.rule1, ERRORS, NOW)
+        self.buffer.record_failed_check(self.user, NOW)
+        self.buffer.record_failed_check(self.user, NOW)
+        self.buffer.record_failed_check(other_user, NOW)
+        deleted_user = User.objects.create(username="deleted")
+        self.buffer.record_failed_check(deleted_user, NOW)
+        deleted_user.delete()
+
+        self.buffer.flush(NOW)
+
+        self.assertEqual(RuleHourlyActivity.objects.get(rule=self.rule1).errors, 1)
+        self.assertEqual(
+            dict(UserHourlyActivity.objects.values_list("user__username", "errors")),
+            {"test": 2, "other": 1},
+        )
+
+    def test_flushes_add_up(self):
+        self.buffer.record(self.rule1, APPLIED, NOW)
+        self.buffer.flush(NOW)
+        self.buffer.record(self.rule1, APPLIED, NOW)
+        self.buffer.record(self.rule1, ERRORS, NOW)
+        self.buffer.flush(NOW)
+
+        rule1 = RuleHourlyActivity.objects.get(rule=self.rule1)
+        self.assertEqual(rule1.applied, 2)
+        self.assertEqual(rule1.errors, 1)
+        self.assertEqual(UserHourlyActivity.objects.get(user=self.user).applied, 2)
+
+    def test_queries_dont_grow_with_checks(self):
+        for n in range(50):
+            rule = Rule.objects.create(owner=self.user, trigger_song_spotify_id=f"{n}")
+            for _ in range(3):
+                self.buffer.record(rule, APPLIED, NOW)
+
+        # The rules that still exist, an upsert for each table between a savepoint and
+        # its release, then pruning both tables as it's a new hour.
+        with self.assertNumQueries(7):
+            self.buffer.flush(NOW)
+
+        self.assertEqual(RuleHourlyActivity.objects.count(), 50)
+        self.assertEqual(UserHourlyActivity.objects.get(user=self.user).applied, 150)
+
+    @mock.patch("worker.activity.UPSERT_BATCH_SIZE", 2)
+    def test_batches(self):
+        rules = [
+            Rule.objects.create(owner=self.user, trigger_song_spotify_id=f"{n}")
+            for n in range(5)
+        ]
+        for rule in rules:
+            self.buffer.record(rule, APPLIED, NOW)
+
+        self.buffer.flush(NOW)
+
+        self.assertEqual(
+            sorted(RuleHourlyActivity.objects.values_list("rule_id", flat=True)),
+            [rule.id for rule in rules],
+        )
+
+    def test_deleted_rule(self):
+        self.buffer.record(self.rule1, APPLIED, NOW)
+        self.buffer.record(self.rule2, APPLIED, NOW)
+        self.rule2.delete()
+
+        self.buffer.flush(NOW)
+
+        self.assertEqual(
+            list(RuleHourlyActivity.objects.values_list("rule_id", flat=True)),
+            [self.rule1.id],
+        )
+        self.assertEqual(UserHourlyActivity.objects.get(user=self.user).applied, 1)
+
+    def test_failed_flush(self):
+        self.buffer.record(self.rule1, APPLIED, NOW)
+        self.buffer.record_failed_check(self.user, NOW)
+
+        with mock.patch("worker.activity._upsert", side_effect=DatabaseError()):
+            with self.assertRaises(DatabaseError):
+                self.buffer.flush(NOW)
+        self.buffer.record(self.rule1, APPLIED, NOW)
+        self.buffer.record_failed_check(self.user, NOW)
+        self.buffer.flush(NOW)
+
+        # Nothing's lost.
+        self.assertEqual(RuleHourlyActivity.objects.get(rule=self.rule1).applied, 2)
+        self.assertEqual(UserHourlyActivity.objects.get(user=self.user).errors, 2)
+
+    def test_prunes_old_rows(self):
+        old = HOUR - timedelta(days=1, hours=1)
+        RuleHourlyActivity.objects.create(rule=self.rule1, hour=old, applied=1)
+        RuleHourlyActivity.objects.create(rule=self.rule1, hour=HOUR, applied=1)
+        UserHourlyActivity.objects.create(user=self.user, hour=old, applied=1)
+
+        self.buffer.flush(NOW)
+
+        self.assertEqual(
+            list(RuleHourlyActivity.objects.values_list("hour", flat=True)), [HOUR]
+        )
+        self.assertFalse(UserHourlyActivity.objects.exists())
+
+        # Only once an hour.
+        RuleHourlyActivity.objects.create(rule=self.rule1, hour=old, applied=1)
+        with self.assertNumQueries(0):
+            self.buffer.flush(NOW)
+
+    def test_is_due(self):
+        with mock.patch("worker.activity.monotonic", return_value=1000):
+            buffer = RuleActivityBuffer(interval=60)
+
+        with mock.patch("worker.activity.monotonic", return_value=1100):
+            # Nothing to flush yet.
+            self.assertFalse(buffer.is_due())
+            buffer.record(self.rule1, APPLIED, NOW)
+            self.assertTrue(buffer.is_due())
+
+            buffer.flush(NOW)
+            self.assertFalse(buffer.is_due())
+
+    def test_is_due_with_failed_checks(self):
+        with mock.patch("worker.activity.monotonic", return_value=1000):
+            buffer = RuleActivityBuffer(interval=60)
+
+        with mock.patch("worker.activity.monotonic", return_value=1100):
+            buffer.record_failed_check(self.user, NOW)
+            self.assertTrue(buffer.is_due())
+
+    @override_settings(
+        QUEUERD_ACTIVITY_FLUSH_INTERVAL=30, QUEUERD_ACTIVITY_RETENTION_DAYS=7
+    )
+    def test_settings(self):
+        buffer = RuleActivityBuffer()
+
+        self.assertEqual(buffer.interval, 30)
+        self.assertEqual(buffer.retention, timedelta(days=7))
@@ -0,0 +1,178 @@
+import json
+import logging
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from social_django.models import UserSocialAuth
+from spotipy import Spotify
+from spotipy.exceptions import SpotifyException
+
+from data.models import Rule, SongSequenceMember
+from worker import benchmark
+
+
+class TestSeedBenchmarkData(TestCase):
+    def test_seed(self):
+        benchmark.seed_benchmark_data(3, 2, 4, benchmark.make_track_ids(5))
+
+        users = User.objects.filter(
+            username__startswith=benchmark.BENCHMARK_USERNAME_PREFIX
+        )
+        self.assertEqual(users.count(), 3)
+        self.assertEqual(UserSocialAuth.objects.filter(user__in=users).count(), 3)
+        self.assertEqual(Rule.objects.filter(owner__in=users).count(), 6)
+        self.assertEqual(
+            SongSequenceMember.objects.filter(rule__owner__in=users).count(), 24
+        )
+
+    def test_too_few_tracks(self):
+        with self.assertRaises(ValueError):
+            benchmark.seed_benchmark_data(1, 3, 1, benchmark.make_track_ids(2))
+
+    def test_clear_leaves_other_users(self):
+        User.objects.create(username="test")
+        benchmark.seed_benchmark_data(2, 1, 1, benchmark.make_track_ids(1))
+
+        benchmark.clear_benchmark_data()
+
+        self.assertEqual(
+            list(User.objects.values_list("username", flat=True)), ["test"]
+        )
+        self.assertFalse(Rule.objects.exists())
+
+
+class TestFakeSpotifyServer(SimpleTestCase):
+    def setUp(self):
+        # Squelch logging for these tests.
+        logging.disable(logging.CRITICAL)
+
+        self.server = benchmark.FakeSpotifyServer(["foo"], seed=0).start()
+        # Without a session, so nothing's retried.
+        self.client = Spotify(auth="token", requests_session=False)
+        self.client.prefix = f"{self.server.url}/v1/"
+
+    def tearDown(self):
+        self.server.stop()
+
+        # Reenable logging when tests finish.
+        logging.disable(logging.NOTSET)
+
+    def test_currently_playing(self):
+        currently_playing = self.client.currently_playing()
+
+        self.assertTrue(currently_playing["is_playing"])
+        self.assertEqual(currently_playing["item"]["id"], "foo")
+        self.assertEqual(self.server.requests["currently_playing"], 1)
+
+    def test_add_to_queue(self):
+        self.assertIsNone(self.client.add_to_queue("bar"))
+        self.assertEqual(self.server.requests["add_to_queue"], 1)
+
+    def test_track(self):
+        self.assertEqual(self.client.track("bar")["name"], "bar")
+
+    def test_not_found(self):
+        with self.assertRaises(SpotifyException):
+            self.client.me()
+
+        self.assertEqual(self.server.requests["GET /v1/me/"], 1)
+
+    def test_rate_limited(self):
+        self.server.rate_limit_rate = 1
+
+        with self.assertRaises(SpotifyException) as context:
+            self.client.currently_playing()
+
+        self.assertEqual(context.exception.http_status, 429)
+        self.assertEqual(self.server.rate_limited, 1)
+
+    def test_server_error(self):
+        self.server.error_rate = 1
+
+        with self.assertRaises(SpotifyException) as context:
+            self.client.currently_playing()
+
+        self.assertEqual(context.exception.http_status, 503)
+        self.assertEqual(self.server.server_errors, 1)
+
+    @mock.patch("worker.benchmark.sleep")
+    def test_latency_and_timeout(self, mock_sleep):
+        self.server.latency = 0.25
+        self.server.timeout_rate = 1
+        self.server.timeout_delay = 7
+
+        self.client.currently_playing()
+
+        self.assertEqual(mock_sleep.mock_calls, [mock.call(0.25), mock.call(7)])
+        self.assertEqual(self.server.timed_out, 1)
+
+
+class TestCommand(TransactionTestCase):
+    def setUp(self):
+        # Squelch logging for these tests.
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        # Reenable logging when tests finish.
+        logging.disable(logging.NOTSET)
+
+    def test_run(self):
+        out = StringIO()
+        call_command(
+            "queuerd_benchmark",
+            users=5,
+            duration=0.5,
+            sleep_time=0,
+            check_interval=0,
+            stdout=out,
+        )
+
+        self.assertIn("checks/sec", out.getvalue())
+        self.assertFalse(
+            User.objects.filter(
+                username__startswith=benchmark.BENCHMARK_USERNAME_PREFIX
+            ).exists()
+        )
+
+    def test_json_report_and_keep_data(self):
+        out = StringIO()
+        call_command(
+            "queuerd_benchmark",
+            users=2,
+            duration=0.2,
+            sleep_time=0,
+            keep_data=True,
+            json=True,
+            stdout=out,
+        )
+
+        report = json.loads(out.getvalue())
+        self.assertGreater(report["checks"], 0)
+        self.assertEqual(report["errors"], 0)
+        self.assertIn("currently_playing", report["spotify"]["requests"])
+        self.assertEqual(
+            User.objects.filter(
+                username__startswith=benchmark.BENCHMARK_USERNAME_PREFIX
+            ).count(),
+            2,
+        )
+
+    @mock.patch("worker.management.commands.queuerd.get_spotify_client")
+    def test_errors_counted(self, mock_get_spotify_client):
+        # Spotify's own failures don't stop queuerd, but anything else does.
+        mock_get_spotify_client.side_effect = SpotifyException(404, -1, "whoopsie")
+        out = StringIO()
+
+        call_command(
+            "queuerd_benchmark",
+            users=1,
+            duration=0.1,
+            sleep_time=0,
+            json=True,
+            stdout=out,
+        )
+
+        self.assertGreater(json.loads(out.getvalue())["errors"], 0)
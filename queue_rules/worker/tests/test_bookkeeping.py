@@ -0,0 +1,141 @@
+from datetime import datetime, timezone
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from data.models import LastCheckLog, Rule, UserLock
+from worker.bookkeeping import Bookkeeping
+
+
+class TestBookkeeping(TestCase):
+    def setUp(self):
+        self.test_user = User.objects.create(username="test")
+        self.test_log = LastCheckLog.objects.create(
+            user=self.test_user, last_checked=datetime(1985, 2, 15, tzinfo=timezone.utc)
+        )
+        self.test_lock = UserLock.objects.create(user=self.test_user)
+        self.test_rule = Rule.objects.create(
+            owner=self.test_user, trigger_song_spotify_id="foo"
+        )
+
+    def test_flush_nothing_pending(self):
+        bookkeeping = Bookkeeping()
+
+        with self.assertNumQueries(0):
+            bookkeeping.flush()
+
+    def test_flush(self):
+        bookkeeping = Bookkeeping()
+        bookkeeping.record_check(
+            self.test_log, datetime(2020, 8, 16, tzinfo=timezone.utc)
+        )
+        self.test_rule.last_applied = datetime(2020, 8, 15, tzinfo=timezone.utc)
+        bookkeeping.record_apply(self.test_rule)
+        bookkeeping.release_lock(self.test_lock)
+
+        # Nothing gets written until the flush.
+        self.test_log.refresh_from_db()
+        self.assertEqual(
+            self.test_log.last_checked, datetime(1985, 2, 15, tzinfo=timezone.utc)
+        )
+        self.assertTrue(UserLock.objects.exists())
+        self.assertEqual(bookkeeping.pending, 3)
+
+        bookkeeping.flush()
+
+        self.test_log.refresh_from_db()
+        self.test_rule.refresh_from_db()
+        self.assertEqual(
+            self.test_log.last_checked, datetime(2020, 8, 16, tzinfo=timezone.utc)
+        )
+        self.assertEqual(
+            self.test_rule.last_applied, datetime(2020, 8, 15, tzinfo=timezone.utc)
+        )
+        self.assertFalse(UserLock.objects.exists())
+        self.assertEqual(bookkeeping.pending, 0)
+
+    def test_flush_new_log(self):
+        new_user = User.objects.create(username="new")
+        bookkeeping = Bookkeeping()
+        bookkeeping.record_check(
+            LastCheckLog(user=new_user, last_checked=datetime.now(timezone.utc)),
+            datetime(2020, 8, 16, tzinfo=timezone.utc),
+        )
+
+        bookkeeping.flush()
+
+        self.assertEqual(
+            LastCheckLog.objects.get(user=new_user).last_checked,
+            datetime(2020, 8, 16, tzinfo=timezone.utc),
+        )
+
+    def test_flush_new_log_deleted_user(self):
+        new_user = User.objects.create(username="new")
+        bookkeeping = Bookkeeping()
+        bookkeeping.record_check(
+            LastCheckLog(user=new_user, last_checked=datetime.now(timezone.utc)),
+            datetime(2020, 8, 16, tzinfo=timezone.utc),
+        )
+        bookkeeping.release_lock(self.test_lock)
+        new_user.delete()
+
+        bookkeeping.flush()
+
+        self.assertEqual(LastCheckLog.objects.count(), 1)
+        self.assertFalse(UserLock.objects.exists())
+
+    def test_flush_queries_dont_grow(self):
+        def flush_users(num_users):
+            bookkeeping = Bookkeeping()
+            for n in range(num_users):
+                user = User.objects.create(username=f"user{num_users}-{n}")
+                log = LastCheckLog.objects.create(
+                    user=user, last_checked=datetime.now(timezone.utc)
+                )
+                rule = Rule.objects.create(owner=user, trigger_song_spotify_id="foo")
+                bookkeeping.record_check(log, datetime.now(timezone.utc))
+                bookkeeping.record_apply(rule)
+                bookkeeping.release_lock(UserLock.objects.create(user=user))
+
+            with self.assertNumQueries(5):
+                bookkeeping.flush()
+
+        flush_users(2)
+        flush_users(20)
+
+    def test_flush_failure_keeps_pending(self):
+        bookkeeping = Bookkeeping()
+        bookkeeping.record_check(self.test_log, datetime.now(timezone.utc))
+        bookkeeping.record_apply(self.test_rule)
+        bookkeeping.release_lock(self.test_lock)
+
+        with mock.patch.object(bookkeeping, "_write", side_effect=RuntimeError()):
+            with self.assertRaises(RuntimeError):
+                bookkeeping.flush()
+
+        self.assertEqual(bookkeeping.pending, 3)
+
+        bookkeeping.flush()
+
+        self.assertEqual(bookkeeping.pending, 0)
+        self.assertFalse(UserLock.objects.exists())
+
+    def test_due_by_pending(self):
+        bookkeeping = Bookkeeping(flush_interval=3600, max_pending=2)
+        bookkeeping.release_lock(self.test_lock)
+        self.assertFalse(bookkeeping.is_due())
+
+        bookkeeping.record_apply(self.test_rule)
+        self.assertTrue(bookkeeping.is_due())
+
+    @mock.patch("worker.bookkeeping.monotonic")
+    def test_due_by_interval(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        bookkeeping = Bookkeeping(flush_interval=1, max_pending=100)
+
+        mock_monotonic.return_value = 100.5
+        self.assertFalse(bookkeeping.is_due())
+
+        mock_monotonic.return_value = 101
+        self.assertTrue(bookkeeping.is_due())
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from django.test import TestCase
+
+from data.models import Rule, RuleApplyClaim
+from worker.dedup import AppliedRules, PLAY_START_TOLERANCE, PRUNE_INTERVAL
+
+
+@mock.patch("worker.dedup.time", return_value=1000000.0)
+class TestAppliedRules(TestCase):
+    def setUp(self):
+        self.applied_rules = AppliedRules()
+        # Claims don't need the rule to exist.
+        self.rule = Rule(id=1, trigger_song_spotify_id="foo")
+        self.playback_info = {
+            "progress_ms": 100000,
+            "item": {"id": "foo", "duration_ms": 200000},
+        }
+
+    def test_claim_once_per_play(self, mock_time):
+        self.assertIsNotNone(self.applied_rules.claim(self.rule, self.playback_info))
+
+        # The same play, a check later.
+        mock_time.return_value += 5
+        self.playback_info["progress_ms"] += 5000
+        self.assertIsNone(self.applied_rules.claim(self.rule, self.playback_info))
+
+    def test_start_jitter(self, mock_time):
+        self.applied_rules.claim(self.rule, self.playback_info)
+
+        for jitter in [-PLAY_START_TOLERANCE, PLAY_START_TOLERANCE]:
+            mock_time.return_value = 1000000.0 + jitter
+            self.assertIsNone(self.applied_rules.claim(self.rule, self.playback_info))
+
+    def test_new_play(self, mock_time):
+        self.applied_rules.claim(self.rule, self.playback_info)
+
+        # The track's been started over.
+        mock_time.return_value += 30
+        self.assertIsNotNone(self.applied_rules.claim(self.rule, self.playback_info))
+
+    def test_other_rule(self, mock_time):
+        self.applied_rules.claim(self.rule, self.playback_info)
+
+        other_rule = Rule(id=2, trigger_song_spotify_id="foo")
+        self.assertIsNotNone(self.applied_rules.claim(other_rule, self.playback_info))
+
+    def test_release(self, mock_time):
+        claim = self.applied_rules.claim(self.rule, self.playback_info)
+
+        self.applied_rules.release(claim)
+
+        self.assertIsNotNone(self.applied_rules.claim(self.rule, self.playback_info))
+
+    def test_claimed_by_another_worker(self, mock_time):
+        # Another worker's clock put the play's start in the next slot over.
+        mock_time.return_value += PLAY_START_TOLERANCE
+        self.assertIsNotNone(AppliedRules().claim(self.rule, self.playback_info))
+        mock_time.return_value -= PLAY_START_TOLERANCE
+
+        # A savepoint, a single INSERT, then rolling back to and releasing the
+        # savepoint, without looking for the other claim first.
+        with self.assertNumQueries(4):
+            self.assertIsNone(self.applied_rules.claim(self.rule, self.playback_info))
+
+    def test_expires_with_track(self, mock_time):
+        self.applied_rules.claim(self.rule, self.playback_info)
+
+        expires = datetime.fromtimestamp(1000000.0, timezone.utc) + timedelta(
+            seconds=200 + PLAY_START_TOLERANCE
+        )
+        self.assertEqual(
+            set(RuleApplyClaim.objects.values_list("expires", flat=True)), {expires}
+        )
+
+    def test_prunes_expired_claims(self, mock_time):
+        self.applied_rules.claim(self.rule, self.playback_info)
+
+        # Long after the track finished.
+        mock_time.return_value += 3600
+        with mock.patch("worker.dedup.monotonic", return_value=10 ** 9):
+            self.applied_rules.claim(Rule(id=2), self.playback_info)
+
+        self.assertEqual(
+            set(RuleApplyClaim.objects.values_list("rule_id", flat=True)), {2}
+        )
+
+    def test_prunes_once_in_a_while(self, mock_time):
+        self.applied_rules.claim(self.rule, self.playback_info)
+        mock_time.return_value += 3600
+
+        with mock.patch(
+            "worker.dedup.monotonic",
+            return_value=self.applied_rules._last_prune + PRUNE_INTERVAL - 1,
+        ):
+            self.applied_rules.claim(Rule(id=2), self.playback_info)
+
+        self.assertEqual(RuleApplyClaim.objects.filter(rule_id=1).count(), 3)
@@ -0,0 +1,110 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from worker import metrics
+
+
+class TestPercentile(SimpleTestCase):
+    def test_no_samples(self):
+        self.assertEqual(metrics.percentile([], 0.5), 0.0)
+
+    def test_nearest_rank(self):
+        samples = [5, 1, 4, 2, 3]
+
+        self.assertEqual(metrics.percentile(samples, 0), 1)
+        self.assertEqual(metrics.percentile(samples, 0.5), 3)
+        self.assertEqual(metrics.percentile(samples, 0.95), 5)
+        self.assertEqual(metrics.percentile(samples, 1), 5)
+
+
+class TestSummarize(SimpleTestCase):
+    def test_no_samples(self):
+        self.assertEqual(
+            metrics.summarize([]),
+            {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0},
+        )
+
+    def test_samples(self):
+        summary = metrics.summarize([1.0, 2.0, 3.0])
+
+        self.assertEqual(summary["count"], 3)
+        self.assertEqual(summary["mean"], 2.0)
+        self.assertEqual(summary["p50"], 2.0)
+        self.assertEqual(summary["max"], 3.0)
+
+
+class TestMetrics(SimpleTestCase):
+    def test_counters(self):
+        test_metrics = metrics.Metrics()
+        test_metrics.increment("foo")
+        test_metrics.increment("foo", 2)
+
+        self.assertEqual(test_metrics.counters(), {"foo": 3})
+
+    def test_max_samples(self):
+        test_metrics = metrics.Metrics(max_samples=2)
+        for value in (1.0, 2.0, 3.0):
+            test_metrics.observe("foo", value)
+
+        self.assertEqual(test_metrics.timings(), {"foo": [2.0, 3.0]})
+
+    @mock.patch("worker.metrics.monotonic")
+    def test_timer(self, mock_monotonic):
+        mock_monotonic.side_effect = [10.0, 10.5]
+        test_metrics = metrics.Metrics()
+
+        with test_metrics.timer("foo"):
+            pass
+
+        self.assertEqual(test_metrics.timings(), {"foo": [0.5]})
+
+    def test_reset(self):
+        test_metrics = metrics.Metrics()
+        test_metrics.increment("foo")
+        test_metrics.observe("bar", 1.0)
+
+        test_metrics.reset()
+
+        self.assertEqual(test_metrics.snapshot(), {"counters": {}, "timings": {}})
+
+    def test_snapshot(self):
+        test_metrics = metrics.Metrics()
+        test_metrics.increment("foo")
+        test_metrics.observe("bar", 1.0)
+
+        snapshot = test_metrics.snapshot()
+
+        self.assertEqual(snapshot["counters"], {"foo": 1})
+        self.assertEqual(snapshot["timings"]["bar"]["count"], 1)
+
+    def test_drain(self):
+        test_metrics = metrics.Metrics()
+        test_metrics.increment("foo")
+        test_metrics.observe("bar", 1.0)
+
+        self.assertEqual(test_metrics.drain(), ({"foo": 1}, {"bar": [1.0]}))
+        self.assertEqual(test_metrics.drain(), ({}, {}))
+
+    def test_tally(self):
+        test_metrics = metrics.Metrics()
+        test_metrics.increment("foo")
+        test_metrics.increment("foo")
+        test_metrics.drain()
+        test_metrics.increment("bar")
+        test_metrics.merge({"bar": 2}, {})
+        test_metrics.reset()
+
+        # Only what was counted here, whatever's happened to the counters since.
+        self.assertEqual(test_metrics.tally(), {"foo": 2, "bar": 1})
+        self.assertEqual(test_metrics.tally(), {})
+
+    def test_merge(self):
+        test_metrics = metrics.Metrics(max_samples=2)
+        test_metrics.increment("foo")
+        test_metrics.observe("bar", 1.0)
+
+        test_metrics.merge({"foo": 2, "baz": 1}, {"bar": [2.0, 3.0]})
+
+        self.assertEqual(test_metrics.counters(), {"foo": 3, "baz": 1})
+        self.assertEqual(test_metrics.timings(), {"bar": [2.0, 3.0]})
@@ -1,17 +1,40 @@
 import logging
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.management import call_command
-from django.db.utils import IntegrityError
-from django.test import TestCase
+from django.db.utils import DatabaseError, IntegrityError
+from django.test import override_settings, SimpleTestCase, TestCase
 from freezegun import freeze_time
 from requests.exceptions import ReadTimeout
-
-from data.models import LastCheckLog, Rule, UserLock
+from spotipy.exceptions import SpotifyException
+
+from social_django.models import UserSocialAuth
+
+from data.circuit_breaker import CircuitBreaker, OPEN
+from data.exceptions import CircuitOpen, DeadlineExceeded
+from data.models import LastCheckLog, Rule, SongSequenceMember, UserLock
+from data.user_utils import get_spotify_client
+from worker import benchmark
+from worker.activity import (
+    APPLIED,
+    ERRORS,
+    SKIPPED_APPLIED_RECENTLY,
+    SKIPPED_NOT_PLAYING,
+    SKIPPED_TOO_EARLY,
+)
+from worker.bookkeeping import Bookkeeping
 from worker.management.commands import queuerd
+from worker.rollups import worker_name
+from worker.schedule import Schedule
+from worker.snapshots import Decision
 
 
 class TestGetUser(TestCase):
@@ -53,6 +76,16 @@ class TestGetUser(TestCase):
         with queuerd.get_user() as user:
             self.assertIsNone(user)
 
+    def test_only_deactivated_users(self):
+        User.objects.create(username="test", is_active=False)
+        LastCheckLog.objects.create(
+            user=User.objects.create(username="test2", is_active=False),
+            last_checked=datetime(1985, 2, 15, tzinfo=timezone.utc),
+        )
+
+        with queuerd.get_user() as user:
+            self.assertIsNone(user)
+
     def test_prioritize_never_checked_user(self):
         test_user_1 = User.objects.create(username="test1")
         test_user_2 = User.objects.create(username="test2")
@@ -112,6 +145,22 @@ class TestGetUser(TestCase):
         with queuerd.get_user() as user:
             self.assertIsNone(user)
 
+    def test_bookkeeping_defers_writes(self):
+        test_user = User.objects.create(username="test")
+        bookkeeping = Bookkeeping()
+
+        with queuerd.get_user(bookkeeping) as user:
+            self.assertEqual(user, test_user)
+            self.assertIsNone(user.last_check_log.pk)
+            self.assertFalse(LastCheckLog.objects.exists())
+
+        # The lock is only released when the bookkeeping is flushed.
+        self.assertTrue(UserLock.objects.filter(user=test_user).exists())
+
+        bookkeeping.flush()
+
+        self.assertFalse(UserLock.objects.filter(user=test_user).exists())
+
     @mock.patch("worker.management.commands.queuerd.UserLock")
     def test_race_condition(self, mock_UserLock):
         User.objects.create(username="test")
@@ -212,6 +261,52 @@ class TestShouldApplyRule(TestCase):
 
         self.assertTrue(queuerd.should_apply_rule(self.test_rule, playback_info))
 
+    @freeze_time("2020-05-17")
+    def test_skip_reasons(self):
+        item = {"duration_ms": 900000}
+        self.test_rule.last_applied = datetime(2020, 5, 17, tzinfo=timezone.utc)
+
+        self.assertEqual(
+            queuerd.skip_reason(self.test_rule, {"is_playing": False}),
+            SKIPPED_NOT_PLAYING,
+        )
+        self.assertEqual(
+            queuerd.skip_reason(self.test_rule, {"is_playing": True, "item": item}),
+            SKIPPED_APPLIED_RECENTLY,
+        )
+
+        self.test_rule.last_applied = None
+        self.assertEqual(
+            queuerd.skip_reason(
+                self.test_rule, {"is_playing": True, "progress_ms": 0, "item": item}
+            ),
+            SKIPPED_TOO_EARLY,
+        )
+        self.assertIsNone(
+            queuerd.skip_reason(
+                self.test_rule,
+                {"is_playing": True, "progress_ms": 900000, "item": item},
+            )
+        )
+
+    def test_now(self):
+        now = datetime(2020, 5, 17, 12, tzinfo=timezone.utc)
+        self.test_rule.last_applied = now - timedelta(minutes=2)
+        playback_info = {
+            "is_playing": True,
+            "progress_ms": 100000,
+            "item": {"duration_ms": 180000},
+        }
+
+        self.assertFalse(
+            queuerd.should_apply_rule(self.test_rule, playback_info, now=now)
+        )
+        self.assertTrue(
+            queuerd.should_apply_rule(
+                self.test_rule, playback_info, now=now + timedelta(minutes=2)
+            )
+        )
+
 
 class TestRunForUser(TestCase):
     def setUp(self):
@@ -223,6 +318,11 @@ class TestRunForUser(TestCase):
             owner=self.test_user, trigger_song_spotify_id="foo"
         )
         self.test_rule.apply = mock.MagicMock()
+        self.playback_info = {
+            "is_playing": True,
+            "progress_ms": 100000,
+            "item": {"id": "foo", "duration_ms": 200000},
+        }
 
     def tearDown(self):
         # Reenable logging when tests finish.
@@ -258,43 +358,56 @@ class TestRunForUser(TestCase):
         self.test_rule.apply.assert_not_called()
 
     @mock.patch("worker.management.commands.queuerd.get_matching_rule")
-    @mock.patch("worker.management.commands.queuerd.should_apply_rule")
-    def test_shouldnt_apply_matching_rule(self, mock_should_apply, mock_get_matching):
+    @mock.patch("worker.management.commands.queuerd.skip_reason")
+    def test_shouldnt_apply_matching_rule(self, mock_skip_reason, mock_get_matching):
         mock_client = mock.MagicMock()
         mock_client.currently_playing.return_value = {
             "item": {"id": "foo"},
         }
         mock_get_matching.return_value = self.test_rule
-        mock_should_apply.return_value = False
+        mock_skip_reason.return_value = SKIPPED_TOO_EARLY
 
         queuerd.run_for_user(self.test_user, mock_client)
 
         mock_get_matching.assert_called_once_with(self.test_user, "foo")
-        mock_should_apply.assert_called_once_with(
+        mock_skip_reason.assert_called_once_with(
             self.test_rule, mock_client.currently_playing.return_value
         )
         self.test_rule.apply.assert_not_called()
 
     @mock.patch("worker.management.commands.queuerd.get_matching_rule")
-    @mock.patch("worker.management.commands.queuerd.should_apply_rule")
-    def test_should_apply_matching_rule(self, mock_should_apply, mock_get_matching):
+    @mock.patch("worker.management.commands.queuerd.skip_reason")
+    def test_should_apply_matching_rule(self, mock_skip_reason, mock_get_matching):
         mock_client = mock.MagicMock()
-        mock_client.currently_playing.return_value = {
-            "item": {"id": "foo"},
-        }
+        mock_client.currently_playing.return_value = self.playback_info
         mock_get_matching.return_value = self.test_rule
-        mock_should_apply.return_value = True
+        mock_skip_reason.return_value = None
 
         queuerd.run_for_user(self.test_user, mock_client)
 
         mock_get_matching.assert_called_once_with(self.test_user, "foo")
-        mock_should_apply.assert_called_once_with(
+        mock_skip_reason.assert_called_once_with(
             self.test_rule, mock_client.currently_playing.return_value
         )
-        self.test_rule.apply.assert_called_once_with(mock_client)
+        self.test_rule.apply.assert_called_once_with(mock_client, queued=[])
 
     @mock.patch("worker.management.commands.queuerd.get_matching_rule")
-    def test_read_timeout(self, mock_get_matching):
+    @mock.patch("worker.management.commands.queuerd.skip_reason")
+    def test_apply_with_bookkeeping(self, mock_skip_reason, mock_get_matching):
+        mock_client = mock.MagicMock()
+        mock_client.currently_playing.return_value = self.playback_info
+        mock_get_matching.return_value = self.test_rule
+        mock_skip_reason.return_value = None
+        mock_bookkeeping = mock.MagicMock()
+
+        queuerd.run_for_user(self.test_user, mock_client, mock_bookkeeping)
+
+        self.test_rule.apply.assert_called_once_with(mock_client, save=False, queued=[])
+        mock_bookkeeping.record_apply.assert_called_once_with(self.test_rule)
+
+    @mock.patch("worker.management.commands.queuerd.rule_activity")
+    @mock.patch("worker.management.commands.queuerd.get_matching_rule")
+    def test_read_timeout(self, mock_get_matching, mock_rule_activity):
         mock_client = mock.MagicMock()
         mock_client.currently_playing.side_effect = ReadTimeout()
 
@@ -302,6 +415,212 @@ class TestRunForUser(TestCase):
 
         assert result is None
         mock_get_matching.assert_not_called()
+        mock_rule_activity.record_failed_check.assert_called_once_with(self.test_user)
+
+    @freeze_time("2020-08-16")
+    @mock.patch("worker.management.commands.queuerd.get_matching_rule")
+    @mock.patch("worker.management.commands.queuerd.skip_reason")
+    def test_apply_timeout(self, mock_skip_reason, mock_get_matching):
+        mock_client = mock.MagicMock()
+        mock_client.currently_playing.return_value = self.playback_info
+        mock_get_matching.return_value = self.test_rule
+        mock_skip_reason.return_value = None
+        mock_bookkeeping = mock.MagicMock()
+
+        def apply(client, save=True, queued=None):
+            queued.append("bar")
+            raise DeadlineExceeded()
+
+        self.test_rule.apply.side_effect = apply
+
+        with self.assertRaises(DeadlineExceeded):
+            queuerd.run_for_user(self.test_user, mock_client, mock_bookkeeping)
+
+        # Part of the sequence was queued, so don't queue it all again.
+        self.assertEqual(
+            self.test_rule.last_applied, datetime(2020, 8, 16, tzinfo=timezone.utc)
+        )
+        mock_bookkeeping.record_apply.assert_called_once_with(self.test_rule)
+
+    @freeze_time("2020-08-16")
+    @mock.patch("worker.management.commands.queuerd.get_matching_rule")
+    @mock.patch("worker.management.commands.queuerd.skip_reason")
+    def test_apply_read_timeout(self, mock_skip_reason, mock_get_matching):
+        mock_client = mock.MagicMock()
+        mock_client.currently_playing.return_value = self.playback_info
+        mock_get_matching.return_value = self.test_rule
+        mock_skip_reason.return_value = None
+        self.test_rule.apply.side_effect = ReadTimeout()
+        mock_bookkeeping = mock.MagicMock()
+
+        with self.assertRaises(ReadTimeout):
+            queuerd.run_for_user(self.test_user, mock_client, mock_bookkeeping)
+
+        # The first song was sent, and Spotify may well have queued it.
+        self.assertEqual(
+            self.test_rule.last_applied, datetime(2020, 8, 16, tzinfo=timezone.utc)
+        )
+        mock_bookkeeping.record_apply.assert_called_once_with(self.test_rule)
+
+    @mock.patch("worker.management.commands.queuerd.get_matching_rule")
+    @mock.patch("worker.management.commands.queuerd.skip_reason")
+    def test_apply_timeout_nothing_queued(self, mock_skip_reason, mock_get_matching):
+        mock_client = mock.MagicMock()
+        mock_client.currently_playing.return_value = self.playback_info
+        mock_get_matching.return_value = self.test_rule
+        mock_skip_reason.return_value = None
+        self.test_rule.apply.side_effect = [DeadlineExceeded(), None]
+        mock_bookkeeping = mock.MagicMock()
+
+        with self.assertRaises(DeadlineExceeded):
+            queuerd.run_for_user(self.test_user, mock_client, mock_bookkeeping)
+
+        self.assertIsNone(self.test_rule.last_applied)
+        mock_bookkeeping.record_apply.assert_not_called()
+
+        # Nothing was sent, so the next check tries again.
+        queuerd.run_for_user(self.test_user, mock_client, mock_bookkeeping)
+        self.assertEqual(len(self.test_rule.apply.mock_calls), 2)
+        mock_bookkeeping.record_apply.assert_called_once_with(self.test_rule)
+
+    @mock.patch("worker.management.commands.queuerd.get_matching_rule")
+    @mock.patch("worker.management.commands.queuerd.skip_reason")
+    def test_already_applied_for_play(self, mock_skip_reason, mock_get_matching):
+        mock_client = mock.MagicMock()
+        mock_client.currently_playing.return_value = self.playback_info
+        mock_get_matching.return_value = self.test_rule
+        mock_skip_reason.return_value = None
+        queuerd.metrics.reset()
+
+        # Such as when the first apply's last_applied is still waiting on bookkeeping.
+        queuerd.run_for_user(self.test_user, mock_client, mock.MagicMock())
+        queuerd.run_for_user(self.test_user, mock_client, mock.MagicMock())
+
+        self.test_rule.apply.assert_called_once()
+        self.assertEqual(queuerd.metrics.counters()["duplicate_applies"], 1)
+
+    @mock.patch("worker.management.commands.queuerd.get_matching_rule")
+    @mock.patch("worker.management.commands.queuerd.skip_reason")
+    def test_failed_apply_retried(self, mock_skip_reason, mock_get_matching):
+        mock_client = mock.MagicMock()
+        mock_client.currently_playing.return_value = self.playback_info
+        mock_get_matching.return_value = self.test_rule
+        mock_skip_reason.return_value = None
+        self.test_rule.apply.side_effect = [SpotifyException(404, -1, "error"), None]
+
+        with self.assertRaises(SpotifyException):
+            queuerd.run_for_user(self.test_user, mock_client)
+        queuerd.run_for_user(self.test_user, mock_client)
+
+        self.assertEqual(self.test_rule.apply.call_count, 2)
+
+    @mock.patch("worker.management.commands.queuerd.rule_activity")
+    @mock.patch("worker.management.commands.queuerd.get_matching_rule")
+    def test_rule_activity(self, mock_get_matching, mock_rule_activity):
+        mock_client = mock.MagicMock()
+        mock_get_matching.return_value = self.test_rule
+        not_playing = {**self.playback_info, "is_playing": False}
+        too_early = {**self.playback_info, "progress_ms": 10000}
+
+        for playback_info in (not_playing, too_early, self.playback_info) * 2:
+            mock_client.currently_playing.return_value = playback_info
+            queuerd.run_for_user(self.test_user, mock_client, mock.MagicMock())
+
+        self.assertEqual(
+            mock_rule_activity.record.call_args_list,
+            [
+                mock.call(self.test_rule, outcome)
+                for outcome in [
+                    SKIPPED_NOT_PLAYING,
+                    SKIPPED_TOO_EARLY,
+                    APPLIED,
+                    SKIPPED_NOT_PLAYING,
+                    SKIPPED_TOO_EARLY,
+                    # Still waiting on bookkeeping to save last_applied.
+                    SKIPPED_APPLIED_RECENTLY,
+                ]
+            ],
+        )
+
+    @mock.patch("worker.management.commands.queuerd.rule_activity")
+    @mock.patch("worker.management.commands.queuerd.get_matching_rule")
+    def test_inactive_rule_activity(self, mock_get_matching, mock_rule_activity):
+        mock_client = mock.MagicMock()
+        mock_client.currently_playing.return_value = self.playback_info
+        self.test_rule.is_active = False
+        mock_get_matching.return_value = self.test_rule
+
+        queuerd.run_for_user(self.test_user, mock_client)
+
+        self.test_rule.apply.assert_not_called()
+        mock_rule_activity.record.assert_not_called()
+
+    @mock.patch("worker.management.commands.queuerd.rule_activity")
+    @mock.patch("worker.management.commands.queuerd.get_matching_rule")
+    def test_failed_apply_activity(self, mock_get_matching, mock_rule_activity):
+        mock_client = mock.MagicMock()
+        mock_client.currently_playing.return_value = self.playback_info
+        mock_get_matching.return_value = self.test_rule
+        self.test_rule.apply.side_effect = SpotifyException(404, -1, "error")
+
+        with self.assertRaises(SpotifyException):
+            queuerd.run_for_user(self.test_user, mock_client)
+
+        mock_rule_activity.record.assert_called_once_with(self.test_rule, ERRORS)
+
+    @mock.patch("worker.management.commands.queuerd.snapshot_log")
+    @mock.patch("worker.management.commands.queuerd.get_matching_rule")
+    @mock.patch("worker.management.commands.queuerd.skip_reason")
+    def test_snapshots(self, mock_skip_reason, mock_get_matching, mock_snapshot_log):
+        mock_client = mock.MagicMock()
+        mock_client.currently_playing.return_value = self.playback_info
+        mock_get_matching.side_effect = [None, self.test_rule, self.test_rule]
+        mock_skip_reason.side_effect = [SKIPPED_TOO_EARLY, None]
+
+        for _ in range(3):
+            queuerd.run_for_user(self.test_user, mock_client)
+
+        self.assertEqual(
+            mock_snapshot_log.record.call_args_list,
+            [
+                mock.call(self.test_user.id, self.playback_info, decision)
+                for decision in [
+                    Decision.NO_RULE,
+                    Decision.NOT_APPLIED,
+                    Decision.APPLIED,
+                ]
+            ],
+        )
+
+    @mock.patch("worker.management.commands.queuerd.snapshot_log")
+    @mock.patch("worker.management.commands.queuerd.get_matching_rule")
+    @mock.patch("worker.management.commands.queuerd.skip_reason")
+    def test_snapshot_of_failure(
+        self, mock_skip_reason, mock_get_matching, mock_snapshot_log
+    ):
+        mock_client = mock.MagicMock()
+        mock_client.currently_playing.return_value = self.playback_info
+        mock_get_matching.return_value = self.test_rule
+        mock_skip_reason.return_value = None
+        self.test_rule.apply.side_effect = SpotifyException(404, -1, "error")
+
+        with self.assertRaises(SpotifyException):
+            queuerd.run_for_user(self.test_user, mock_client)
+
+        mock_snapshot_log.record.assert_called_once_with(
+            self.test_user.id, self.playback_info, Decision.FAILED
+        )
+
+    @mock.patch("worker.management.commands.queuerd.snapshot_log")
+    def test_nothing_playing_snapshot(self, mock_snapshot_log):
+        mock_client = mock.MagicMock()
+        mock_client.currently_playing.return_value = None
+
+        queuerd.run_for_user(self.test_user, mock_client)
+
+        mock_snapshot_log.record.assert_called_once_with(
+            self.test_user.id, None, Decision.NOTHING_PLAYING
+        )
 
 
 class TestRunOne(TestCase):
@@ -341,8 +660,8 @@ class TestRunOne(TestCase):
 
         queuerd.run_one()
 
-        mock_get_spotify_client.assert_called_once_with(test_user)
-        mock_run_for_user.assert_called_once_with(test_user, mock_spotify_client)
+        mock_get_spotify_client.assert_called_once_with(test_user, deadline=mock.ANY)
+        mock_run_for_user.assert_called_once_with(test_user, mock_spotify_client, None)
 
         test_user_log.refresh_from_db()
         self.assertEqual(
@@ -350,26 +669,948 @@ class TestRunOne(TestCase):
             datetime(2020, 8, 16, tzinfo=timezone.utc),
         )
 
+    @mock.patch("worker.management.commands.queuerd.rule_activity")
+    @mock.patch("worker.management.commands.queuerd.check_user")
+    @mock.patch("worker.management.commands.queuerd.get_user")
+    def test_flushes_rule_activity(
+        self, mock_get_user, mock_check_user, mock_rule_activity
+    ):
+        mock_get_user.return_value.__enter__.return_value = mock.MagicMock()
+        mock_get_user.return_value.__exit__.return_value = None
+        mock_rule_activity.is_due.side_effect = [False, True]
+
+        queuerd.run_one()
+        mock_rule_activity.flush.assert_not_called()
+
+        queuerd.run_one()
+        mock_rule_activity.flush.assert_called_once_with()
+
+    @freeze_time("2020-08-16")
+    @mock.patch("worker.management.commands.queuerd.run_for_user")
+    @mock.patch("worker.management.commands.queuerd.get_spotify_client")
+    @mock.patch("worker.management.commands.queuerd.get_user")
+    def test_with_user_bookkeeping(
+        self, mock_get_user, mock_get_spotify_client, mock_run_for_user
+    ):
+        test_user = User.objects.create(username="test")
+        test_user_log = LastCheckLog.objects.create(
+            user=test_user, last_checked=datetime(1985, 12, 25, tzinfo=timezone.utc)
+        )
+
+        mock_get_user.return_value.__enter__.return_value = test_user
+        mock_get_user.return_value.__exit__.return_value = None
+        mock_bookkeeping = mock.MagicMock()
+
+        queuerd.run_one(mock_bookkeeping)
+
+        mock_get_user.assert_called_once_with(mock_bookkeeping, None)
+        mock_run_for_user.assert_called_once_with(
+            test_user, mock_get_spotify_client.return_value, mock_bookkeeping
+        )
+        mock_bookkeeping.record_check.assert_called_once_with(
+            test_user_log, datetime(2020, 8, 16, tzinfo=timezone.utc)
+        )
+
+        # The write is left to the bookkeeping.
+        test_user_log.refresh_from_db()
+        self.assertEqual(
+            test_user_log.last_checked,
+            datetime(1985, 12, 25, tzinfo=timezone.utc),
+        )
+
+    @freeze_time("2020-08-16")
+    @mock.patch("worker.management.commands.queuerd.run_for_user")
+    @mock.patch("worker.management.commands.queuerd.get_spotify_client")
+    @mock.patch("worker.management.commands.queuerd.get_user")
+    def test_with_user_schedule(
+        self, mock_get_user, mock_get_spotify_client, mock_run_for_user
+    ):
+        test_user = User.objects.create(username="test")
+        LastCheckLog.objects.create(
+            user=test_user, last_checked=datetime(1985, 12, 25, tzinfo=timezone.utc)
+        )
+
+        mock_get_user.return_value.__enter__.return_value = test_user
+        mock_get_user.return_value.__exit__.return_value = None
+        mock_schedule = mock.MagicMock()
+
+        queuerd.run_one(schedule=mock_schedule)
+
+        mock_get_user.assert_called_once_with(None, mock_schedule)
+        mock_schedule.record_check.assert_called_once_with(
+            test_user.id, datetime(2020, 8, 16, tzinfo=timezone.utc).timestamp()
+        )
+
+    @mock.patch("worker.management.commands.queuerd.metrics")
+    @mock.patch("worker.management.commands.queuerd.run_for_user")
+    @mock.patch("worker.management.commands.queuerd.get_spotify_client")
+    @mock.patch("worker.management.commands.queuerd.get_user")
+    def test_metrics(
+        self, mock_get_user, mock_get_spotify_client, mock_run_for_user, mock_metrics
+    ):
+        test_user = User.objects.create(username="test")
+        LastCheckLog.objects.create(
+            user=test_user, last_checked=datetime.now(timezone.utc)
+        )
+        mock_get_user.return_value.__enter__.return_value = test_user
+        mock_get_user.return_value.__exit__.return_value = None
+
+        queuerd.run_one()
+
+        mock_metrics.increment.assert_called_once_with("checks")
+        self.assertEqual(
+            [c.args[0] for c in mock_metrics.observe.mock_calls],
+            ["claim", "scheduling_lag"],
+        )
+        # The user was checked before they were due, so there's no lag.
+        self.assertEqual(mock_metrics.observe.mock_calls[1].args[1], 0.0)
+        self.assertEqual(
+            [c.args[0] for c in mock_metrics.timer.call_args_list],
+            ["client", "check", "bookkeeping"],
+        )
+
+
+class TestSecondsUntilNextDue(SimpleTestCase):
+    def setUp(self):
+        self.schedule = Schedule(check_interval=5, sync_interval=60)
+        self.schedule._next_sync = time.monotonic() + 60
+
+    @override_settings(QUEUERD_SLEEP_TIME=30)
+    def test_empty(self):
+        self.assertEqual(queuerd.seconds_until_next_due(self.schedule), 30)
+
+    def test_user_due(self):
+        self.schedule.schedule(1, 0.0)
+
+        self.assertEqual(queuerd.seconds_until_next_due(self.schedule), 0)
+
+    @freeze_time("2020-01-01 12:00:00")
+    @override_settings(QUEUERD_SLEEP_TIME=30)
+    def test_user_due_soon(self):
+        self.schedule.schedule(1, time.time() + 2)
+
+        self.assertEqual(queuerd.seconds_until_next_due(self.schedule), 2)
+
+    @freeze_time("2020-01-01 12:00:00")
+    @override_settings(QUEUERD_SLEEP_TIME=1)
+    def test_capped_at_sleep_time(self):
+        self.schedule.schedule(1, time.time() + 2)
+
+        self.assertEqual(queuerd.seconds_until_next_due(self.schedule), 1)
+
+    @override_settings(QUEUERD_SLEEP_TIME=30)
+    def test_capped_at_next_sync(self):
+        self.schedule.request_sync()
+
+        self.assertEqual(queuerd.seconds_until_next_due(self.schedule), 0)
+
+
+class TestGetScheduledUsers(TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.user = User.objects.create(username="test_user")
+        self.schedule = Schedule(check_interval=5)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def make_checked_user(self, username, seconds_ago=10):
+        user = User.objects.create(username=username)
+        UserSocialAuth.objects.create(
+            user=user,
+            provider="spotify",
+            uid=username,
+            extra_data={"access_token": "access", "refresh_token": "refresh"},
+        )
+        LastCheckLog.objects.create(
+            user=user,
+            last_checked=datetime.now(timezone.utc) - timedelta(seconds=seconds_ago),
+        )
+        rule = Rule.objects.create(owner=user, trigger_song_spotify_id="trigger")
+        Rule.objects.create(
+            owner=user, trigger_song_spotify_id="inactive", is_active=False
+        )
+        for n in range(3):
+            SongSequenceMember.objects.create(
+                rule=rule, song_spotify_id=f"song{n}", sequence_number=2 - n
+            )
+        rule.update_cached_song_sequence()
+        return user
+
+    def test_nobody_due(self):
+        self.schedule.schedule(self.user.id, time.time() + 60)
+
+        with self.assertNumQueries(0):
+            with queuerd.get_scheduled_users(self.schedule) as users:
+                self.assertEqual(users, [])
+
+    @freeze_time("2020-01-01 12:00:00")
+    def test_never_checked_user(self):
+        self.schedule.sync()
+
+        with queuerd.get_scheduled_users(self.schedule) as users:
+            self.assertEqual(users, [self.user])
+            self.assertTrue(UserLock.objects.filter(user=self.user).exists())
+            self.assertEqual(
+                LastCheckLog.objects.get(user=self.user).last_checked,
+                datetime.now(timezone.utc),
+            )
+            self.schedule.record_check(self.user.id, time.time())
+
+        self.assertFalse(UserLock.objects.exists())
+        self.assertEqual(self.schedule.get(self.user.id).next_due, time.time() + 5)
+
+    @freeze_time("2020-01-01 12:00:00")
+    def test_deactivated_user(self):
+        self.schedule.sync()
+        # Deactivated after the schedule last heard about them, as when they've asked
+        # for their account to be deleted.
+        User.objects.filter(id=self.user.id).update(is_active=False)
+
+        with queuerd.get_scheduled_users(self.schedule) as users:
+            self.assertEqual(users, [])
+
+        self.assertFalse(UserLock.objects.exists())
+        self.assertEqual(self.schedule.get(self.user.id).next_due, time.time() + 5)
+
+    def test_batch_loaded_in_fixed_queries(self):
+        self.user.delete()
+        for n in range(5):
+            self.make_checked_user(f"user{n}")
+        self.schedule.sync()
+        bookkeeping = Bookkeeping()
+
+        # Users, their rules (which come with their sequences), credentials and the
+        # locks. The locks are inserted in a savepoint, and SQLite can't return their
+        # IDs from the insert so they're read back, but none of it depends on the batch
+        # size.
+        with self.assertNumQueries(7):
+            with queuerd.get_scheduled_users(self.schedule, bookkeeping) as users:
+                self.assertEqual(len(users), 5)
+                for user in users:
+                    user.last_check_log
+                    rule = queuerd.get_matching_rule(user, "trigger")
+                    self.assertEqual(
+                        [song.song_spotify_id for song in rule.get_song_sequence()],
+                        ["song2", "song1", "song0"],
+                    )
+                    self.assertIsNone(queuerd.get_matching_rule(user, "inactive"))
+                    get_spotify_client(user, check_access=False)
+
+        self.assertEqual(bookkeeping.pending, 5)
+
+    @override_settings(QUEUERD_BATCH_SIZE=2)
+    def test_batch_size(self):
+        self.schedule.sync()
+        for n in range(3):
+            self.schedule.schedule(self.make_checked_user(f"user{n}").id, 0.0)
+
+        with queuerd.get_scheduled_users(self.schedule) as users:
+            self.assertEqual(len(users), 2)
+
+    def test_checked_elsewhere(self):
+        self.schedule.sync()
+        checked_at = datetime.now(timezone.utc)
+        LastCheckLog.objects.create(user=self.user, last_checked=checked_at)
+
+        with queuerd.get_scheduled_users(self.schedule) as users:
+            self.assertEqual(users, [])
+
+        self.assertFalse(UserLock.objects.exists())
+        self.assertEqual(
+            self.schedule.get(self.user.id).next_due, checked_at.timestamp() + 5
+        )
+
+    def test_locked_elsewhere(self):
+        self.schedule.sync()
+        UserLock.objects.create(user=self.user)
+
+        with queuerd.get_scheduled_users(self.schedule) as users:
+            self.assertEqual(users, [])
+
+        self.assertIsNotNone(self.schedule.get(self.user.id).next_due)
+
+    def test_unchecked_users_put_back(self):
+        self.schedule.sync()
+
+        with self.assertRaises(ReadTimeout):
+            with queuerd.get_scheduled_users(self.schedule):
+                raise ReadTimeout()
+
+        self.assertFalse(UserLock.objects.exists())
+        self.assertEqual(self.schedule.get(self.user.id).backoff, 0)
+        self.assertIsNotNone(self.schedule.get(self.user.id).next_due)
+
+    @mock.patch("worker.management.commands.queuerd.UserLock")
+    def test_race_condition(self, mock_UserLock):
+        mock_UserLock.objects.bulk_create.side_effect = IntegrityError()
+        mock_UserLock.objects.create.side_effect = IntegrityError()
+        self.schedule.sync()
+
+        with queuerd.get_scheduled_users(self.schedule) as users:
+            self.assertEqual(users, [])
+
+        self.assertIsNotNone(self.schedule.get(self.user.id).next_due)
+
+    def test_race_condition_for_one_user(self):
+        other_user = self.make_checked_user("other_user")
+        self.schedule.sync()
+
+        real_create = UserLock.objects.create
+
+        def create(user):
+            if user == other_user:
+                raise IntegrityError()
+            return real_create(user=user)
+
+        with mock.patch.object(
+            UserLock.objects, "bulk_create", side_effect=IntegrityError()
+        ), mock.patch.object(UserLock.objects, "create", side_effect=create):
+            with queuerd.get_scheduled_users(self.schedule) as users:
+                self.assertEqual(users, [self.user])
+
+        self.assertFalse(UserLock.objects.exists())
+
+
+class TestRunBatch(TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.users = [User.objects.create(username=f"user{n}") for n in range(3)]
+        self.schedule = Schedule(check_interval=5)
+        self.schedule.sync()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    @mock.patch("worker.management.commands.queuerd.get_spotify_client")
+    @mock.patch("worker.management.commands.queuerd.run_for_user")
+    def test_checks_batch(self, mock_run_for_user, mock_get_spotify_client):
+        bookkeeping = Bookkeeping()
+
+        self.assertEqual(queuerd.run_batch(bookkeeping, self.schedule), 3)
+
+        self.assertEqual(len(mock_run_for_user.mock_calls), 3)
+        for user in self.users:
+            self.assertIsNotNone(self.schedule.get(user.id).next_due)
+
+    @mock.patch("worker.management.commands.queuerd.get_spotify_client")
+    @mock.patch("worker.management.commands.queuerd.run_for_user")
+    def test_failed_check_backs_off(self, mock_run_for_user, mock_get_spotify_client):
+        mock_run_for_user.side_effect = [None, SpotifyException(404, -1, "error")]
+        bookkeeping = Bookkeeping()
+        queuerd.metrics.reset()
+
+        with self.assertRaises(SpotifyException):
+            queuerd.run_batch(bookkeeping, self.schedule)
+
+        backoffs = [self.schedule.get(user.id).backoff for user in self.users]
+        self.assertEqual(backoffs, [0, 1, 0])
+        self.assertEqual(queuerd.metrics.counters()["check_errors"], 1)
+        self.assertIsNotNone(self.schedule.get(self.users[2].id).next_due)
+
+        bookkeeping.flush()
+        self.assertFalse(UserLock.objects.exists())
+
+    @mock.patch("worker.management.commands.queuerd.get_spotify_client")
+    @mock.patch("worker.management.commands.queuerd.run_for_user")
+    def test_timed_out_check_backs_off(
+        self, mock_run_for_user, mock_get_spotify_client
+    ):
+        mock_run_for_user.side_effect = [None, DeadlineExceeded(), None]
+        queuerd.metrics.reset()
+
+        self.assertEqual(queuerd.run_batch(Bookkeeping(), self.schedule), 3)
+
+        # The rest of the batch doesn't wait on a slow user.
+        backoffs = [self.schedule.get(user.id).backoff for user in self.users]
+        self.assertEqual(backoffs, [0, 1, 0])
+        self.assertEqual(queuerd.metrics.counters()["check_timeouts"], 1)
+        self.assertEqual(queuerd.metrics.counters()["checks"], 2)
+
+    @override_settings(QUEUERD_CHECK_TIMEOUT=3)
+    @mock.patch("worker.management.commands.queuerd.get_spotify_client")
+    @mock.patch("worker.management.commands.queuerd.run_for_user")
+    def test_check_deadline(self, mock_run_for_user, mock_get_spotify_client):
+        queuerd.run_batch(Bookkeeping(), self.schedule)
+
+        deadline = mock_get_spotify_client.call_args.kwargs["deadline"]
+        self.assertLessEqual(deadline.remaining(), 3)
+        self.assertGreater(deadline.remaining(), 2)
+
+    @mock.patch("worker.management.commands.queuerd.get_spotify_client")
+    @mock.patch("worker.management.commands.queuerd.run_for_user")
+    def test_shed_check(self, mock_run_for_user, mock_get_spotify_client):
+        mock_run_for_user.side_effect = [None, CircuitOpen("spotify"), None]
+        bookkeeping = Bookkeeping()
+        queuerd.metrics.reset()
+
+        self.assertEqual(queuerd.run_batch(bookkeeping, self.schedule), 3)
+
+        # Not the user's fault, but not a check either.
+        shed_user = self.users[1]
+        state = self.schedule.get(shed_user.id)
+        self.assertEqual(state.backoff, 0)
+        self.assertGreater(state.next_due, time.time() + 4)
+        self.assertEqual(queuerd.metrics.counters()["shed_checks"], 1)
+        self.assertEqual(queuerd.metrics.counters()["checks"], 2)
+        bookkeeping.flush()
+        self.assertFalse(LastCheckLog.objects.filter(user=shed_user).exists())
+        self.assertFalse(UserLock.objects.exists())
+
+    @mock.patch("worker.management.commands.queuerd.rule_activity")
+    @mock.patch("worker.management.commands.queuerd.get_spotify_client")
+    @mock.patch("worker.management.commands.queuerd.run_for_user")
+    def test_failed_checks_activity(
+        self, mock_run_for_user, mock_get_spotify_client, mock_rule_activity
+    ):
+        mock_run_for_user.side_effect = [
+            DeadlineExceeded(),
+            CircuitOpen("spotify"),
+            SpotifyException(404, -1, "error"),
+        ]
+
+        with self.assertRaises(SpotifyException):
+            queuerd.run_batch(Bookkeeping(), self.schedule)
+
+        # Every way a check can fail counts against the user.
+        self.assertEqual(
+            mock_rule_activity.record_failed_check.call_args_list,
+            [mock.call(user) for user in self.users],
+        )
+
+    @mock.patch("worker.management.commands.queuerd.get_spotify_client")
+    @mock.patch("worker.management.commands.queuerd.run_for_user")
+    def test_outage_backs_off(self, mock_run_for_user, mock_get_spotify_client):
+        mock_run_for_user.side_effect = [
+            SpotifyException(503, -1, "error"),
+            SpotifyException(429, -1, "error"),
+            None,
+        ]
+        bookkeeping = Bookkeeping()
+        queuerd.metrics.reset()
+
+        # Spotify's trouble isn't worth stopping the daemon for.
+        self.assertEqual(queuerd.run_batch(bookkeeping, self.schedule), 3)
+
+        backoffs = [self.schedule.get(user.id).backoff for user in self.users]
+        self.assertEqual(backoffs, [1, 1, 0])
+        self.assertEqual(queuerd.metrics.counters()["check_errors"], 2)
+
+        bookkeeping.flush()
+        self.assertEqual(LastCheckLog.objects.count(), 1)
+        self.assertFalse(UserLock.objects.exists())
+
+    @mock.patch("worker.management.commands.queuerd.get_spotify_client")
+    @mock.patch("worker.management.commands.queuerd.run_for_user")
+    def test_batch_size(self, mock_run_for_user, mock_get_spotify_client):
+        self.assertEqual(queuerd.run_batch(Bookkeeping(), self.schedule, None, 1), 1)
+
+    def test_no_users(self):
+        self.schedule = Schedule(check_interval=5)
+
+        self.assertEqual(queuerd.run_batch(Bookkeeping(), self.schedule), 0)
+
+
+@mock.patch("worker.management.commands.queuerd.get_spotify_client")
+@mock.patch("worker.management.commands.queuerd.run_for_user")
+class TestCheckUsers(TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.users = [User.objects.create(username=f"user{n}") for n in range(3)]
+        self.schedule = Schedule(check_interval=5)
+        self.schedule.sync()
+        self.bookkeeping = Bookkeeping()
+        self.executor = ThreadPoolExecutor(max_workers=3)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        logging.disable(logging.NOTSET)
+
+    def test_checks_overlap(self, mock_run_for_user, mock_get_spotify_client):
+        # Only gets through if all three checks are waiting on it at once.
+        barrier = threading.Barrier(3, timeout=5)
+        mock_run_for_user.side_effect = lambda user, client, bookkeeping: barrier.wait()
+
+        checked = queuerd.run_batch(self.bookkeeping, self.schedule, self.executor)
+
+        self.bookkeeping.flush()
+        self.assertEqual(checked, 3)
+        self.assertEqual(LastCheckLog.objects.count(), 3)
+        self.assertFalse(UserLock.objects.exists())
+        for user in self.users:
+            self.assertEqual(self.schedule.get(user.id).backoff, 0)
+
+    def test_deadline_exceeded(self, mock_run_for_user, mock_get_spotify_client):
+        mock_run_for_user.side_effect = [None, DeadlineExceeded(), None]
+        queuerd.metrics.reset()
+
+        queuerd.run_batch(self.bookkeeping, self.schedule, self.executor)
 
+        backoffs = sorted(self.schedule.get(user.id).backoff for user in self.users)
+        self.assertEqual(backoffs, [0, 0, 1])
+        self.assertEqual(queuerd.metrics.counters()["check_timeouts"], 1)
+        self.assertNotIn("abandoned_checks", queuerd.metrics.counters())
+
+    @override_settings(QUEUERD_CHECK_TIMEOUT=0.05)
+    @mock.patch("worker.management.commands.queuerd.DEADLINE_GRACE", 0)
+    def test_abandoned(self, mock_run_for_user, mock_get_spotify_client):
+        slow_user = self.users[1]
+        finish = threading.Event()
+
+        def run_for_user(user, client, bookkeeping):
+            if user == slow_user:
+                finish.wait(5)
+
+        mock_run_for_user.side_effect = run_for_user
+        queuerd.metrics.reset()
+
+        queuerd.run_batch(self.bookkeeping, self.schedule, self.executor)
+        self.bookkeeping.flush()
+
+        self.assertEqual(queuerd.metrics.counters()["check_timeouts"], 1)
+        self.assertEqual(queuerd.metrics.counters()["abandoned_checks"], 1)
+        self.assertEqual(queuerd.metrics.counters()["checks"], 2)
+        self.assertEqual(self.schedule.get(slow_user.id).backoff, 1)
+        # They stay locked until their check is done.
+        self.assertEqual(
+            list(UserLock.objects.values_list("user_id", flat=True)), [slow_user.id]
+        )
+
+        finish.set()
+        self.executor.shutdown()
+        self.bookkeeping.flush()
+        self.assertFalse(UserLock.objects.exists())
+
+    @override_settings(QUEUERD_CHECK_TIMEOUT=0.2)
+    @mock.patch("worker.management.commands.queuerd.DEADLINE_GRACE", 0)
+    def test_deadline_starts_on_thread(
+        self, mock_run_for_user, mock_get_spotify_client
+    ):
+        def run_for_user(user, client, bookkeeping):
+            # Most of a check's time, so they'd run out if their time started while
+            # they were waiting for the one thread.
+            time.sleep(0.1)
+
+        mock_run_for_user.side_effect = run_for_user
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        queuerd.metrics.reset()
+
+        queuerd.run_batch(self.bookkeeping, self.schedule, self.executor)
+
+        self.assertEqual(queuerd.metrics.counters()["checks"], 3)
+        self.assertNotIn("check_timeouts", queuerd.metrics.counters())
+
+    @override_settings(QUEUERD_CHECK_TIMEOUT=0.05)
+    @mock.patch("worker.management.commands.queuerd.DEADLINE_GRACE", 0)
+    def test_queued_behind_abandoned(self, mock_run_for_user, mock_get_spotify_client):
+        finish = threading.Event()
+        mock_run_for_user.side_effect = lambda user, client, bookkeeping: finish.wait(5)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        queuerd.metrics.reset()
+
+        queuerd.run_batch(self.bookkeeping, self.schedule, self.executor)
+        self.bookkeeping.flush()
+
+        # Only the first check ever got the thread, and the rest were called off.
+        self.assertEqual(len(mock_run_for_user.mock_calls), 1)
+        self.assertEqual(queuerd.metrics.counters()["abandoned_checks"], 3)
+        self.assertEqual(UserLock.objects.count(), 1)
+
+        finish.set()
+        self.executor.shutdown()
+        self.bookkeeping.flush()
+        self.assertFalse(UserLock.objects.exists())
+
+    def test_shed_check(self, mock_run_for_user, mock_get_spotify_client):
+        mock_run_for_user.side_effect = [None, CircuitOpen("spotify"), None]
+        queuerd.metrics.reset()
+
+        queuerd.run_batch(self.bookkeeping, self.schedule, self.executor)
+
+        self.bookkeeping.flush()
+        self.assertEqual(queuerd.metrics.counters()["shed_checks"], 1)
+        self.assertEqual(LastCheckLog.objects.count(), 2)
+        self.assertFalse(UserLock.objects.exists())
+        for user in self.users:
+            self.assertEqual(self.schedule.get(user.id).backoff, 0)
+
+    def test_failure(self, mock_run_for_user, mock_get_spotify_client):
+        mock_run_for_user.side_effect = [None, SpotifyException(404, -1, "error"), None]
+        queuerd.metrics.reset()
+
+        with self.assertRaises(SpotifyException):
+            with mock.patch(
+                "worker.management.commands.queuerd.rule_activity"
+            ) as mock_rule_activity:
+                queuerd.run_batch(self.bookkeeping, self.schedule, self.executor)
+
+        self.assertEqual(queuerd.metrics.counters()["check_errors"], 1)
+        mock_rule_activity.record_failed_check.assert_called_once_with(self.users[1])
+
+        # The rest of the batch still gets checked.
+        backoffs = sorted(self.schedule.get(user.id).backoff for user in self.users)
+        self.assertEqual(backoffs, [0, 0, 1])
+        self.bookkeeping.flush()
+        self.assertEqual(LastCheckLog.objects.count(), 2)
+        self.assertFalse(UserLock.objects.exists())
+
+    def test_outage(self, mock_run_for_user, mock_get_spotify_client):
+        mock_run_for_user.side_effect = [None, SpotifyException(503, -1, "error"), None]
+        queuerd.metrics.reset()
+
+        queuerd.run_batch(self.bookkeeping, self.schedule, self.executor)
+
+        self.assertEqual(queuerd.metrics.counters()["check_errors"], 1)
+        backoffs = sorted(self.schedule.get(user.id).backoff for user in self.users)
+        self.assertEqual(backoffs, [0, 0, 1])
+        self.bookkeeping.flush()
+        self.assertEqual(LastCheckLog.objects.count(), 2)
+        self.assertFalse(UserLock.objects.exists())
+
+
+@mock.patch("worker.management.commands.queuerd.seconds_until_next_due")
+@mock.patch("worker.management.commands.queuerd.wakeup")
 class TestCommand(TestCase):
     class TestCommandIntentionalException(Exception):
         pass
 
     @mock.patch("worker.management.commands.queuerd.run_one")
-    @mock.patch("worker.management.commands.queuerd.sleep")
-    def test_run_once(self, mock_sleep, mock_run_one):
+    def test_run_once(self, mock_run_one, mock_wakeup, mock_seconds_until_next_due):
         call_command("queuerd", "-o")
 
         mock_run_one.assert_called_once()
-        mock_sleep.assert_not_called()
+        mock_wakeup.wait.assert_not_called()
 
-    @mock.patch("worker.management.commands.queuerd.run_one")
-    @mock.patch("worker.management.commands.queuerd.sleep")
-    def test_run_forever(self, mock_sleep, mock_run_one):
-        mock_sleep.side_effect = [True, TestCommand.TestCommandIntentionalException()]
+    @mock.patch("worker.management.commands.queuerd.run_batch")
+    def test_run_forever(
+        self, mock_run_batch, mock_wakeup, mock_seconds_until_next_due
+    ):
+        mock_run_batch.side_effect = [1, 1, 0]
+        mock_seconds_until_next_due.return_value = 2.5
+        mock_wakeup.wait.side_effect = TestCommand.TestCommandIntentionalException()
 
         with self.assertRaises(TestCommand.TestCommandIntentionalException):
             call_command("queuerd")
 
-        self.assertEqual(len(mock_run_one.mock_calls), 2)
-        mock_sleep.assert_called_with(settings.QUEUERD_SLEEP_TIME)
+        # No waiting around while there are users to check.
+        self.assertEqual(len(mock_run_batch.mock_calls), 3)
+        mock_wakeup.wait.assert_called_once_with(2.5)
+
+    @mock.patch("worker.management.commands.queuerd.run_forever")
+    @mock.patch("worker.management.commands.queuerd.Supervisor")
+    def test_processes(
+        self,
+        mock_Supervisor,
+        mock_run_forever,
+        mock_wakeup,
+        mock_seconds_until_next_due,
+    ):
+        call_command("queuerd", "--processes", "4")
+
+        mock_Supervisor.assert_called_once_with(queuerd.run_worker, 4, queuerd.metrics)
+        mock_Supervisor.return_value.run.assert_called_once()
+        mock_run_forever.assert_not_called()
+
+    @mock.patch("worker.management.commands.queuerd.run_forever")
+    @mock.patch("worker.management.commands.queuerd.Supervisor")
+    def test_one_process(
+        self,
+        mock_Supervisor,
+        mock_run_forever,
+        mock_wakeup,
+        mock_seconds_until_next_due,
+    ):
+        call_command("queuerd", "--processes", "1")
+
+        mock_Supervisor.assert_not_called()
+        mock_run_forever.assert_called_once()
+
+    @mock.patch("worker.management.commands.queuerd.RollupWriter")
+    @mock.patch("worker.management.commands.queuerd.Schedule")
+    @mock.patch("worker.management.commands.queuerd.run_batch")
+    def test_run_worker(
+        self,
+        mock_run_batch,
+        mock_Schedule,
+        mock_RollupWriter,
+        mock_wakeup,
+        mock_seconds_until_next_due,
+    ):
+        mock_run_batch.side_effect = TestCommand.TestCommandIntentionalException()
+
+        with self.assertRaises(TestCommand.TestCommandIntentionalException):
+            queuerd.run_worker(1, 3)
+
+        mock_Schedule.assert_called_once_with(partition=(1, 3))
+        mock_RollupWriter.assert_called_once_with(queuerd.metrics, worker_name((1, 3)))
+
+    @mock.patch("worker.management.commands.queuerd.run_batch")
+    def test_run_forever_woken_early(
+        self, mock_run_batch, mock_wakeup, mock_seconds_until_next_due
+    ):
+        mock_run_batch.side_effect = [
+            0,
+            0,
+            TestCommand.TestCommandIntentionalException(),
+        ]
+        mock_wakeup.wait.return_value = True
+
+        queuerd.metrics.reset()
+        with self.assertRaises(TestCommand.TestCommandIntentionalException):
+            queuerd.run_forever()
+
+        self.assertEqual(queuerd.metrics.counters()["woken_early"], 2)
+
+    @mock.patch("worker.management.commands.queuerd.spotify_breaker")
+    @mock.patch("worker.management.commands.queuerd.run_batch")
+    def test_run_forever_breaker_open(
+        self, mock_run_batch, mock_breaker, mock_wakeup, mock_seconds_until_next_due
+    ):
+        mock_breaker.state.return_value = "open"
+        mock_breaker.seconds_until_probe.side_effect = [30.0, 0.0]
+        mock_run_batch.side_effect = TestCommand.TestCommandIntentionalException()
+        mock_wakeup.wait.return_value = False
+
+        queuerd.metrics.reset()
+        with override_settings(QUEUERD_SLEEP_TIME=5), self.assertRaises(
+            TestCommand.TestCommandIntentionalException
+        ):
+            queuerd.run_forever()
+
+        # Nobody's claimed until it's time for a probe, and then only one user.
+        mock_wakeup.wait.assert_called_once_with(5)
+        mock_run_batch.assert_called_once_with(mock.ANY, mock.ANY, mock.ANY, 1)
+        self.assertEqual(queuerd.metrics.counters()["breaker_pauses"], 1)
+
+    @mock.patch("worker.management.commands.queuerd.Bookkeeping")
+    @mock.patch("worker.management.commands.queuerd.run_batch")
+    def test_run_forever_flushes(
+        self, mock_run_batch, mock_Bookkeeping, mock_wakeup, mock_seconds_until_next_due
+    ):
+        mock_bookkeeping = mock_Bookkeeping.return_value
+        mock_bookkeeping.is_due.side_effect = [False, True, False]
+        mock_run_batch.side_effect = [
+            1,
+            1,
+            0,
+            TestCommand.TestCommandIntentionalException(),
+        ]
+
+        with self.assertRaises(TestCommand.TestCommandIntentionalException):
+            queuerd.run_forever()
+
+        mock_run_batch.assert_called_with(mock_bookkeeping, mock.ANY, mock.ANY, None)
+        # Once when it was due, once before going to sleep, and once more on the way
+        # out.
+        self.assertEqual(len(mock_bookkeeping.flush.mock_calls), 3)
+
+    @mock.patch("worker.management.commands.queuerd.RollupWriter")
+    @mock.patch("worker.management.commands.queuerd.run_batch")
+    def test_run_forever_writes_rollups(
+        self,
+        mock_run_batch,
+        mock_RollupWriter,
+        mock_wakeup,
+        mock_seconds_until_next_due,
+    ):
+        mock_rollups = mock_RollupWriter.return_value
+        mock_rollups.is_due.side_effect = [False, True, False]
+        mock_rollups.write.side_effect = [DatabaseError(), None]
+        mock_run_batch.side_effect = [
+            1,
+            1,
+            1,
+            TestCommand.TestCommandIntentionalException(),
+        ]
+
+        with self.assertLogs("queuerd", logging.ERROR):
+            with self.assertRaises(TestCommand.TestCommandIntentionalException):
+                queuerd.run_forever()
+
+        # Once when it was due, which failed without stopping anything, and once more
+        # on the way out.
+        self.assertEqual(len(mock_rollups.write.mock_calls), 2)
+
+    @mock.patch("worker.management.commands.queuerd.rule_activity")
+    @mock.patch("worker.management.commands.queuerd.run_batch")
+    def test_run_forever_flushes_rule_activity(
+        self,
+        mock_run_batch,
+        mock_rule_activity,
+        mock_wakeup,
+        mock_seconds_until_next_due,
+    ):
+        mock_rule_activity.is_due.side_effect = [False, True, False]
+        mock_rule_activity.flush.side_effect = [DatabaseError(), None]
+        mock_run_batch.side_effect = [
+            1,
+            1,
+            1,
+            TestCommand.TestCommandIntentionalException(),
+        ]
+
+        with self.assertLogs("queuerd", logging.ERROR):
+            with self.assertRaises(TestCommand.TestCommandIntentionalException):
+                queuerd.run_forever()
+
+        # Once when it was due, which failed without stopping anything, and once more
+        # on the way out.
+        self.assertEqual(len(mock_rule_activity.flush.mock_calls), 2)
+
+    @mock.patch("worker.management.commands.queuerd.run_batch")
+    def test_run_forever_should_stop(
+        self, mock_run_batch, mock_wakeup, mock_seconds_until_next_due
+    ):
+        mock_run_batch.return_value = 0
+        should_stop = mock.MagicMock(side_effect=[False, False, False, True])
+
+        queuerd.run_forever(should_stop)
+
+        self.assertEqual(len(mock_run_batch.mock_calls), 2)
+        # No point sleeping once we've been told to stop.
+        self.assertEqual(mock_wakeup.wait.call_count, 1)
+
+    @mock.patch("worker.management.commands.queuerd.Bookkeeping")
+    @mock.patch("worker.management.commands.queuerd.run_batch")
+    def test_sigterm_stops_after_in_flight_check(
+        self, mock_run_batch, mock_Bookkeeping, mock_wakeup, mock_seconds_until_next_due
+    ):
+        mock_run_batch.side_effect = lambda *args: os.kill(os.getpid(), signal.SIGTERM)
+        previous_handler = signal.getsignal(signal.SIGTERM)
+
+        call_command("queuerd")
+
+        mock_run_batch.assert_called_once()
+        mock_wakeup.wait.assert_not_called()
+        mock_Bookkeeping.return_value.flush.assert_called()
+        self.assertEqual(signal.getsignal(signal.SIGTERM), previous_handler)
+
+
+@mock.patch("worker.management.commands.queuerd.wakeup")
+@mock.patch("worker.management.commands.queuerd.get_spotify_client")
+class TestGracefulShutdown(TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.user = User.objects.create(username="test_user")
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def stall(self, signals=1):
+        def get_spotify_client(user, deadline=None):
+            for _ in range(signals):
+                os.kill(os.getpid(), signal.SIGTERM)
+            while True:
+                time.sleep(0.01)
+
+        return get_spotify_client
+
+    @override_settings(QUEUERD_SHUTDOWN_TIMEOUT=0.05)
+    def test_drain_timeout_releases_claims(self, mock_get_spotify_client, mock_wakeup):
+        mock_get_spotify_client.side_effect = self.stall()
+
+        call_command("queuerd")
+
+        self.assertFalse(UserLock.objects.exists())
+        mock_wakeup.wait.assert_not_called()
+
+    @override_settings(QUEUERD_SHUTDOWN_TIMEOUT=60)
+    def test_second_signal_releases_claims(self, mock_get_spotify_client, mock_wakeup):
+        mock_get_spotify_client.side_effect = self.stall(signals=2)
+
+        call_command("queuerd")
+
+        self.assertFalse(UserLock.objects.exists())
+        mock_wakeup.wait.assert_not_called()
+
+    @override_settings(QUEUERD_SHUTDOWN_TIMEOUT=0.05)
+    def test_final_flush_not_interrupted(self, mock_get_spotify_client, mock_wakeup):
+        mock_get_spotify_client.side_effect = self.stall()
+        flush_bookkeeping = queuerd.flush_bookkeeping
+
+        def slow_flush_bookkeeping(bookkeeping):
+            # Told to stop again, and past the deadline, while still flushing.
+            os.kill(os.getpid(), signal.SIGTERM)
+            time.sleep(0.1)
+            flush_bookkeeping(bookkeeping)
+
+        with mock.patch(
+            "worker.management.commands.queuerd.flush_bookkeeping",
+            side_effect=slow_flush_bookkeeping,
+        ):
+            call_command("queuerd")
+
+        self.assertFalse(UserLock.objects.exists())
+
+
+@override_settings(QUEUERD_THREADS=1, QUEUERD_BATCH_SIZE=1)
+class TestSpotifyOutage(TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+        track_ids = benchmark.make_track_ids(1)
+        benchmark.seed_benchmark_data(2, 1, 1, track_ids)
+        self.server = benchmark.FakeSpotifyServer(track_ids, error_rate=1).start()
+
+        # Opens once both users' checks have failed, and no sooner.
+        self.breaker = CircuitBreaker(
+            "spotify",
+            window=4,
+            failure_rate=0.5,
+            slow_call=5,
+            open_time=30,
+            max_open_time=300,
+        )
+        for target in (
+            "data.user_utils.spotify_breaker",
+            "worker.management.commands.queuerd.spotify_breaker",
+        ):
+            patcher = mock.patch(target, self.breaker)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.stop()
+        logging.disable(logging.NOTSET)
+
+    def test_run_forever_survives_outage(self):
+        queuerd.metrics.reset()
+
+        def should_stop():
+            # The first user's check gets a 503, and the second's a 429.
+            errors = queuerd.metrics.counters().get("check_errors", 0)
+            if errors:
+                self.server.error_rate = 0
+                self.server.rate_limit_rate = 1
+            return errors >= 2
+
+        with self.settings(
+            SPOTIFY_API_PREFIX=f"{self.server.url}/v1/",
+            SPOTIFY_TOKEN_URL=f"{self.server.url}/api/token",
+        ):
+            queuerd.run_forever(should_stop=should_stop)
+
+        self.assertGreater(self.server.server_errors, 0)
+        self.assertGreater(self.server.rate_limited, 0)
+        self.assertEqual(self.breaker.state(), OPEN)
+        self.assertFalse(UserLock.objects.exists())
+
+    def test_rate_limited_within_deadline(self):
+        self.server.error_rate = 0
+        self.server.rate_limit_rate = 1
+        self.server.retry_after = 2
+        user = User.objects.filter(
+            username__startswith=benchmark.BENCHMARK_USERNAME_PREFIX
+        ).first()
+
+        started = time.monotonic()
+        with self.settings(SPOTIFY_API_PREFIX=f"{self.server.url}/v1/"):
+            with self.assertRaises(SpotifyException) as context:
+                queuerd.get_spotify_client(
+                    user, check_access=False, deadline=queuerd.Deadline(1)
+                ).currently_playing()
+
+        # Not retried, so there's no waiting around for Retry-After.
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(context.exception.http_status, 429)
+        self.assertEqual(self.server.requests["currently_playing"], 1)
@@ -0,0 +1,208 @@
+import json
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+
+from worker import replay
+from worker.management.commands import queuerd
+from worker.snapshots import Decision, Snapshot
+
+
+def snapshot(checked_at, track_id="foo", progress_ms=0, is_playing=True, decision=None):
+    if decision is None:
+        decision = Decision.NO_RULE if track_id is None else Decision.NOT_APPLIED
+    return Snapshot(
+        checked_at_ms=int(checked_at * 1000),
+        user_id=1,
+        track_id=track_id,
+        progress_ms=None if track_id is None else progress_ms,
+        duration_ms=None if track_id is None else 200000,
+        is_playing=is_playing,
+        decision=decision,
+    )
+
+
+class TestTimelines(SimpleTestCase):
+    def test_synthetic(self):
+        track_ids = ["foo", "bar", "baz"]
+        timelines = replay.synthetic_timelines(
+            3, 12, track_ids, 2, skip_rate=0.5, pause_rate=0.5, seed=0
+        )
+
+        self.assertEqual([timeline.user_id for timeline in timelines], [1, 2, 3])
+        for timeline in timelines:
+            self.assertEqual(len(timeline.trigger_track_ids), 2)
+            self.assertTrue(timeline.segments)
+            for segment, following in zip(timeline.segments, timeline.segments[1:]):
+                self.assertLessEqual(segment.start, segment.end)
+                self.assertLessEqual(segment.end, following.start)
+                self.assertIn(segment.track_id, track_ids)
+
+            # Only plays that got to the end count as finished.
+            last_segments = {
+                segment.play: segment for segment in timeline.segments
+            }.values()
+            finished = {
+                segment.play
+                for segment in last_segments
+                if segment.progress_ms
+                + (segment.end - segment.start) * 1000 * segment.is_playing
+                >= segment.duration_ms - 1
+                and segment.end <= timeline.end
+            }
+            self.assertEqual(timeline.finished, finished)
+            self.assertTrue(0 < len(finished) < timeline.plays)
+
+    def test_synthetic_seeded(self):
+        first, second = (
+            replay.synthetic_timelines(2, 12, ["foo", "bar"], 1, seed=0)
+            for _ in range(2)
+        )
+
+        for timeline, other in zip(first, second):
+            self.assertEqual(timeline.segments, other.segments)
+
+    def test_synthetic_too_few_tracks(self):
+        with self.assertRaises(ValueError):
+            replay.synthetic_timelines(1, 1, ["foo"], 2)
+
+    def test_recorded(self):
+        timelines = replay.recorded_timelines(
+            [
+                snapshot(10, progress_ms=0),
+                snapshot(110, progress_ms=100000, is_playing=False),
+                snapshot(200, progress_ms=100000),
+                # Finished at 300, then the track's started over.
+                snapshot(400, progress_ms=5000),
+                snapshot(405, track_id="bar", decision=Decision.NO_RULE),
+                snapshot(410, track_id=None),
+                snapshot(500, track_id="bar", decision=Decision.NO_RULE),
+            ]
+        )
+
+        self.assertEqual(len(timelines), 1)
+        timeline = timelines[0]
+        self.assertEqual(timeline.user_id, 1)
+        self.assertEqual(timeline.trigger_track_ids, {"foo"})
+        self.assertEqual((timeline.start, timeline.end), (10, 500))
+        self.assertEqual(
+            [
+                (segment.start, segment.end, segment.play)
+                for segment in timeline.segments
+            ],
+            [(10, 110, 0), (110, 200, 0), (200, 300, 0), (400, 405, 1), (405, 410, 2)],
+        )
+        self.assertEqual(timeline.finished, {0})
+
+
+class TestReplay(SimpleTestCase):
+    def timeline(self, *plays, end=None):
+        # Each play is a list of (seconds, is_playing) segments of a 200 second track
+        # with a rule, back to back from the start.
+        timeline = replay.Timeline(1, ["foo"], 0.0, 0.0)
+        now = 0.0
+        for segments in plays:
+            play = timeline.new_play()
+            progress_ms = 0
+            for seconds, is_playing in segments:
+                timeline.add(
+                    now, now + seconds, "foo", 200000, progress_ms, is_playing, play
+                )
+                now += seconds
+                progress_ms += int(seconds * 1000) * is_playing
+            if progress_ms == 200000:
+                timeline.finished.add(play)
+
+        timeline.end = now if end is None else end
+        return timeline
+
+    def test_applied_once_per_play(self):
+        timeline = self.timeline([(200, True)], [(200, True)], [(50, True)])
+
+        report = replay.replay([timeline], 5, sequence_length=3, seed=0)
+
+        self.assertEqual(report["checks"], 90)
+        self.assertEqual(report["trigger_plays"], 3)
+        self.assertEqual(report["finished_trigger_plays"], 2)
+        self.assertEqual(report["applications"], 2)
+        self.assertEqual(report["missed_applications"], 0)
+        self.assertEqual(report["double_applications"], 0)
+        self.assertEqual(report["api_calls"], 2 * 90 + 2 * 3)
+        self.assertEqual(report["user_hours"], 450 / 3600)
+        self.assertAlmostEqual(report["api_calls_per_user_hour"], 186 / (450 / 3600))
+
+    def test_double_application(self):
+        # Paused for longer than the track, so the last_applied guard has run out by
+        # the time it's resumed.
+        timeline = self.timeline([(150, True), (300, False), (50, True)])
+
+        report = replay.replay([timeline], 5, seed=0)
+
+        self.assertEqual(report["applications"], 2)
+        self.assertEqual(report["double_applications"], 1)
+
+    def test_missed_application(self):
+        timeline = self.timeline([(200, True)])
+
+        report = replay.replay([timeline], 5, failure_rate=1.0, seed=0)
+
+        self.assertEqual(report["failed_checks"], report["checks"])
+        # Backed off, so checked less than once every 5 seconds.
+        self.assertLess(report["checks"], 10)
+        self.assertEqual(report["applications"], 0)
+        self.assertEqual(report["missed_applications"], 1)
+
+    def test_nothing_playing(self):
+        timeline = self.timeline(end=100)
+
+        report = replay.replay([timeline], 10, seed=0)
+
+        self.assertEqual(report["checks"], 10)
+        self.assertEqual(report["trigger_plays"], 0)
+        self.assertEqual(report["applications"], 0)
+
+    def test_heuristics(self):
+        timeline = self.timeline([(90, True), (110, False)])
+
+        with replay.heuristics(progress_cutoff=0.4):
+            self.assertEqual(queuerd.TRACK_PROGRESS_CUTOFF, 0.4)
+            report = replay.replay([timeline], 5, seed=0)
+
+        self.assertEqual(report["applications"], 1)
+        self.assertEqual(queuerd.TRACK_PROGRESS_CUTOFF, 0.5)
+        self.assertEqual(replay.replay([timeline], 5, seed=0)["applications"], 0)
+
+
+class TestReplayCommand(SimpleTestCase):
+    def test_synthetic(self):
+        out = StringIO()
+        call_command(
+            "queuerd_replay",
+            "--users=5",
+            "--hours=2",
+            "--check-interval",
+            "5",
+            "10",
+            "--seed=0",
+            "--json",
+            stdout=out,
+        )
+
+        reports = json.loads(out.getvalue())
+        self.assertEqual([report["check_interval"] for report in reports], [5.0, 10.0])
+        self.assertEqual(reports[0]["checks"], 5 * 2 * 60 * 60 / 5)
+        self.assertEqual(reports[0]["users"], 5)
+
+    def test_report(self):
+        out = StringIO()
+        call_command("queuerd_replay", "--users=1", "--hours=1", "--seed=0", stdout=out)
+
+        self.assertIn("calls/user-h", out.getvalue())
+
+    def test_no_snapshots(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(CommandError):
+                call_command("queuerd_replay", f"--snapshot-dir={directory}")
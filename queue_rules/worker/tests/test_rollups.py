@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import TestCase
+
+from data.models import WorkerRollup
+from worker.metrics import Metrics
+from worker.rollups import RollupWriter, worker_name
+
+
+NOW = datetime(2020, 9, 1, 12, 30, 15, tzinfo=timezone.utc)
+MINUTE = datetime(2020, 9, 1, 12, 30, tzinfo=timezone.utc)
+
+
+class TestWorkerName(TestCase):
+    @mock.patch("worker.rollups.socket.gethostname", return_value="host")
+    def test_worker_name(self, mock_gethostname):
+        self.assertEqual(worker_name(), "host")
+        self.assertEqual(worker_name((2, 4)), "host/2")
+
+
+class TestRollupWriter(TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+        self.rollups = RollupWriter(self.metrics, "host", interval=10)
+
+    def test_first_write(self):
+        self.metrics.increment("checks", 5)
+        self.metrics.increment("rules_applied", 2)
+        self.metrics.increment("check_timeouts")
+        # Not rolled up.
+        self.metrics.increment("idle")
+
+        self.rollups.write(backlog=7, now=NOW)
+
+        rollup = WorkerRollup.objects.get()
+        self.assertEqual(rollup.minute, MINUTE)
+        self.assertEqual(rollup.worker, "host")
+        self.assertEqual(
+            (rollup.checks, rollup.rules_applied, rollup.check_timeouts),
+            (5, 2, 1),
+        )
+        self.assertEqual((rollup.check_errors, rollup.shed_checks), (0, 0))
+        self.assertEqual(rollup.backlog, 7)
+
+    def test_same_minute(self):
+        self.metrics.increment("checks", 5)
+        self.rollups.write(backlog=7, now=NOW)
+        self.metrics.increment("checks", 3)
+        # The supervisor collecting our metrics doesn't affect what's rolled up.
+        self.metrics.drain()
+
+        with self.assertNumQueries(1):
+            self.rollups.write(backlog=2, now=NOW + timedelta(seconds=10))
+
+        rollup = WorkerRollup.objects.get()
+        self.assertEqual(rollup.checks, 8)
+        self.assertEqual(rollup.backlog, 2)
+
+    def test_next_minute(self):
+        self.metrics.increment("checks", 5)
+        self.rollups.write(backlog=7, now=NOW)
+        self.metrics.increment("checks", 3)
+
+        self.rollups.write(backlog=2, now=NOW + timedelta(minutes=1))
+
+        self.assertEqual(
+            list(WorkerRollup.objects.order_by("minute").values_list("checks")),
+            [(5,), (3,)],
+        )
+
+    def test_restarted_worker(self):
+        # A previous run of this worker already wrote this minute.
+        WorkerRollup.objects.create(minute=MINUTE, worker="host", checks=4)
+        self.metrics.increment("checks", 5)
+
+        self.rollups.write(backlog=0, now=NOW)
+
+        self.assertEqual(WorkerRollup.objects.get().checks, 9)
+
+    def test_failed_write_retried(self):
+        self.metrics.increment("checks", 5)
+        with mock.patch.object(
+            WorkerRollup.objects, "create", side_effect=DatabaseError()
+        ):
+            with self.assertRaises(DatabaseError):
+                self.rollups.write(backlog=0, now=NOW)
+
+        self.metrics.increment("checks", 3)
+        self.rollups.write(backlog=0, now=NOW)
+
+        self.assertEqual(WorkerRollup.objects.get().checks, 8)
+
+    def test_prunes_old_rollups(self):
+        rollups = RollupWriter(self.metrics, "host", retention=timedelta(days=1))
+        WorkerRollup.objects.create(minute=MINUTE - timedelta(days=2), worker="old")
+        WorkerRollup.objects.create(minute=MINUTE - timedelta(hours=1), worker="new")
+
+        rollups.write(backlog=0, now=NOW)
+
+        self.assertEqual(
+            sorted(WorkerRollup.objects.values_list("worker", flat=True)),
+            ["host", "new"],
+        )
+
+    @mock.patch("worker.rollups.monotonic")
+    def test_is_due(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        rollups = RollupWriter(self.metrics, "host", interval=10)
+        self.assertFalse(rollups.is_due())
+
+        mock_monotonic.return_value = 110.0
+        self.assertTrue(rollups.is_due())
+
+        rollups.write(backlog=0, now=NOW)
+        self.assertFalse(rollups.is_due())
@@ -0,0 +1,214 @@
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+
+from data.models import LastCheckLog
+from worker.schedule import MAX_BACKOFF, Schedule, SYNC_OVERLAP, UserState
+
+
+class TestUserState(SimpleTestCase):
+    def test_slots(self):
+        state = UserState(1, 10.0)
+
+        with self.assertRaises(AttributeError):
+            state.username = "test"
+
+
+class TestSchedule(SimpleTestCase):
+    def setUp(self):
+        self.schedule = Schedule(check_interval=5)
+
+    def test_empty(self):
+        self.assertEqual(len(self.schedule), 0)
+        self.assertIsNone(self.schedule.peek())
+        self.assertIsNone(self.schedule.pop_due(100))
+
+    def test_pop_due_in_order(self):
+        self.schedule.schedule(1, 30.0)
+        self.schedule.schedule(2, 10.0)
+        self.schedule.schedule(3, 20.0)
+
+        self.assertEqual(self.schedule.pop_due(25).user_id, 2)
+        self.assertEqual(self.schedule.pop_due(25).user_id, 3)
+        self.assertIsNone(self.schedule.pop_due(25))
+        self.assertEqual(self.schedule.peek().user_id, 1)
+
+    def test_count_due(self):
+        self.schedule.schedule(1, 30.0)
+        self.schedule.schedule(2, 10.0)
+        self.schedule.schedule(3, 20.0)
+        self.schedule.pop_due(25)
+
+        # User 2's claimed, so no longer due.
+        self.assertEqual(self.schedule.count_due(25), 1)
+        self.assertEqual(self.schedule.count_due(30), 2)
+
+    def test_reschedule(self):
+        self.schedule.schedule(1, 10.0)
+        self.schedule.schedule(2, 20.0)
+        self.schedule.schedule(1, 30.0)
+
+        # The stale entry for user 1 is skipped.
+        self.assertEqual(self.schedule.pop_due(100).user_id, 2)
+        self.assertEqual(self.schedule.pop_due(100).user_id, 1)
+        self.assertIsNone(self.schedule.pop_due(100))
+
+    def test_schedule_same_time_twice(self):
+        self.schedule.schedule(1, 10.0)
+        self.schedule.schedule(1, 10.0)
+
+        self.assertEqual(self.schedule.pop_due(100).user_id, 1)
+        self.assertIsNone(self.schedule.pop_due(100))
+
+    def test_popped_until_rescheduled(self):
+        self.schedule.schedule(1, 10.0)
+        state = self.schedule.pop_due(100)
+
+        self.assertIsNone(state.next_due)
+        self.assertIn(1, self.schedule)
+        self.assertIsNone(self.schedule.pop_due(100))
+
+        self.schedule.record_check(1, 50.0)
+        self.assertEqual(state.next_due, 55.0)
+        self.assertEqual(self.schedule.pop_due(100), state)
+
+    def test_remove(self):
+        self.schedule.schedule(1, 10.0)
+        self.schedule.remove(1)
+
+        self.assertNotIn(1, self.schedule)
+        self.assertIsNone(self.schedule.pop_due(100))
+
+    def test_backoff(self):
+        self.schedule.schedule(1, 0.0)
+
+        self.schedule.record_check(1, 100.0, failed=True)
+        self.assertEqual(self.schedule.get(1).next_due, 110.0)
+        self.schedule.record_check(1, 100.0, failed=True)
+        self.assertEqual(self.schedule.get(1).next_due, 120.0)
+
+        for _ in range(MAX_BACKOFF + 5):
+            self.schedule.record_check(1, 100.0, failed=True)
+        self.assertEqual(self.schedule.get(1).backoff, MAX_BACKOFF)
+        self.assertEqual(self.schedule.get(1).next_due, 100.0 + 5 * 2 ** MAX_BACKOFF)
+
+        self.schedule.record_check(1, 100.0)
+        self.assertEqual(self.schedule.get(1).backoff, 0)
+        self.assertEqual(self.schedule.get(1).next_due, 105.0)
+
+    def test_compacts_stale_entries(self):
+        self.schedule.schedule(1, 0.0)
+        for n in range(1000):
+            self.schedule.schedule(1, float(n))
+
+        self.assertLess(len(self.schedule._heap), 100)
+        self.assertEqual(self.schedule.pop_due(1000).user_id, 1)
+        self.assertIsNone(self.schedule.pop_due(1000))
+
+
+class TestScheduleSync(TestCase):
+    def setUp(self):
+        self.now = datetime.now(timezone.utc)
+        self.checked = User.objects.create(username="checked")
+        self.unchecked = User.objects.create(username="unchecked")
+        LastCheckLog.objects.create(user=self.checked, last_checked=self.now)
+
+        self.schedule = Schedule(check_interval=5)
+
+    def test_first_sync(self):
+        with self.assertNumQueries(1):
+            self.schedule.sync()
+
+        self.assertEqual(len(self.schedule), 2)
+        self.assertEqual(self.schedule.get(self.unchecked.id).next_due, 0.0)
+        self.assertEqual(
+            self.schedule.get(self.checked.id).next_due, self.now.timestamp() + 5
+        )
+
+    def test_incremental_sync(self):
+        self.schedule.sync()
+        new_user = User.objects.create(username="new")
+        LastCheckLog.objects.filter(user=self.checked).update(
+            last_checked=self.now + timedelta(seconds=30)
+        )
+
+        with self.assertNumQueries(2):
+            self.schedule.sync()
+
+        self.assertEqual(self.schedule.get(new_user.id).next_due, 0.0)
+        self.assertEqual(
+            self.schedule.get(self.checked.id).next_due, self.now.timestamp() + 35
+        )
+
+    def test_incremental_sync_reads_only_recent_checks(self):
+        self.schedule.sync()
+        LastCheckLog.objects.filter(user=self.checked).update(
+            last_checked=self.now - SYNC_OVERLAP - timedelta(seconds=30)
+        )
+        self.schedule._synced_at = self.now
+
+        self.schedule.sync()
+
+        # The old check wasn't read, and wouldn't have moved the user earlier anyway.
+        self.assertEqual(
+            self.schedule.get(self.checked.id).next_due, self.now.timestamp() + 5
+        )
+
+    def test_sync_leaves_claimed_users(self):
+        self.schedule.sync()
+        self.assertEqual(self.schedule.pop_due(0.0).user_id, self.unchecked.id)
+        LastCheckLog.objects.create(user=self.unchecked, last_checked=self.now)
+
+        self.schedule.sync()
+
+        self.assertIsNone(self.schedule.get(self.unchecked.id).next_due)
+
+    def test_full_sync(self):
+        self.schedule.sync()
+        self.unchecked.delete()
+
+        self.schedule.sync(full=True)
+
+        self.assertNotIn(self.unchecked.id, self.schedule)
+
+    def test_deactivated_users(self):
+        self.schedule.sync()
+        User.objects.filter(id=self.unchecked.id).update(is_active=False)
+        new_user = User.objects.create(username="new", is_active=False)
+
+        self.schedule.sync()
+        self.assertNotIn(new_user.id, self.schedule)
+
+        self.schedule.sync(full=True)
+        self.assertNotIn(self.unchecked.id, self.schedule)
+
+    def test_partitions(self):
+        for n in range(4):
+            User.objects.create(username=f"user{n}")
+        schedules = [
+            Schedule(check_interval=5, partition=(index, 3)) for index in range(3)
+        ]
+
+        for index, schedule in enumerate(schedules):
+            schedule.sync()
+            self.assertTrue(
+                all(state.user_id % 3 == index for state in schedule.states())
+            )
+
+        user_ids = sorted(state.user_id for s in schedules for state in s.states())
+        self.assertEqual(user_ids, sorted(User.objects.values_list("id", flat=True)))
+
+    def test_partitioned_incremental_sync(self):
+        schedule = Schedule(check_interval=5, partition=(self.checked.id % 2, 2))
+        schedule.sync()
+        LastCheckLog.objects.filter(user=self.checked).update(
+            last_checked=self.now + timedelta(seconds=30)
+        )
+
+        schedule.sync()
+
+        self.assertEqual(
+            schedule.get(self.checked.id).next_due, self.now.timestamp() + 35
+        )
+        self.assertNotIn(self.unchecked.id, schedule)
@@ -0,0 +1,59 @@
+import logging
+import os
+import signal
+
+from django.test import SimpleTestCase
+
+from worker.shutdown import DrainTimeout, GracefulShutdown
+
+
+class TestGracefulShutdown(SimpleTestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_should_stop(self):
+        with GracefulShutdown(60) as shutdown:
+            self.assertFalse(shutdown.should_stop())
+            os.kill(os.getpid(), signal.SIGINT)
+            self.assertTrue(shutdown.should_stop())
+
+    def test_should_stop_disarms_deadline(self):
+        with GracefulShutdown(60) as shutdown:
+            os.kill(os.getpid(), signal.SIGTERM)
+            self.assertGreater(signal.getitimer(signal.ITIMER_REAL)[0], 0)
+
+            shutdown.should_stop()
+            self.assertEqual(signal.getitimer(signal.ITIMER_REAL)[0], 0)
+
+    def test_second_signal(self):
+        with GracefulShutdown(60):
+            os.kill(os.getpid(), signal.SIGTERM)
+            with self.assertRaises(DrainTimeout):
+                os.kill(os.getpid(), signal.SIGTERM)
+
+    def test_shielded(self):
+        with GracefulShutdown(0.01) as shutdown:
+            os.kill(os.getpid(), signal.SIGTERM)
+
+            with shutdown.shielded():
+                self.assertEqual(signal.getitimer(signal.ITIMER_REAL)[0], 0)
+                # Neither another signal nor the deadline gets in the way.
+                os.kill(os.getpid(), signal.SIGTERM)
+                os.kill(os.getpid(), signal.SIGALRM)
+
+            self.assertTrue(shutdown.should_stop())
+
+    def test_restores_handlers(self):
+        def handler(signum, frame):
+            pass
+
+        previous_handler = signal.signal(signal.SIGTERM, handler)
+        try:
+            with GracefulShutdown(60):
+                self.assertNotEqual(signal.getsignal(signal.SIGTERM), handler)
+            self.assertEqual(signal.getsignal(signal.SIGTERM), handler)
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
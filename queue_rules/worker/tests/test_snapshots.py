@@ -0,0 +1,186 @@
+import logging
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.test import override_settings, SimpleTestCase
+
+from worker.snapshots import (
+    Decision,
+    list_segments,
+    read_snapshots,
+    Snapshot,
+    SnapshotLog,
+    SnapshotSegment,
+)
+
+
+def playback(track_id="4uLU6hMCjMI75M1A2tKUQC", progress_ms=1000, is_playing=True):
+    return {
+        "is_playing": is_playing,
+        "progress_ms": progress_ms,
+        "item": {"id": track_id, "duration_ms": 200000},
+    }
+
+
+@mock.patch("worker.snapshots.time", return_value=1600000000.0)
+class TestSnapshotLog(SimpleTestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.log = SnapshotLog(self.directory.name, segment_rows=8)
+        self.addCleanup(self.log.close)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_round_trip(self, mock_time):
+        self.log.record(1, playback(), Decision.APPLIED)
+        self.log.record(2, None, Decision.NOTHING_PLAYING)
+        self.log.record(3, playback(track_id=None, progress_ms=None), Decision.NO_RULE)
+        self.log.flush()
+
+        self.assertEqual(
+            list(read_snapshots(self.directory.name)),
+            [
+                Snapshot(
+                    checked_at_ms=1600000000000,
+                    user_id=1,
+                    track_id="4uLU6hMCjMI75M1A2tKUQC",
+                    progress_ms=1000,
+                    duration_ms=200000,
+                    is_playing=True,
+                    decision=Decision.APPLIED,
+                ),
+                Snapshot(
+                    checked_at_ms=1600000000000,
+                    user_id=2,
+                    track_id=None,
+                    progress_ms=None,
+                    duration_ms=None,
+                    is_playing=False,
+                    decision=Decision.NOTHING_PLAYING,
+                ),
+                Snapshot(
+                    checked_at_ms=1600000000000,
+                    user_id=3,
+                    track_id=None,
+                    progress_ms=None,
+                    duration_ms=200000,
+                    is_playing=True,
+                    decision=Decision.NO_RULE,
+                ),
+            ],
+        )
+
+    def test_buffered_until_flush(self, mock_time):
+        self.log.record(1, playback(), Decision.APPLIED)
+
+        self.assertEqual(list(read_snapshots(self.directory.name)), [])
+
+    @mock.patch("worker.snapshots.MAX_BUFFERED", 2)
+    def test_written_when_buffer_full(self, mock_time):
+        self.log.record(1, playback(), Decision.APPLIED)
+        self.log.record(2, playback(), Decision.APPLIED)
+
+        self.assertEqual(len(list(read_snapshots(self.directory.name))), 2)
+
+    def test_appends_to_segment(self, mock_time):
+        self.log.record(1, playback(), Decision.APPLIED)
+        self.log.flush()
+        self.log.record(2, playback(), Decision.NOT_APPLIED)
+        self.log.flush()
+
+        segments = list_segments(self.directory.name)
+        self.assertEqual(len(segments), 1)
+        with SnapshotSegment(segments[0]) as segment:
+            self.assertEqual(len(segment), 2)
+            self.assertEqual(segment.capacity, 8)
+
+    def test_new_segment_when_full(self, mock_time):
+        for user_id in range(20):
+            self.log.record(user_id, playback(), Decision.NOT_APPLIED)
+        self.log.flush()
+
+        segments = list_segments(self.directory.name)
+        self.assertEqual(len(segments), 3)
+        user_ids = [
+            snapshot.user_id for snapshot in read_snapshots(self.directory.name)
+        ]
+        self.assertEqual(user_ids, list(range(20)))
+
+    def test_columns(self, mock_time):
+        for progress_ms in [1000, 2000, 3000]:
+            self.log.record(1, playback(progress_ms=progress_ms), Decision.NOT_APPLIED)
+        self.log.flush()
+
+        with SnapshotSegment(list_segments(self.directory.name)[0]) as segment:
+            progress = segment.column("progress_ms")
+            self.assertEqual(progress.tolist(), [1000, 2000, 3000])
+            progress.release()
+
+            track_ids = segment.column("track_id")
+            self.assertEqual(bytes(track_ids[:22]), b"4uLU6hMCjMI75M1A2tKUQC")
+            self.assertEqual(len(track_ids), 3 * 22)
+            track_ids.release()
+
+    def test_unwritten_rows_ignored(self, mock_time):
+        self.log.record(1, playback(), Decision.APPLIED)
+        self.log.flush()
+
+        # Rows aren't counted until they've been written in full.
+        self.assertEqual(
+            os.path.getsize(list_segments(self.directory.name)[0]), 64 + 8 * 48
+        )
+        self.assertEqual(len(list(read_snapshots(self.directory.name))), 1)
+
+    def test_not_a_segment(self, mock_time):
+        path = Path(self.directory.name) / "junk.snap"
+        path.write_bytes(b"\0" * 64)
+
+        with self.assertRaises(ValueError):
+            SnapshotSegment(path)
+
+    def test_disabled(self, mock_time):
+        with override_settings(QUEUERD_SNAPSHOT_DIR=None):
+            log = SnapshotLog()
+            log.record(1, playback(), Decision.APPLIED)
+            log.flush()
+
+        self.assertFalse(log.enabled)
+        self.assertEqual(log._buffered, 0)
+
+    def test_directory_from_settings(self, mock_time):
+        directory = Path(self.directory.name) / "snapshots"
+        with override_settings(QUEUERD_SNAPSHOT_DIR=str(directory)):
+            log = SnapshotLog(segment_rows=8)
+            log.record(1, playback(), Decision.APPLIED)
+            log.close()
+
+        self.assertEqual(len(list(read_snapshots(directory))), 1)
+
+    def test_reset(self, mock_time):
+        self.log.record(1, playback(), Decision.APPLIED)
+        self.log.flush()
+
+        # As in a forked worker.
+        self.log.reset()
+        self.log.record(2, playback(), Decision.APPLIED)
+        self.log.flush()
+
+        self.assertEqual(len(list_segments(self.directory.name)), 2)
+
+    def test_write_error_dropped(self, mock_time):
+        self.log.record(1, playback(), Decision.APPLIED)
+
+        with mock.patch("worker.snapshots.os.pwrite", side_effect=OSError()):
+            self.log.flush()
+
+        self.log.record(2, playback(), Decision.APPLIED)
+        self.log.flush()
+        user_ids = [
+            snapshot.user_id for snapshot in read_snapshots(self.directory.name)
+        ]
+        self.assertEqual(user_ids, [2])
@@ -0,0 +1,76 @@
+import logging
+import os
+import signal
+import time
+
+from django.test import SimpleTestCase
+
+from worker.metrics import Metrics
+from worker.shutdown import GracefulShutdown
+from worker.supervisor import Supervisor
+
+
+# Workers are forked, so these share the test's metrics only through the supervisor.
+test_metrics = Metrics()
+
+
+def run_until_stopped(index, count):
+    test_metrics.increment(f"worker_{index}_of_{count}")
+    with GracefulShutdown(60) as shutdown:
+        while not shutdown.should_stop():
+            time.sleep(0.01)
+
+
+def crash(index, count):
+    os._exit(1)
+
+
+def ignore_sigterm(index, count):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    test_metrics.increment("ready")
+    while True:
+        time.sleep(0.01)
+
+
+class TestSupervisor(SimpleTestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        test_metrics.reset()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def run_until(self, supervisor, condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        supervisor.run(should_stop=lambda: condition() or time.monotonic() > deadline)
+        self.assertTrue(condition())
+
+    def test_partitions_and_metrics(self):
+        supervisor = Supervisor(
+            run_until_stopped, 2, test_metrics, shutdown_timeout=5, report_interval=0.01
+        )
+
+        self.run_until(supervisor, lambda: len(test_metrics.counters()) == 2)
+
+        self.assertEqual(
+            test_metrics.counters(), {"worker_0_of_2": 1, "worker_1_of_2": 1}
+        )
+
+    def test_restarts_crashed_workers(self):
+        supervisor = Supervisor(
+            crash, 2, test_metrics, shutdown_timeout=5, restart_delay=0.01
+        )
+
+        self.run_until(
+            supervisor, lambda: test_metrics.counters().get("worker_restarts", 0) >= 4
+        )
+
+    def test_kills_stuck_workers(self):
+        supervisor = Supervisor(
+            ignore_sigterm, 2, test_metrics, shutdown_timeout=0, report_interval=0.01
+        )
+
+        self.run_until(supervisor, lambda: test_metrics.counters().get("ready") == 2)
+
+        self.assertEqual(test_metrics.counters()["worker_kills"], 2)
+        self.assertNotIn("worker_restarts", test_metrics.counters())
@@ -0,0 +1,57 @@
+import os
+from time import monotonic
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+
+from worker.wakeup import Wakeup, wakeup
+
+
+class TestWakeup(SimpleTestCase):
+    def test_timeout(self):
+        started = monotonic()
+
+        self.assertFalse(Wakeup().wait(0.01))
+        self.assertGreaterEqual(monotonic() - started, 0.01)
+
+    def test_interrupt(self):
+        waker = Wakeup()
+        waker.interrupt()
+
+        self.assertTrue(waker.wait(60))
+        # Wakeups don't carry over to the next wait.
+        self.assertFalse(waker.wait(0))
+
+    def test_notify(self):
+        waker = Wakeup()
+        waker.wait(0)
+        waker.notify()
+
+        self.assertTrue(waker.wait(60))
+
+    def test_notify_without_pipe(self):
+        waker = Wakeup()
+        waker.notify()
+
+        # Processes that never wait, like the web app's, don't open one.
+        self.assertIsNone(waker._read_fd)
+
+    def test_forked(self):
+        waker = Wakeup()
+        waker.interrupt()
+
+        with mock.patch("worker.wakeup.os.getpid", return_value=os.getpid() + 1):
+            # A forked process has a pipe of its own.
+            self.assertFalse(waker.wait(0))
+
+
+@mock.patch("worker.wakeup.transaction.on_commit")
+class TestReceivers(TestCase):
+    def test_new_user(self, mock_on_commit):
+        user = User.objects.create(username="test_user")
+        mock_on_commit.assert_called_once_with(wakeup.notify)
+
+        mock_on_commit.reset_mock()
+        user.save()
+        mock_on_commit.assert_not_called()
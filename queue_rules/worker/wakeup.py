@@ -0,0 +1,112 @@
+import os
+import select
+from typing import Tuple
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+
+CHANNEL = "queuerd_wakeup"
+
+
+class Wakeup:
+    """
+    Lets queuerd sleep until its next user is due, while anything that might give it
+    work sooner wakes it up early.
+
+    Within a process this goes through a pipe, so signal handlers can use it too.
+    Across processes, such as the web app telling queuerd about a new user, it uses
+    PostgreSQL's LISTEN/NOTIFY when that's the database in use. On other databases
+    queuerd only finds out once its sleep runs out.
+
+    The pipe is opened by the first wait or interrupt in each process, so the web app
+    never has one, and each of queuerd's worker processes has its own rather than
+    waking the others through their parent's.
+    """
+
+    def __init__(self):
+        self._pid = None
+        self._read_fd = self._write_fd = None
+        self._listening_on = None
+
+    def _pipe(self) -> Tuple[int, int]:
+        if self._pid != os.getpid():
+            if self._pid is not None:  # Our copy of the parent's, from a fork.
+                os.close(self._read_fd)
+                os.close(self._write_fd)
+
+            self._read_fd, self._write_fd = os.pipe()
+            os.set_blocking(self._read_fd, False)
+            os.set_blocking(self._write_fd, False)
+            self._pid = os.getpid()
+            self._listening_on = None
+
+        return self._read_fd, self._write_fd
+
+    def notify(self) -> None:
+        # Only a process that's waiting has anything to interrupt.
+        if self._pid == os.getpid():
+            self.interrupt()
+
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(f"NOTIFY {CHANNEL}")
+
+    def interrupt(self) -> None:
+        _, write_fd = self._pipe()
+        try:
+            os.write(write_fd, b"\0")
+        except BlockingIOError:  # The pipe is full, so a wakeup is already pending.
+            pass
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Sleep for up to timeout seconds, returning whether we were woken up early.
+        """
+        read_fd, _ = self._pipe()
+        listener = self._listen()
+        if listener is not None and listener.notifies:
+            # These arrived while we were running other queries.
+            listener.notifies.clear()
+            return True
+
+        fds = [read_fd] if listener is None else [read_fd, listener]
+        ready, _, _ = select.select(fds, [], [], max(timeout, 0))
+
+        try:
+            while os.read(read_fd, 1024):
+                pass
+        except BlockingIOError:
+            pass
+
+        if listener is not None:
+            listener.poll()
+            listener.notifies.clear()
+
+        return bool(ready)
+
+    def _listen(self):
+        if connection.vendor != "postgresql":
+            return None
+
+        # LISTEN only lasts as long as the connection, so listen again whenever Django
+        # has had to reconnect.
+        connection.ensure_connection()
+        if connection.connection is not self._listening_on:
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            self._listening_on = connection.connection
+
+        return connection.connection
+
+
+wakeup = Wakeup()
+
+
+@receiver(post_save, sender=User)
+def wake_for_new_user(sender, instance, created, **kwargs):
+    # New users are due for a check straight away.
+    if created:
+        transaction.on_commit(wakeup.notify)